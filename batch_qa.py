@@ -0,0 +1,208 @@
+"""
+Batch question answering over the RAG graph.
+
+Instead of one `app.invoke` per question, the batch is answered in stages:
+    1. resolve each question's challenge name locally (pre-router), where possible
+    2. embed every question in a single batched call
+    3. one exact per-challenge search, carrying all of that challenge's embeddings, fused per question
+       with BM25 over the same challenge as `retrieve` does (RETRIEVAL_MODE)
+    4. generate + grade on a bounded thread pool, through a graph that starts at `generate`
+Questions whose challenge cannot be resolved locally go through the full graph instead.
+
+Input is either JSONL ({"question": ..., "challenge_name": optional}) or one question per line.
+Output is JSONL in input order.
+
+Usage:
+    python batch_qa.py questions.jsonl --output answers.jsonl --workers 4
+"""
+import json
+import time
+import logging
+import argparse
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Tuple
+from langchain.schema import Document
+from langgraph.graph import START, END, StateGraph
+from utils.tools import generate, grade_generation, decide, web_search
+from utils.vectorstore import warm_up, get_embeddings
+from utils.challenge_index import get_challenge_index
+from utils.hybrid import fuse_keyword_hits, RETRIEVAL_MODE, FETCH_K
+from utils.prerouter import get_prerouter, record
+from main import GraphState, app, answer_cache, is_cacheable
+from utils.tracing import tracer
+from dotenv import load_dotenv
+
+load_dotenv()
+
+TOP_K = 8
+WORKERS = 4
+
+# Same generate/grade loop as main.app, for questions whose documents were retrieved in bulk
+answer_workflow = StateGraph(GraphState)
+answer_workflow.add_node("web_search", tracer.node("web_search", web_search))
+answer_workflow.add_node("generate", tracer.node("generate", generate))
+answer_workflow.add_node("grade", tracer.node("grade", grade_generation))
+answer_workflow.add_edge(START, "generate")
+answer_workflow.add_edge("web_search", "generate")
+answer_workflow.add_edge("generate", "grade")
+answer_workflow.add_conditional_edges(
+    "grade",
+    tracer.edge("decide", decide),
+    {
+        "not_supported": "generate",
+        "useful": END,
+        "not_useful": "web_search",
+        "over_budget": END
+    }
+)
+answer_app = answer_workflow.compile()
+
+def load_questions(path: str) -> List[Dict[str, str]]:
+    """
+    Args:
+        path (str): JSONL file of {"question", "challenge_name"?} objects, or plain text with one question per line
+
+    Returns:
+        list: {"question": str, "challenge_name": str} per non-empty line
+    """
+    rows = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            if line.startswith("{"):
+                row = json.loads(line)
+                rows.append({"question": row["question"], "challenge_name": (row.get("challenge_name") or "").lower()})
+            else:
+                rows.append({"question": line, "challenge_name": ""})
+    return rows
+
+def resolve_challenges(rows: List[Dict[str, str]]):
+    """Fill in challenge names the pre-router is confident about; the rest stay empty."""
+    prerouter = get_prerouter()
+    for row in rows:
+        if row["challenge_name"]:
+            continue
+        name, confidence = prerouter.match_challenge(row["question"])
+        if name and confidence >= prerouter.threshold:
+            record("name_fast")
+            row["challenge_name"] = name
+
+def retrieve_grouped(rows: List[Dict[str, str]], vectors: List[List[float]], k: int = TOP_K) -> List[List[Document]]:
+    """
+    One search of the challenge's own chunks per challenge, with the embeddings of all its questions.
+    In hybrid mode each question's hits are then fused with its BM25 hits in the same challenge,
+    so a batch retrieves the same documents as `hybrid_search` for that question.
+
+    Returns:
+        list: Retrieved documents per row, aligned with `rows`
+    """
+    groups = defaultdict(list)
+    for i, row in enumerate(rows):
+        groups[row["challenge_name"]].append(i)
+
+    hybrid = RETRIEVAL_MODE == "hybrid"
+    challenge_index = get_challenge_index()
+    documents: List[List[Document]] = [[] for _ in rows]
+    for challenge_name, indices in groups.items():
+        results = challenge_index.search([vectors[i] for i in indices], challenge_name, FETCH_K if hybrid else k)
+        ids = challenge_index.ids_for(challenge_name) if hybrid else []
+        for i, hits in zip(indices, results):
+            vector_hits = [doc for doc, _ in hits]
+            documents[i] = fuse_keyword_hits(rows[i]["question"], vector_hits, k, ids=ids) if hybrid else vector_hits
+    return documents
+
+def answer(inputs: GraphState, full_graph: bool) -> Dict:
+    started = time.perf_counter()
+    key = inputs["challenge_name"]
+    try:
+        final_state = answer_cache.lookup(inputs["question"], key) if key else None
+        cached = final_state is not None
+        if not cached:
+            with tracer.question(inputs["question"]) as trace:
+                final_state = (app if full_graph else answer_app).invoke(inputs)
+            if key and is_cacheable(final_state):
+                answer_cache.store(inputs["question"], key, final_state)
+        return {
+            "question": inputs["question"],
+            "challenge_name": final_state.get("challenge_name") or key,
+            "generation": final_state.get("generation") or "",
+            "generate_count": final_state.get("generate_count", 0),
+            "stop_reason": final_state.get("stop_reason", ""),
+            "sources": sorted({d.metadata.get("basename") or d.metadata.get("source", "") for d in final_state.get("documents") or []}),
+            "cached": cached,
+            "trace_id": None if cached else trace.trace_id,
+            "seconds": round(time.perf_counter() - started, 3),
+        }
+    except Exception as e:
+        logging.exception(f"---BATCH: FAILED ON {inputs['question']!r}---")
+        return {"question": inputs["question"], "challenge_name": key, "error": str(e), "seconds": round(time.perf_counter() - started, 3)}
+
+def run_batch(rows: List[Dict[str, str]], workers: int = WORKERS, k: int = TOP_K) -> Tuple[List[Dict], Dict[str, Tuple[int, float]]]:
+    """
+    Answer every row of the batch.
+
+    Returns:
+        tuple: (one result dict per row, in order; stage name -> (items, seconds))
+    """
+    stages = {}
+
+    started = time.perf_counter()
+    resolve_challenges(rows)
+    resolved = [i for i, row in enumerate(rows) if row["challenge_name"]]
+    stages["resolve"] = (len(rows), time.perf_counter() - started)
+
+    started = time.perf_counter()
+    vectors = get_embeddings().embed_documents([rows[i]["question"] for i in resolved]) if resolved else []
+    stages["embed"] = (len(resolved), time.perf_counter() - started)
+
+    started = time.perf_counter()
+    documents = retrieve_grouped([rows[i] for i in resolved], vectors, k) if resolved else []
+    stages["retrieve"] = (len(resolved), time.perf_counter() - started)
+
+    inputs = []
+    for row in rows:
+        inputs.append(({
+            "question": row["question"],
+            "challenge_name": row["challenge_name"],
+            "generation": "",
+            "documents": [],
+            "generate_count": 0,
+        }, not row["challenge_name"]))
+    for i, docs in zip(resolved, documents):
+        inputs[i][0]["documents"] = docs
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        results = list(pool.map(lambda item: answer(*item), inputs))
+    stages["generate+grade"] = (len(rows), time.perf_counter() - started)
+
+    return results, stages
+
+def print_report(stages, total: float):
+    print(f"{'stage':<16}{'items':>8}{'seconds':>10}{'items/s':>10}")
+    for stage, (items, seconds) in stages.items():
+        print(f"{stage:<16}{items:>8}{seconds:>10.2f}{items / seconds if seconds else 0:>10.1f}")
+    print(f"{'total':<16}{'':>8}{total:>10.2f}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Answer a file of questions through the RAG graph.")
+    parser.add_argument("questions", help="JSONL of {question, challenge_name?} or one question per line")
+    parser.add_argument("--output", default="rag_response/batch.jsonl")
+    parser.add_argument("--workers", type=int, default=WORKERS, help="Questions generated/graded at once")
+    parser.add_argument("--k", type=int, default=TOP_K, help="Documents retrieved per question")
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    warm_up()
+    rows = load_questions(args.questions)
+    results, stages = run_batch(rows, args.workers, args.k)
+    with open(args.output, "w", encoding="utf-8") as f:
+        for result in results:
+            f.write(json.dumps(result, ensure_ascii=False) + "\n")
+
+    failed = sum(1 for r in results if "error" in r)
+    print(f"{len(results)} answers written to {args.output} ({failed} failed)")
+    print_report(stages, time.perf_counter() - started)
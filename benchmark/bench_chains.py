@@ -0,0 +1,83 @@
+"""
+Micro-benchmark of per-node chain overhead: rebuilding prompts/chains on every call
+(the old behaviour of the graph nodes) vs reusing the registry in utils/chains.py.
+
+The LLM is replaced with a canned fake so only LangChain object construction and
+invocation are measured.
+
+Usage:
+    python -m benchmark.bench_chains --iterations 2000
+"""
+import time
+import argparse
+from langchain_core.language_models.fake_chat_models import FakeListChatModel
+from langchain_core.output_parsers import StrOutputParser, JsonOutputParser
+from langchain.prompts import PromptTemplate, ChatPromptTemplate, SystemMessagePromptTemplate, HumanMessagePromptTemplate
+from utils.chains import build_chains, router_prompt, challenge_name_prompt, rag_prompt, hallucination_prompt, answer_prompt
+
+NODES = {
+    # node -> (chains it uses, inputs, canned LLM response)
+    "route_question": (["question_router"], {"question": "How to solve fluffy?"}, '{"datasource": "vectorstore"}'),
+    "retrieve": (["challenge_name_extractor"], {"question": "How to solve fluffy?"}, "fluffy"),
+    "generate": (["rag_chain"], {"context": "ctx " * 200, "question": "How to solve fluffy?"}, "step 1 ..."),
+    "grade": (
+        ["hallucination_grader", "answer_grader"],
+        {"documents": "ctx " * 200, "generation": "step 1 ...", "question": "How to solve fluffy?"},
+        '{"score": "yes"}',
+    ),
+}
+
+def _rebuild_chat(prompt: ChatPromptTemplate) -> ChatPromptTemplate:
+    return ChatPromptTemplate.from_messages(
+        [
+            SystemMessagePromptTemplate.from_template(prompt.messages[0].prompt.template),
+            HumanMessagePromptTemplate.from_template(prompt.messages[1].prompt.template),
+        ]
+    )
+
+def build_per_call(name: str, llm):
+    """Reproduces what the nodes used to do on every call."""
+    if name == "question_router":
+        return _rebuild_chat(router_prompt) | llm | JsonOutputParser()
+    if name == "challenge_name_extractor":
+        return _rebuild_chat(challenge_name_prompt) | llm | StrOutputParser()
+    if name == "rag_chain":
+        return _rebuild_chat(rag_prompt) | llm | StrOutputParser()
+    prompt = hallucination_prompt if name == "hallucination_grader" else answer_prompt
+    return PromptTemplate(template=prompt.template, input_variables=prompt.input_variables) | llm | JsonOutputParser()
+
+def bench(iterations: int):
+    rows = []
+    for node, (names, inputs, response) in NODES.items():
+        llm = FakeListChatModel(responses=[response])
+        registry = build_chains(llm)
+
+        start = time.perf_counter()
+        for _ in range(iterations):
+            for name in names:
+                build_per_call(name, llm)
+        build_only = (time.perf_counter() - start) / iterations
+
+        start = time.perf_counter()
+        for _ in range(iterations):
+            for name in names:
+                build_per_call(name, llm).invoke(inputs)
+        before = (time.perf_counter() - start) / iterations
+
+        start = time.perf_counter()
+        for _ in range(iterations):
+            for name in names:
+                registry[name].invoke(inputs)
+        after = (time.perf_counter() - start) / iterations
+
+        rows.append((node, build_only, before, after))
+
+    print(f"{'node':<16}{'build (us)':>12}{'before (us)':>14}{'after (us)':>13}{'saved':>8}")
+    for node, build_only, before, after in rows:
+        print(f"{node:<16}{build_only * 1e6:>12.1f}{before * 1e6:>14.1f}{after * 1e6:>13.1f}{1 - after / before:>8.1%}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Per-node chain construction overhead, before vs after the registry.")
+    parser.add_argument("--iterations", type=int, default=1000)
+    args = parser.parse_args()
+    bench(args.iterations)
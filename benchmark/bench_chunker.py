@@ -0,0 +1,126 @@
+"""
+The Markdown chunker (utils/markdown_chunker.py) against the splitter ingest used before it
+(recursive character splitting measured in tokens, as `from_tiktoken_encoder(1000, 200)`),
+over the data/*.md writeups.
+
+Reported per splitter:
+    split       chunks/s over the corpus replicated --copies times (the Markdown chunker both
+                in-process and across its process pool), chunks, mean tokens per chunk, and
+                chunks that cut a fenced code block (an odd number of ``` lines)
+    recall      recall@k of benchmark/questions.jsonl, vector-only and hybrid, each splitter's
+                chunks ingested into their own throwaway collection through benchmark/fake_ollama.py
+
+Usage:
+    python -m benchmark.bench_chunker --copies 50
+    python -m benchmark.bench_chunker --chunk-size 500 --chunk-overlap 100 --output chunker.json
+"""
+import os
+import json
+import time
+import asyncio
+import argparse
+import tempfile
+from pathlib import Path
+from statistics import mean
+
+from benchmark.run_benchmarks import DATA_DIR, QUESTIONS_PATH, load_corpus, load_questions, make_splitter
+
+def cut_fences(chunks) -> int:
+    return sum(1 for c in chunks if sum(line.lstrip().startswith(("```", "~~~")) for line in c.page_content.split("\n")) % 2)
+
+def bench_split(splitter, docs, copies: int):
+    from langchain.schema import Document
+    from utils.context import count_tokens
+
+    corpus = [
+        Document(page_content=d.page_content, metadata={**d.metadata, "source": f"{d.metadata['source']}#{i}"})
+        for i in range(copies) for d in docs
+    ]
+    started = time.perf_counter()
+    chunks = splitter.split_documents(corpus)
+    seconds = time.perf_counter() - started
+    # Quality is measured on one copy of the corpus
+    single = [c for c in chunks if c.metadata["source"].endswith("#0")]
+    return {
+        "documents": len(corpus),
+        "chunks": len(chunks),
+        "seconds": round(seconds, 3),
+        "chunks_per_sec": round(len(chunks) / seconds, 1) if seconds else 0.0,
+        "mean_tokens": round(mean(count_tokens(c.page_content) for c in single), 1) if single else 0.0,
+        "cut_code_blocks": cut_fences(single),
+    }
+
+def bench_recall_for(name: str, splitter, docs, questions, workdir: str):
+    from utils.vectorstore import get_vectorstore
+    from utils.keyword_index import KeywordIndex, keyword_index_path
+    from utils.ingest_manifest import IngestManifest, aindex_incrementally
+    from benchmark.run_benchmarks import bench_recall
+
+    vectorstore = get_vectorstore(f"chunker_{name}_{os.getpid()}")
+    try:
+        asyncio.run(aindex_incrementally(
+            vectorstore, docs, splitter, IngestManifest(os.path.join(workdir, f"manifest_{name}.json")),
+            source_key="source",
+        ))
+        keyword_index = KeywordIndex(keyword_index_path(vectorstore))
+        results = {}
+        for mode in ("vector", "hybrid"):
+            recall = bench_recall(vectorstore, questions, mode, keyword_index=keyword_index)
+            results[mode] = {key: value for key, value in recall.items() if key != "per_question"}
+        return results
+    finally:
+        vectorstore.drop()
+
+def main():
+    parser = argparse.ArgumentParser(description="Markdown chunker versus the former token splitter: speed, code-block cuts, recall.")
+    parser.add_argument("--output", help="Write the JSON results here instead of stdout")
+    parser.add_argument("--data", default=str(DATA_DIR), help="Directory of Markdown writeups")
+    parser.add_argument("--questions", default=str(QUESTIONS_PATH), help="Labeled JSONL question set")
+    parser.add_argument("--copies", type=int, default=20, help="Times the corpus is replicated for the speed measurement")
+    parser.add_argument("--chunk-size", type=int, default=1000)
+    parser.add_argument("--chunk-overlap", type=int, default=200)
+    parser.add_argument("--port", type=int, default=11440)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="rag_chunker_")
+    # Everything below reads its configuration at import time
+    os.environ["CHROMA_PERSIST_DIR"] = workdir
+    os.environ["VECTOR_BACKEND"] = "chroma"
+    os.environ["EMBEDDING_CACHE_PATH"] = os.path.join(workdir, "embeddings.sqlite")
+    os.environ["OLLAMA_HOST"] = f"http://127.0.0.1:{args.port}"
+
+    from benchmark.fake_ollama import serve
+    from utils.markdown_chunker import MarkdownChunker
+    server = serve(port=args.port)
+
+    docs = load_corpus(Path(args.data))
+    questions = load_questions(Path(args.questions))
+    splitters = {
+        "tiktoken": make_splitter("tiktoken", args.chunk_size, args.chunk_overlap),
+        "markdown": make_splitter("markdown", args.chunk_size, args.chunk_overlap),
+    }
+    serial = MarkdownChunker(chunk_size=args.chunk_size, chunk_overlap=args.chunk_overlap, workers=1)
+    try:
+        results = {
+            "config": {"copies": args.copies, "chunk_size": args.chunk_size, "chunk_overlap": args.chunk_overlap,
+                       "workers": splitters["markdown"].workers},
+            "split": {
+                "tiktoken": bench_split(splitters["tiktoken"], docs, args.copies),
+                "markdown_serial": bench_split(serial, docs, args.copies),
+                "markdown": bench_split(splitters["markdown"], docs, args.copies),
+            },
+            "recall": {name: bench_recall_for(name, splitter, docs, questions, workdir) for name, splitter in splitters.items()},
+        }
+    finally:
+        server.shutdown()
+
+    report = json.dumps(results, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(report + "\n")
+        print(f"Results written to {args.output}")
+    else:
+        print(report)
+
+if __name__ == "__main__":
+    main()
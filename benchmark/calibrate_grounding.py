@@ -0,0 +1,168 @@
+"""
+Calibrate the grounding pre-check thresholds (utils/grounding.py) on a labeled set.
+
+The accept threshold is the lowest score above which at least --precision of the answers
+are grounded, the reject threshold the highest score below which at least --precision are
+not. Answers in between go to the LLM grader. Written as JSON for the pre-check to load, with
+the embedding model they hold for; with --offline that is tagged as benchmark/fake_ollama.py's,
+so the pre-check never uses them with the real model. The word-overlap-only thresholds, which
+the pre-check falls back to without calibrated ones (GROUNDING_ACCEPT / GROUNDING_REJECT), are
+written under "lexical" and do not depend on the embedding model.
+
+benchmark/grounding_labels.jsonl is a small hand-labeled set over the writeups in data/: faithful
+answers, answers with invented steps or values, and answers with one invented step.
+
+Labeled rows (JSONL) carry "answer" and "grounded" (bool), plus one of:
+    "score"                         precomputed, e.g. the pre-check's GROUNDING_LOG_PATH, where the label is the LLM grader's
+                                    ("semantic": false marks a word-overlap-only score)
+    "context"                       the text the answer has to be grounded in
+    "question" + "challenge_name"   the context is retrieved as the graph would
+Without --labeled, a synthetic set is built from benchmark/questions.jsonl: answers quoting
+the retrieved chunks (grounded), quoting another challenge's chunks (not), and half of each (not).
+
+Usage:
+    python -m benchmark.calibrate_grounding --labeled benchmark/grounding_labels.jsonl
+    python -m benchmark.calibrate_grounding --offline --output /tmp/thresholds.json
+"""
+import os
+import re
+import json
+import time
+import asyncio
+import argparse
+import tempfile
+from pathlib import Path
+
+from benchmark.run_benchmarks import DATA_DIR, QUESTIONS_PATH, load_corpus, load_questions
+
+WORD = re.compile(r"[a-z0-9]+")
+ANSWER_LINES = 4
+
+def quote_lines(question: str, documents, n: int = ANSWER_LINES):
+    """The `n` context lines sharing the most words with the question, as a stand-in answer."""
+    words = set(WORD.findall(question.lower()))
+    lines = [l.strip() for d in documents for l in d.page_content.split("\n") if len(l.split()) >= 5]
+    return sorted(lines, key=lambda l: -len(words & set(WORD.findall(l.lower()))))[:n]
+
+def synthetic_rows(questions, k: int = 8):
+    from utils.hybrid import hybrid_search
+
+    retrieved = {q["question"]: hybrid_search(q["question"], k=k, challenge=q["challenge_name"]) for q in questions}
+    challenges = sorted({q["challenge_name"] for q in questions})
+    rows = []
+    for q in questions:
+        other = challenges[(challenges.index(q["challenge_name"]) + 1) % len(challenges)]
+        own = quote_lines(q["question"], retrieved[q["question"]])
+        foreign = quote_lines(q["question"], hybrid_search(q["question"], k=k, challenge=other))
+        base = {"question": q["question"], "challenge_name": q["challenge_name"]}
+        rows.append({**base, "answer": "\n".join(own), "grounded": True})
+        rows.append({**base, "answer": "\n".join(foreign), "grounded": False})
+        half = ANSWER_LINES // 2
+        rows.append({**base, "answer": "\n".join(own[:half] + foreign[:half]), "grounded": False})
+    return rows
+
+def score_rows(rows, semantic: bool = True, k: int = 8):
+    from langchain.schema import Document
+    from utils.hybrid import hybrid_search
+    from utils.grounding import grounding_score
+
+    scored = []
+    for row in rows:
+        if "score" in row:
+            # Precomputed scores only calibrate the kind of score they are
+            score = row["score"] if row.get("semantic", True) == semantic else None
+        elif "context" in row:
+            score, _ = grounding_score(row["answer"], [Document(page_content=row["context"])], row["context"], semantic)
+        else:
+            score, _ = grounding_score(row["answer"], hybrid_search(row["question"], k=k, challenge=row["challenge_name"]), semantic=semantic)
+        if score is not None:
+            scored.append((score, bool(row["grounded"])))
+    return scored
+
+def calibrate(scored, precision: float):
+    """
+    Returns:
+        dict: accept/reject thresholds, and the share of answers they decide locally and how
+        many of those decisions match the labels
+    """
+    ordered = sorted(scored)
+    accept = reject = None
+    # Lowest threshold whose "score >= t" side is grounded at the target precision
+    for i in range(len(ordered)):
+        above = ordered[i:]
+        if sum(label for _, label in above) / len(above) >= precision:
+            accept = ordered[i][0]
+            break
+    accept = 1.01 if accept is None else accept
+    # Highest threshold below it whose "score <= t" side is ungrounded at the target precision
+    for i in range(sum(s < accept for s, _ in ordered), 0, -1):
+        below = ordered[:i]
+        if sum(not label for _, label in below) / len(below) >= precision:
+            reject = ordered[i - 1][0]
+            break
+    reject = -0.01 if reject is None else reject
+    decided = [(s, label) for s, label in scored if s >= accept or s <= reject]
+    correct = sum((s >= accept) == label for s, label in decided)
+    return {
+        "accept": accept,
+        "reject": reject,
+        "n": len(scored),
+        "coverage": round(len(decided) / len(scored), 3) if scored else 0.0,
+        "local_accuracy": round(correct / len(decided), 3) if decided else 0.0,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Calibrate the grounding pre-check thresholds on a labeled set.")
+    parser.add_argument("--labeled", help="Labeled JSONL (default: a synthetic set from --questions)")
+    parser.add_argument("--questions", default=str(QUESTIONS_PATH), help="Questions for the synthetic set")
+    parser.add_argument("--precision", type=float, default=0.95, help="Required precision of each local decision")
+    parser.add_argument("--output", help="Thresholds file (default: GROUNDING_THRESHOLDS_PATH)")
+    parser.add_argument("--offline", action="store_true",
+                        help="Index data/*.md into a temp collection behind benchmark/fake_ollama.py instead of using the configured store")
+    parser.add_argument("--port", type=int, default=11441)
+    args = parser.parse_args()
+
+    server = None
+    if args.offline:
+        workdir = tempfile.mkdtemp(prefix="rag_grounding_")
+        # Everything below reads its configuration at import time
+        os.environ["CHROMA_PERSIST_DIR"] = workdir
+        os.environ["VECTOR_BACKEND"] = "chroma"
+        os.environ["EMBEDDING_CACHE_PATH"] = os.path.join(workdir, "embeddings.sqlite")
+        os.environ["OLLAMA_HOST"] = f"http://127.0.0.1:{args.port}"
+
+        from benchmark.fake_ollama import serve
+        from utils.doc_loader import get_text_splitter, MANIFEST_PATH
+        from utils.vectorstore import get_vectorstore
+        from utils.ingest_manifest import IngestManifest, aindex_incrementally
+
+        server = serve(port=args.port)
+        asyncio.run(aindex_incrementally(get_vectorstore(), load_corpus(DATA_DIR), get_text_splitter(), IngestManifest(MANIFEST_PATH)))
+
+    from utils.grounding import THRESHOLDS_PATH
+    from utils.vectorstore import EMBEDDING_MODEL
+
+    try:
+        if args.labeled:
+            rows = load_questions(Path(args.labeled))
+        else:
+            rows = synthetic_rows(load_questions(Path(args.questions)))
+        result = calibrate(score_rows(rows), args.precision)
+        result["lexical"] = calibrate(score_rows(rows, semantic=False), args.precision)
+    finally:
+        if server:
+            server.shutdown()
+
+    # Fake embeddings say nothing about the real model's similarities
+    embedding_model = f"fake_ollama:{EMBEDDING_MODEL}" if args.offline else EMBEDDING_MODEL
+    result.update({"embedding_model": embedding_model, "precision": args.precision, "calibrated_at": int(time.time())})
+    output = args.output or THRESHOLDS_PATH
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(result, f, indent=2, sort_keys=True)
+        f.write("\n")
+    print(json.dumps(result, indent=2, sort_keys=True))
+    print(f"Thresholds written to {output}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,171 @@
+"""
+Minimal stand-in for the Ollama HTTP API, for exercising the ingest/retrieval code offline.
+
+Embeddings are deterministic hashed bag-of-words vectors, so texts that share words are
+close to each other and recall numbers stay meaningful. Chat replies are canned per prompt
+(router, challenge-name extraction, RAG answer, graders), so the whole graph runs end to end.
+
+Usage:
+    python benchmark/fake_ollama.py --port 11435 --latency 0.05 --fail-rate 0.1
+    OLLAMA_HOST=http://127.0.0.1:11435 python -m utils.doc_loader
+"""
+import re
+import json
+import math
+import time
+import random
+import hashlib
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DIMENSIONS = 256
+# The answer stand-in quotes this many context lines that share words with the question
+ANSWER_LINES = 5
+WORD = re.compile(r"[a-z0-9]+")
+# Disfluencies the transcript-editor stand-in removes
+FILLER = {"um", "uh", "erm", "hmm"}
+
+def embed_text(text: str, dimensions: int = DIMENSIONS):
+    vector = [0.0] * dimensions
+    for token in WORD.findall(text.lower()):
+        h = int.from_bytes(hashlib.md5(token.encode("utf-8")).digest()[:4], "little")
+        vector[h % dimensions] += 1.0 if h & 0x80000000 else -1.0
+    norm = math.sqrt(sum(v * v for v in vector)) or 1.0
+    return [v / norm for v in vector]
+
+def _between(text: str, start: str, end: str) -> str:
+    _, _, tail = text.partition(start)
+    return tail.partition(end)[0] if tail else ""
+
+def chat_reply(messages) -> str:
+    """
+    Deterministic stand-in for the LLM, keyed on the prompts in utils/chains.py:
+      router          -> vectorstore for HackTheBox questions, else web_search
+      name extraction -> the word before "challenge"/"machine", else unknown
+      RAG answer      -> the context lines sharing the most words with the question
+      graders         -> grounded if most answer words occur in the facts, useful if non-empty
+      transcript map  -> the chunk without filler words; reduce -> the chunks unchanged
+    """
+    system = " ".join(m.get("content", "") for m in messages if m.get("role") == "system")
+    user = " ".join(m.get("content", "") for m in messages if m.get("role") != "system")
+    text = f"{system} {user}"
+
+    if "routing a user question" in system:
+        question = user.partition(":")[2]
+        datasource = "vectorstore" if re.search(r"hack\s*the\s*box|htb|challenge|machine", question, re.I) else "web_search"
+        return json.dumps({"datasource": datasource})
+    if "extracting the HackTheBox challenge name" in system:
+        match = re.search(r"([A-Za-z0-9]+)\s+(?:challenge|machine|box)\b", user.partition(":")[2])
+        return match.group(1).lower() if match else "unknown"
+    if "question-answering tasks" in system:
+        context = _between(user, "Here is the context:", "Answer this question base on the above context:")
+        question = set(WORD.findall(user.rpartition(":")[2].lower()))
+        lines = [l.strip() for l in context.replace("\\n", "\n").split("\n") if l.strip()]
+        ranked = sorted(lines, key=lambda l: -len(question & set(WORD.findall(l.lower()))))
+        return "\n".join(ranked[:ANSWER_LINES]) or "I don't know."
+    if "careful editor" in system:
+        # Transcript map step: drop filler words
+        chunk = _between(user, "```", "```")
+        return " ".join(w for w in chunk.split() if w.lower().strip(",.") not in FILLER)
+    if "already-refined chunks" in system:
+        return _between(user, "```", "```")
+    if "grader assessing" in text:
+        facts = set(WORD.findall(_between(text, "Here are the facts:", "Here is the answer:").lower()))
+        answer = text.partition("Here is the answer:")[2].partition("Here is the question:")[0].partition("Give a binary score")[0]
+        answer_words = WORD.findall(answer.lower())
+        grounded = "yes" if not facts or sum(w in facts for w in answer_words) >= 0.5 * len(answer_words) else "no"
+        useful = "no" if not answer_words or "don't know" in answer.lower() else "yes"
+        if "'grounded' and 'useful'" in text:
+            return json.dumps({"grounded": grounded, "useful": useful})
+        return json.dumps({"score": grounded if "grounded in / supported by a set of facts" in text else useful})
+    return "ok"
+
+class FakeOllamaHandler(BaseHTTPRequestHandler):
+    latency = 0.0
+    fail_rate = 0.0
+    stats = {"requests": 0, "texts": 0, "chats": 0, "failures": 0}
+    lock = threading.Lock()
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status: int, body: dict):
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if self.path == "/stats":
+            with self.lock:
+                return self._send(200, dict(self.stats))
+        self._send(200, {"status": "ok"})
+
+    def do_POST(self):
+        payload = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        if self.latency:
+            time.sleep(self.latency)
+        if random.random() < self.fail_rate:
+            with self.lock:
+                self.stats["failures"] += 1
+            return self._send(503, {"error": "injected failure"})
+
+        if self.path == "/api/embed":
+            texts = payload.get("input", [])
+            texts = [texts] if isinstance(texts, str) else texts
+            with self.lock:
+                self.stats["requests"] += 1
+                self.stats["texts"] += len(texts)
+            return self._send(200, {"model": payload.get("model", ""), "embeddings": [embed_text(t) for t in texts]})
+        if self.path == "/api/chat":
+            with self.lock:
+                self.stats["chats"] += 1
+            return self._chat(payload)
+        self._send(404, {"error": f"unsupported endpoint {self.path}"})
+
+    def _chat(self, payload: dict):
+        reply = chat_reply(payload.get("messages", []))
+        model = payload.get("model", "")
+        # Whitespace-separated words stand in for tokens in the usage counters
+        usage = {
+            "prompt_eval_count": sum(len(m.get("content", "").split()) for m in payload.get("messages", [])),
+            "eval_count": len(reply.split()),
+        }
+        if payload.get("stream") is False:
+            return self._send(200, {"model": model, "message": {"role": "assistant", "content": reply}, "done": True, **usage})
+        # NDJSON stream, one word per chunk, like the real server
+        words = re.findall(r"\S+\s*", reply) or [""]
+        lines = [{"model": model, "message": {"role": "assistant", "content": w}, "done": False} for w in words]
+        lines.append({"model": model, "message": {"role": "assistant", "content": ""}, "done": True, "done_reason": "stop", **usage})
+        data = "".join(json.dumps(l) + "\n" for l in lines).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+def serve(host: str = "127.0.0.1", port: int = 11435, latency: float = 0.0, fail_rate: float = 0.0) -> ThreadingHTTPServer:
+    """Start the fake server on a background thread and return it."""
+    FakeOllamaHandler.latency = latency
+    FakeOllamaHandler.fail_rate = fail_rate
+    server = ThreadingHTTPServer((host, port), FakeOllamaHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fake Ollama server for offline ingest/retrieval runs.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=11435)
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds to sleep per request")
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="Fraction of requests answered with HTTP 503")
+    args = parser.parse_args()
+
+    server = serve(args.host, args.port, args.latency, args.fail_rate)
+    print(f"Fake Ollama listening on http://{args.host}:{args.port}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
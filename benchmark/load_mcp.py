@@ -0,0 +1,85 @@
+"""
+Load test of the MCP retrieval tools against a throwaway Chroma store and the fake Ollama
+server, so embedding latency is simulated and no GPU is needed.
+
+Runs the same number of retrievals through the blocking `retrieve_only_handler` (one at a
+time, as the sync tool serves them) and through the async `retrieve_handler` (all at once),
+then prints wall time, throughput and the async tool's metrics.
+
+Usage:
+    python -m benchmark.load_mcp --requests 64 --concurrency 8 --latency 0.1
+"""
+import os
+import sys
+import time
+import json
+import asyncio
+import argparse
+import tempfile
+
+CHALLENGES = ["fluffy", "twomillion", "cicada", "editor", "planning", "titanic", "artificial", "puppy"]
+
+def main():
+    parser = argparse.ArgumentParser(description="Sync vs async MCP retrieval under concurrent load.")
+    parser.add_argument("--requests", type=int, default=64)
+    parser.add_argument("--concurrency", type=int, default=8, help="MCP_CONCURRENCY for the async tool")
+    parser.add_argument("--latency", type=float, default=0.1, help="Seconds the fake Ollama sleeps per embedding call")
+    parser.add_argument("--queue-timeout", type=float, default=30.0)
+    parser.add_argument("--request-timeout", type=float, default=30.0)
+    parser.add_argument("--port", type=int, default=11436)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="load_mcp_")
+    # Everything below reads its configuration at import time
+    os.environ["CHROMA_PERSIST_DIR"] = workdir
+    os.environ["EMBEDDING_CACHE_PATH"] = os.path.join(workdir, "embeddings.sqlite")
+    os.environ["OLLAMA_HOST"] = f"http://127.0.0.1:{args.port}"
+    os.environ["MCP_CONCURRENCY"] = str(args.concurrency)
+    os.environ["MCP_QUEUE_TIMEOUT"] = str(args.queue_timeout)
+    os.environ["MCP_REQUEST_TIMEOUT"] = str(args.request_timeout)
+    # The Gemini client is built on import but never called here
+    os.environ.setdefault("GOOGLE_API_KEY", "unused")
+
+    from benchmark.fake_ollama import serve
+    server = serve(port=args.port, latency=args.latency)
+
+    from utils.vectorstore import get_vectorstore
+    import test_mcp_rag
+
+    texts, metadatas = [], []
+    for name in CHALLENGES:
+        for step in range(20):
+            texts.append(f"{name} step {step}: enumerate the {name} services, exploit and escalate privileges")
+            metadatas.append({"basename": f"{name}.md"})
+    get_vectorstore().add_texts(texts, metadatas=metadatas)
+
+    def questions(tag: str):
+        # Unique per request, so the embedding cache does not hide the embedding latency
+        return [(f"How to solve {CHALLENGES[i % len(CHALLENGES)]} ({tag} {i})?", CHALLENGES[i % len(CHALLENGES)]) for i in range(args.requests)]
+
+    started = time.perf_counter()
+    for question, name in questions("sync"):
+        test_mcp_rag.retrieve_only_handler(question, name)
+    sync_seconds = time.perf_counter() - started
+
+    async def run_async():
+        return await asyncio.gather(
+            *(test_mcp_rag.retrieve_handler(question, name) for question, name in questions("async")),
+            return_exceptions=True,
+        )
+
+    started = time.perf_counter()
+    results = asyncio.run(run_async())
+    async_seconds = time.perf_counter() - started
+    failures = [r for r in results if isinstance(r, Exception)]
+
+    print(f"{'mode':<8}{'requests':>10}{'seconds':>10}{'req/s':>10}")
+    print(f"{'sync':<8}{args.requests:>10}{sync_seconds:>10.2f}{args.requests / sync_seconds:>10.1f}")
+    print(f"{'async':<8}{args.requests:>10}{async_seconds:>10.2f}{args.requests / async_seconds:>10.1f}")
+    if failures:
+        print(f"{len(failures)} async requests failed, e.g. {failures[0]}", file=sys.stderr)
+    print(json.dumps(test_mcp_rag.metrics_handler(), indent=2))
+    server.shutdown()
+
+if __name__ == "__main__":
+    main()
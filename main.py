@@ -1,8 +1,17 @@
+import sys
+import time
 import pprint
-from typing import List
+import logging
+from typing import Dict, List
 from typing_extensions import TypedDict
 from langgraph.graph import START, END, StateGraph
-from utils.tools import generate, grade_generation_v_documents_and_question, route_question, web_search, retrieve
+from utils.tools import generate, grade_generation, decide, route_question, web_search, retrieve
+from utils.vectorstore import warm_up, get_embeddings
+from utils.prerouter import get_prerouter
+from utils.answer_cache import SemanticAnswerCache
+from utils.chains import ANSWER_TAG
+from utils.tracing import tracer, summarize
+from utils import budget
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -15,6 +24,17 @@ class GraphState(TypedDict):
         question: question
         generation: LLM generation
         documents: list of documents
+        started: when the request's budget started (epoch seconds)
+        llm_calls: LLM calls made by the nodes so far
+        web_searches: web searches so far
+        context: prompt context of the last generation
+        attempts: {"strategy", "fingerprint"} of each generation on the current documents
+        strategy: what the next generation changes (utils.budget.RETRY_STRATEGIES), "" for none
+        decision: last grading decision
+        best: best graded answer so far, {"generation", "documents", "score", "attempt"}
+        stop_reason: set when the budget ran out and `generation` is the best answer so far
+
+    Only the first five keys have to be in the inputs.
     """
 
     question: str
@@ -22,18 +42,28 @@ class GraphState(TypedDict):
     documents: List[str]
     challenge_name: str
     generate_count: int
+    started: float
+    llm_calls: int
+    web_searches: int
+    context: str
+    attempts: List[Dict[str, str]]
+    strategy: str
+    decision: str
+    best: Dict
+    stop_reason: str
 
 workflow = StateGraph(GraphState)
 
-# Define nodes
-workflow.add_node("web_search", web_search)
-workflow.add_node("retrieve", retrieve)
-workflow.add_node("generate", generate)
+# Define nodes, each wrapped in a tracing span
+workflow.add_node("web_search", tracer.node("web_search", web_search))
+workflow.add_node("retrieve", tracer.node("retrieve", retrieve))
+workflow.add_node("generate", tracer.node("generate", generate))
+workflow.add_node("grade", tracer.node("grade", grade_generation))
 
 # Build graph
 workflow.add_conditional_edges(
     START, 
-    route_question, 
+    tracer.edge("route_question", route_question), 
     {
         "web_search": "web_search",
         "vectorstore": "retrieve"
@@ -41,32 +71,155 @@ workflow.add_conditional_edges(
 )
 workflow.add_edge("web_search", "generate")
 workflow.add_edge("retrieve", "generate")
+workflow.add_edge("generate", "grade")
 workflow.add_conditional_edges(
-    "generate",
-    grade_generation_v_documents_and_question,
+    "grade",
+    tracer.edge("decide", decide),
     {
         "not_supported": "generate",
         "useful": END,
-        "not_useful": "web_search"
+        "not_useful": "web_search",
+        "over_budget": END
     }
 )
 
 app = workflow.compile()
 
+# Semantic answer cache in front of the compiled graph
+answer_cache = SemanticAnswerCache(get_embeddings())
+
+def is_cacheable(final_state) -> bool:
+    """Only graded answers are cached, not the best-so-far answer of a request that ran out of budget."""
+    return bool(final_state and final_state.get("generation") and not final_state.get("stop_reason"))
+
+def _cache_key(inputs: GraphState) -> str:
+    """Challenge the question is about, resolved locally when the caller did not give one."""
+    if inputs["challenge_name"]:
+        return inputs["challenge_name"]
+    name, confidence = get_prerouter().match_challenge(inputs["question"])
+    return name if name and confidence >= get_prerouter().threshold else ""
+
+def cached_invoke(inputs: GraphState) -> GraphState:
+    """
+    `app.invoke`, answered from the semantic cache when a near-duplicate question
+    about the same challenge was answered recently.
+    """
+    key = _cache_key(inputs)
+    final_state = answer_cache.lookup(inputs["question"], key)
+    if final_state is None:
+        with tracer.question(inputs["question"]):
+            final_state = app.invoke(inputs)
+        if is_cacheable(final_state):
+            answer_cache.store(inputs["question"], key, final_state)
+    return final_state
+
+def cached_stream(inputs: GraphState):
+    """
+    `app.stream`, yielding a single {"answer_cache": state} update on a cache hit.
+    """
+    key = _cache_key(inputs)
+    final_state = answer_cache.lookup(inputs["question"], key)
+    if final_state is not None:
+        yield {"answer_cache": final_state}
+        return
+    with tracer.question(inputs["question"]):
+        for output in app.stream(inputs):
+            # Updates only carry the keys a node changed; the grade node's has no generation
+            final_state = {**(final_state or {}), **next(iter(output.values()))}
+            yield output
+    if is_cacheable(final_state):
+        answer_cache.store(inputs["question"], key, final_state)
+
+def stream_answer(inputs: GraphState):
+    """
+    Run the graph and yield answer tokens as the LLM produces them.
+
+    Grading still runs after each generation. If it rejects an answer that was already
+    streamed, a "retract" event is yielded before the next attempt starts. When the request
+    runs out of budget and an earlier attempt graded better than the last, the last one is
+    retracted and the earlier one sent as a single token event. If the answer it ends with was
+    not graded as grounded, a "flag" event follows it.
+
+    Yields:
+        dict: One of
+            {"event": "token", "text": str}
+            {"event": "ttft", "seconds": float}                      once, on the first token
+            {"event": "node", "node": str}                           a graph node finished
+            {"event": "retract", "reason": "not_grounded" | "not_useful" | "over_budget"}
+            {"event": "flag", "reason": "not_grounded"}               the final answer is not grounded
+            {"event": "done", "state": GraphState, "ttft": float, "total": float, "cached": bool, "trace": dict}
+        "trace" (per-node time, LLM tokens, retries, see utils.tracing.summarize) is only set on a cache miss.
+    """
+    started = time.perf_counter()
+    key = _cache_key(inputs)
+    final_state = answer_cache.lookup(inputs["question"], key)
+    if final_state is not None:
+        elapsed = time.perf_counter() - started
+        yield {"event": "ttft", "seconds": elapsed}
+        yield {"event": "token", "text": final_state["generation"]}
+        yield {"event": "done", "state": final_state, "ttft": elapsed, "total": elapsed, "cached": True}
+        return
+
+    ttft = None
+    with tracer.question(inputs["question"]) as trace:
+        for mode, payload in app.stream(inputs, stream_mode=["messages", "updates"]):
+            if mode == "messages":
+                chunk, metadata = payload
+                if ANSWER_TAG not in metadata.get("tags", []) or not chunk.content:
+                    continue
+                if ttft is None:
+                    ttft = time.perf_counter() - started
+                    yield {"event": "ttft", "seconds": ttft}
+                yield {"event": "token", "text": chunk.content}
+            else:
+                node, update = next(iter(payload.items()))
+                final_state = {**(final_state or {}), **update}
+                if node == "grade":
+                    decision = update["decision"]
+                    if decision == "not_supported":
+                        yield {"event": "retract", "reason": "not_grounded"}
+                    elif decision == "not_useful":
+                        yield {"event": "retract", "reason": "not_useful"}
+                    elif decision == "over_budget":
+                        if update["best"]["attempt"] != final_state["generate_count"]:
+                            yield {"event": "retract", "reason": "over_budget"}
+                            yield {"event": "token", "text": update["generation"]}
+                        if update["best"]["score"] == budget.SCORES["not_supported"]:
+                            yield {"event": "flag", "reason": "not_grounded"}
+                yield {"event": "node", "node": node}
+
+    total = time.perf_counter() - started
+    logging.info(f"---STREAMED ANSWER: TTFT {ttft or 0:.2f}s, TOTAL {total:.2f}s---")
+    if is_cacheable(final_state):
+        answer_cache.store(inputs["question"], key, final_state)
+    yield {"event": "done", "state": final_state, "ttft": ttft, "total": total, "cached": False, "trace": summarize(trace)}
+
 # Example usage
 if __name__ == "__main__":
     # question = "Give me a full step-by-step of how to solve the TwoMillion challenge in HackTheBox."  # needs web search
     question = "Give me a full step-by-step on how to solve the Tombwatcher challenge in HackTheBox." # can be answered with retrieval
     # question = "I have done the recon part, show me how to escalate to admin in the Fluffy challenge in HackTheBox."
     print = pprint.pp
+    warm_up()
     inputs: GraphState = {"question": question,
                           "challenge_name": "",
                           "generation": "",
                           "documents": [],
                           "generate_count": 0}
-    # Run the workflow and get the final state
-    for output in app.stream(inputs):
-        final_state = next(iter(output.values()))
+    # Run the workflow, printing the answer as it is generated
+    for event in stream_answer(inputs):
+        if event["event"] == "token":
+            sys.stdout.write(event["text"])
+            sys.stdout.flush()
+        elif event["event"] == "retract":
+            sys.stdout.write(f"\n[answer retracted: {event['reason']}]\n")
+        elif event["event"] == "flag":
+            sys.stdout.write(f"\n[answer flagged: {event['reason']}]\n")
+        elif event["event"] == "done":
+            final_state = event["state"]
+            sys.stdout.write(f"\n[ttft {event['ttft'] or 0:.2f}s, total {event['total']:.2f}s]\n")
+            if event.get("trace"):
+                print(event["trace"])
 
     # Access the final generation result
     with open(f"rag_response/{final_state['challenge_name']}.md", "w", encoding="utf-8") as f:
@@ -1,11 +1,31 @@
-from typing import List
+import os
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List
 from typing_extensions import TypedDict
 from utils.tools import retrieve
+from utils.vectorstore import warm_up, get_stats as get_vectorstore_stats
+from utils.metrics import LatencyRecorder
+from utils.budget import get_stats as get_budget_stats
+from utils.grounding import get_stats as get_grounding_stats
+from main import stream_answer
 from dotenv import load_dotenv
-from mcp.server.fastmcp import FastMCP
+from mcp.server.fastmcp import FastMCP, Context
 
 load_dotenv()
 
+# Async serving: at most MCP_CONCURRENCY retrievals run at once, the rest wait up to
+# MCP_QUEUE_TIMEOUT seconds for a slot, and each retrieval gets MCP_REQUEST_TIMEOUT seconds
+CONCURRENCY = int(os.getenv("MCP_CONCURRENCY", "4"))
+QUEUE_TIMEOUT = float(os.getenv("MCP_QUEUE_TIMEOUT", "10"))
+REQUEST_TIMEOUT = float(os.getenv("MCP_REQUEST_TIMEOUT", "60"))
+
+# Chroma and the Ollama embedding/LLM clients block, so they run on this pool
+executor = ThreadPoolExecutor(max_workers=CONCURRENCY, thread_name_prefix="mcp-retrieve")
+retrieve_slots = asyncio.Semaphore(CONCURRENCY)
+retrieve_metrics = LatencyRecorder()
+
 # Create an MCP server
 mcp = FastMCP(
     name="RAG Test Server",
@@ -45,9 +65,109 @@ def retrieve_only_handler(question: str, challenge_name: str) -> List[str]:
     resp = retrieve(state)
     return resp["documents"]
 
+@mcp.tool()
+async def retrieve_handler(question: str, challenge_name: str) -> List[str]:
+    """Runs the retrieve node without blocking other clients and returns the found documents
+    Args:
+        question (str): The input question
+        challenge_name (str): The name of the challenge in lowercase, e.g. "fluffy", "twomillion"
+    Returns:
+        documents: List[str]
+    """
+    state: GraphState = {
+        "question": question,
+        "challenge_name": challenge_name,
+        "documents": [],
+    }
+
+    retrieve_metrics.incr("queued")
+    try:
+        await asyncio.wait_for(retrieve_slots.acquire(), timeout=QUEUE_TIMEOUT)
+    except asyncio.TimeoutError:
+        retrieve_metrics.incr("rejected")
+        raise RuntimeError(f"server busy: no retrieval slot free within {QUEUE_TIMEOUT:g}s")
+    finally:
+        retrieve_metrics.incr("queued", -1)
+
+    loop = asyncio.get_running_loop()
+    future = loop.run_in_executor(executor, retrieve, state)
+    # A timed-out retrieval keeps running on its thread, so its slot is only freed once it really ends
+    future.add_done_callback(lambda _: retrieve_slots.release())
+    with retrieve_metrics.track():
+        try:
+            resp = await asyncio.wait_for(asyncio.shield(future), timeout=REQUEST_TIMEOUT)
+        except asyncio.TimeoutError:
+            retrieve_metrics.incr("timeouts")
+            raise RuntimeError(f"retrieval timed out after {REQUEST_TIMEOUT:g}s")
+    return resp["documents"]
+
+@mcp.tool()
+def metrics_handler() -> Dict:
+    """Reports the retrieval serving metrics
+    Returns:
+        metrics: dict with in-flight/queued requests, completed/error (timeouts included)/timeout/rejected counts,
+        p50/p95 latency in seconds, the concurrency limit, vectorstore/embedding-cache stats and the
+        answer loop's retries per strategy, fallback answers, budget exhaustion per limit and
+        hallucination-grader calls avoided by the grounding pre-check
+    """
+    return {
+        "retrieve": retrieve_metrics.get_stats(),
+        "concurrency": CONCURRENCY,
+        "vectorstore": get_vectorstore_stats(),
+        "budget": get_budget_stats(),
+        "grounding": get_grounding_stats(),
+    }
+
+@mcp.tool()
+async def stream_answer_handler(question: str, challenge_name: str, ctx: Context) -> str:
+    """Runs the full RAG graph and streams the answer as it is generated.
+    Tokens are sent as progress notifications; retractions and timings as log messages.
+    Args:
+        question (str): The input question
+        challenge_name (str): The name of the challenge in lowercase, e.g. "fluffy", "twomillion", or "" to detect it
+    Returns:
+        generation: str, the final graded answer
+    """
+    inputs = {
+        "question": question,
+        "challenge_name": challenge_name,
+        "generation": "",
+        "documents": [],
+        "generate_count": 0,
+    }
+    loop = asyncio.get_running_loop()
+    events: asyncio.Queue = asyncio.Queue()
+
+    # The graph is synchronous, so drive it on a thread and hand events back to the loop
+    def produce():
+        try:
+            for event in stream_answer(inputs):
+                loop.call_soon_threadsafe(events.put_nowait, event)
+        except Exception as e:
+            loop.call_soon_threadsafe(events.put_nowait, {"event": "error", "error": str(e)})
+
+    threading.Thread(target=produce, daemon=True).start()
+    tokens = 0
+    while True:
+        event = await events.get()
+        if event["event"] == "token":
+            tokens += 1
+            await ctx.report_progress(progress=tokens, message=event["text"])
+        elif event["event"] == "ttft":
+            await ctx.info(f"time to first token: {event['seconds']:.2f}s")
+        elif event["event"] == "retract":
+            await ctx.info(f"answer retracted: {event['reason']}")
+        elif event["event"] == "flag":
+            await ctx.warning(f"answer flagged: {event['reason']}")
+        elif event["event"] == "error":
+            raise RuntimeError(event["error"])
+        elif event["event"] == "done":
+            await ctx.info(f"total latency: {event['total']:.2f}s")
+            return event["state"]["generation"] if event["state"] else ""
 
 # Start the MCP server (this will block unless your FastMCP uses non-blocking run)
 if __name__ == "__main__":
+    warm_up()
     documents = retrieve_only_handler("How to solve the Fluffy challenge in HackTheBox?", "fluffy")
     print(documents)
     # mcp.run(transport="stdio")
\ No newline at end of file
@@ -0,0 +1,53 @@
+import os
+import tempfile
+
+import pytest
+from langchain.schema import Document
+
+URL = "https://0xdf.gitlab.io/2025/09/20/htb-fluffy.html"
+PORT = 11443
+
+@pytest.fixture(scope="module")
+def workdir():
+    """Empty Chroma collection behind benchmark/fake_ollama.py; utils reads its configuration at import time."""
+    path = tempfile.mkdtemp(prefix="rag_web_index_")
+    os.environ["CHROMA_PERSIST_DIR"] = path
+    os.environ["VECTOR_BACKEND"] = "chroma"
+    os.environ["EMBEDDING_CACHE_PATH"] = os.path.join(path, "embeddings.sqlite")
+    os.environ["OLLAMA_HOST"] = f"http://127.0.0.1:{PORT}"
+
+    from benchmark.fake_ollama import serve
+
+    server = serve(port=PORT)
+    yield path
+    server.shutdown()
+
+def test_web_result_keeps_crawled_chunks(workdir):
+    """A web result for a URL the crawler already indexed is stored beside the page, not over it."""
+    from langchain_text_splitters import RecursiveCharacterTextSplitter
+    from utils.vectorstore import get_vectorstore
+    from utils.ingest_manifest import IngestManifest, index_incrementally
+    from utils.web_search import index_results
+
+    page = "# Fluffy\n\nThe PDF points to CVE-2021-1675; capture the NTLMv2 hash of pagula with Responder."
+    snippet = "Fluffy is an easy Windows machine on HackTheBox."
+    vectorstore = get_vectorstore()
+    # Indexed as crawl_and_index does: its own manifest, sources keyed by URL
+    crawl_manifest = IngestManifest(os.path.join(workdir, "crawl_manifest.json"))
+    index_incrementally(
+        vectorstore,
+        [Document(page_content=page, metadata={"url": URL, "challenge_name": "htb-fluffy"})],
+        RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=200),
+        crawl_manifest,
+        source_key="url",
+    )
+    crawled_ids = crawl_manifest.chunk_ids(URL)
+
+    stats = index_results([Document(page_content=snippet, metadata={"url": URL})], "fluffy")
+
+    assert stats["added"] == 1
+    crawled = vectorstore.get(ids=crawled_ids)
+    assert crawled["documents"] == [page]
+    web_ids = IngestManifest(os.path.join(workdir, "web_manifest.json")).chunk_ids(URL)
+    assert not set(web_ids) & set(crawled_ids)
+    assert vectorstore.get(ids=web_ids)["documents"] == [snippet]
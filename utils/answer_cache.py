@@ -0,0 +1,102 @@
+import os
+import time
+import logging
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, Optional
+import numpy as np
+from langchain_core.embeddings import Embeddings
+from utils.vectorstore import get_index_version
+
+SIMILARITY_THRESHOLD = float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.95"))
+TTL_SECONDS = float(os.getenv("ANSWER_CACHE_TTL", "3600"))
+MAX_ENTRIES = int(os.getenv("ANSWER_CACHE_SIZE", "1000"))
+
+class SemanticAnswerCache:
+    """
+    Caches final graph states keyed on question-embedding similarity plus challenge name.
+
+    A lookup hits when a stored question for the same challenge has cosine similarity
+    >= `threshold` and is younger than `ttl` seconds. Entries are evicted LRU beyond
+    `max_entries`, and the whole cache is dropped when the index version changes
+    (i.e. the collection was re-indexed).
+    """
+
+    def __init__(
+        self,
+        embeddings: Embeddings,
+        threshold: float = SIMILARITY_THRESHOLD,
+        ttl: float = TTL_SECONDS,
+        max_entries: int = MAX_ENTRIES,
+        version_fn: Callable[[], str] = get_index_version,
+    ):
+        self.embeddings = embeddings
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.version_fn = version_fn
+        self._version = version_fn()
+        self._entries: "OrderedDict[int, Dict]" = OrderedDict()
+        self._next_id = 0
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "evictions": 0, "expired": 0, "invalidations": 0}
+
+    def _embed(self, question: str) -> np.ndarray:
+        vector = np.asarray(self.embeddings.embed_query(question), dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def _check_version(self):
+        version = self.version_fn()
+        if version != self._version:
+            logging.info("---ANSWER CACHE: COLLECTION RE-INDEXED, DROPPING CACHE---")
+            self._entries.clear()
+            self._version = version
+            self._stats["invalidations"] += 1
+
+    def lookup(self, question: str, challenge_name: str) -> Optional[Dict]:
+        """
+        Returns:
+            dict: The cached final state of the most similar question, or None
+        """
+        vector = self._embed(question)
+        now = time.time()
+        with self._lock:
+            self._check_version()
+            best_id, best_score = None, self.threshold
+            for entry_id, entry in list(self._entries.items()):
+                if now - entry["created"] > self.ttl:
+                    del self._entries[entry_id]
+                    self._stats["expired"] += 1
+                    continue
+                if entry["challenge_name"] != challenge_name:
+                    continue
+                score = float(entry["vector"] @ vector)
+                if score >= best_score:
+                    best_id, best_score = entry_id, score
+            if best_id is None:
+                self._stats["misses"] += 1
+                return None
+            self._entries.move_to_end(best_id)
+            self._stats["hits"] += 1
+            logging.info(f"---ANSWER CACHE HIT (similarity {best_score:.3f})---")
+            return self._entries[best_id]["state"]
+
+    def store(self, question: str, challenge_name: str, state: Dict):
+        vector = self._embed(question)
+        with self._lock:
+            self._check_version()
+            self._entries[self._next_id] = {
+                "vector": vector,
+                "challenge_name": challenge_name,
+                "state": state,
+                "created": time.time(),
+            }
+            self._next_id += 1
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._stats["evictions"] += 1
+
+    def get_stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {**self._stats, "entries": len(self._entries)}
@@ -0,0 +1,132 @@
+import os
+import time
+import hashlib
+import logging
+import threading
+from typing import Dict, List, Optional, Tuple
+from langchain.schema import Document
+from utils.keyword_index import tokenize
+from utils.hybrid import hybrid_search, get_reranker, rerank
+
+# Per-request limits on the generate/grade loop. LLM calls count the ones made by graph
+# nodes (name extraction, generation, grading); the routing call before the first node is not counted.
+MAX_LLM_CALLS = int(os.getenv("RAG_MAX_LLM_CALLS", "10"))
+MAX_SECONDS = float(os.getenv("RAG_MAX_SECONDS", "120"))
+# Generations per request, the first one included
+MAX_GENERATIONS = int(os.getenv("RAG_MAX_GENERATIONS", "3"))
+# Falls back to the web when a grounded answer is not useful, at most this many times
+MAX_WEB_SEARCHES = int(os.getenv("RAG_MAX_WEB_SEARCHES", "1"))
+
+# What a retry of an ungrounded answer changes, tried in this order. A strategy that would
+# send a prompt already tried is skipped; when none is left the loop stops.
+RETRY_STRATEGIES = ("rerank", "fewer_documents", "more_documents", "temperature")
+RETRY_TEMPERATURE = 0.4
+# Documents fetched by "more_documents", as a multiple of the current pool
+MORE_DOCUMENTS_FACTOR = 2
+
+# Grades of an answer, best last; the fallback answer is the best-graded one
+SCORES = {"not_supported": 0, "not_useful": 1, "useful": 2}
+
+_stats_lock = threading.Lock()
+_stats = {
+    "useful": 0, "fallback_answers": 0, "web_searches": 0,
+    "exhausted_llm_calls": 0, "exhausted_seconds": 0, "exhausted_generations": 0,
+    "exhausted_strategies": 0, "exhausted_web_searches": 0,
+    **{f"retry_{name}": 0 for name in RETRY_STRATEGIES},
+}
+
+def record(key: str):
+    with _stats_lock:
+        _stats[key] += 1
+
+def get_stats() -> Dict[str, int]:
+    with _stats_lock:
+        return dict(_stats)
+
+def started_at(state) -> float:
+    """When the request's budget started: set by the first node that runs."""
+    return state.get("started") or time.time()
+
+def grading_calls(grader_mode: str) -> int:
+    """LLM calls one grading takes at most."""
+    return 1 if grader_mode == "combined" else 2
+
+def exhausted(state, next_calls: int) -> Optional[str]:
+    """
+    Why another step costing `next_calls` LLM calls is over budget, or None if it fits.
+
+    Returns:
+        str: "llm_calls", "seconds" or "generations"
+    """
+    if state.get("llm_calls", 0) + next_calls > MAX_LLM_CALLS:
+        return "llm_calls"
+    if time.time() - started_at(state) > MAX_SECONDS:
+        return "seconds"
+    if state.get("generate_count", 0) >= MAX_GENERATIONS:
+        return "generations"
+    return None
+
+def fingerprint(context: str, temperature: float) -> str:
+    """Identity of a generation prompt; a retry with the same fingerprint would repeat the answer."""
+    return hashlib.sha1(f"{temperature}\n{context}".encode("utf-8")).hexdigest()
+
+def _rerank(question: str, documents: List[Document]) -> List[Document]:
+    reranker = get_reranker()
+    if reranker is not None:
+        return rerank(question, documents, reranker)
+    # No cross-encoder: order by the share of question terms each chunk contains
+    terms = set(tokenize(question))
+    return sorted(documents, key=lambda d: -len(terms & set(tokenize(d.page_content))) / (len(terms) or 1))
+
+def _more_documents(question: str, documents: List[Document], challenge_name: str) -> List[Document]:
+    if not challenge_name or challenge_name == "unknown":
+        return []
+    return hybrid_search(question, k=max(1, len(documents)) * MORE_DOCUMENTS_FACTOR, challenge=challenge_name)
+
+def apply_strategy(strategy: str, question: str, documents: List[Document], challenge_name: str) -> Tuple[List[Document], float, bool]:
+    """
+    The context documents and temperature of a generation under `strategy`.
+
+    Returns:
+        tuple: (documents for the context, temperature, whether the documents replace the pool)
+    """
+    documents = list(documents or [])
+    if strategy == "rerank":
+        return _rerank(question, documents), 0.0, False
+    if strategy == "fewer_documents":
+        return documents[:max(1, len(documents) // 2)], 0.0, False
+    if strategy == "more_documents":
+        more = _more_documents(question, documents, challenge_name)
+        return (more, 0.0, True) if len(more) > len(documents) else (documents, 0.0, False)
+    if strategy == "temperature":
+        return documents, RETRY_TEMPERATURE, False
+    return documents, 0.0, False
+
+def next_strategy(state, build_context) -> Optional[str]:
+    """
+    The first untried strategy whose prompt differs from every prompt already sent for
+    the current documents; None when retrying would only repeat an earlier attempt.
+    """
+    attempts = state.get("attempts") or []
+    tried_strategies = {a["strategy"] for a in attempts}
+    tried_prompts = {a["fingerprint"] for a in attempts}
+    for strategy in RETRY_STRATEGIES:
+        if strategy in tried_strategies:
+            continue
+        documents, temperature, _ = apply_strategy(strategy, state["question"], state["documents"], state["challenge_name"])
+        if fingerprint(build_context(documents), temperature) not in tried_prompts:
+            return strategy
+        logging.info(f"---RETRY STRATEGY {strategy} WOULD REPEAT AN EARLIER PROMPT, SKIPPED---")
+    return None
+
+def keep_best(state, grade: str) -> Dict:
+    """The best-graded answer so far, the current one included (earlier wins a tie)."""
+    best = state.get("best") or {}
+    if best and best["score"] >= SCORES[grade]:
+        return best
+    return {
+        "generation": state["generation"],
+        "documents": state["documents"],
+        "score": SCORES[grade],
+        "attempt": state.get("generate_count", 0),
+    }
@@ -0,0 +1,144 @@
+import os
+from functools import lru_cache
+from typing import Dict
+from dotenv import load_dotenv
+from langchain_community.chat_models import ChatOllama
+from langchain_core.output_parsers import StrOutputParser, JsonOutputParser
+from langchain_core.runnables import Runnable, RunnableParallel
+from langchain.prompts import PromptTemplate, ChatPromptTemplate, SystemMessagePromptTemplate, HumanMessagePromptTemplate
+from langchain_google_genai import ChatGoogleGenerativeAI
+
+load_dotenv()
+
+# Tag on the answer-generating chain, so streaming consumers can tell its tokens from the graders'
+ANSWER_TAG = "answer"
+
+# LLM
+# Same server the embeddings client uses (OLLAMA_HOST), so both can be pointed at a stand-in
+OLLAMA_BASE_URL = os.getenv("OLLAMA_HOST", "http://localhost:11434")
+if "://" not in OLLAMA_BASE_URL:
+    OLLAMA_BASE_URL = f"http://{OLLAMA_BASE_URL}"
+ollama_llm = ChatOllama(model="llama3.1:8b-instruct-q4_0", temperature=0, num_ctx=8192, base_url=OLLAMA_BASE_URL)
+google_llm = ChatGoogleGenerativeAI(model="gemini-2.5-flash", temperature=0)
+
+# ==== Prompts, compiled once at import ====
+router_prompt = ChatPromptTemplate.from_messages(
+    [
+        SystemMessagePromptTemplate.from_template(
+            """You are an expert at routing a user question to a vectorstore or web search. \n
+    Use the vectorstore for questions on HackTheBox challenges. \n
+    You do not need to be stringent with the keywords in the question related to these topics. \n
+    Otherwise, use web-search. Give a binary choice 'web_search' or 'vectorstore' based on the question. \n
+    Return a JSON with a single key 'datasource' and no premable or explanation. \n"""
+        ),
+        HumanMessagePromptTemplate.from_template("Route this question to the appropriate datasource: {question}"),
+    ]
+)
+
+challenge_name_prompt = ChatPromptTemplate.from_messages(
+    [
+        SystemMessagePromptTemplate.from_template(
+            """You are an expert at extracting the HackTheBox challenge name from a user question.\n
+        The challenge name MUST be in the format 'challengename'.\n
+        If the question does not reference a HackTheBox challenge, return 'unknown'.\n
+        Return ONLY the challenge name with NO preamble or explanation.\n"""
+        ),
+        HumanMessagePromptTemplate.from_template("Extract the HackTheBox challenge name, from this question: {question}"),
+    ]
+)
+
+rag_prompt = ChatPromptTemplate.from_messages(
+    [
+        SystemMessagePromptTemplate.from_template(
+            """You are an expert at question-answering tasks.\n
+        Use the following pieces of retrieved context to answer the question.\n
+        If you don't know the answer, just say that you don't know.\n
+        Provide a conversational answer with a step-by-step guide on how to solve the challenge.\n"""
+        ),
+        HumanMessagePromptTemplate.from_template(
+            "Here is the context: {context}\nAnswer this question base on the above context: {question}"
+        ),
+    ]
+)
+
+hallucination_prompt = PromptTemplate(
+    template="""You are a grader assessing whether an answer is grounded in / supported by a set of facts. \n 
+        Here are the facts:
+        \n ------- \n
+        {documents} 
+        \n ------- \n
+        Here is the answer: {generation}
+        Give a binary score 'yes' or 'no' score to indicate whether the answer is grounded in / supported by a set of facts. \n
+        Provide the binary score as a JSON with a single key 'score' and no preamble or explanation.""",
+    input_variables=["generation", "documents"],
+)
+
+answer_prompt = PromptTemplate(
+    template="""You are a grader assessing whether an answer is useful to resolve a question. \n 
+        Here is the answer:
+        \n ------- \n
+        {generation} 
+        \n ------- \n
+        Here is the question: {question}
+        Give a binary score 'yes' or 'no' to indicate whether the answer is useful to resolve a question. \n
+        Provide the binary score as a JSON with a single key 'score' and no preamble or explanation.""",
+    input_variables=["generation", "question"],
+)
+
+combined_grader_prompt = PromptTemplate(
+    template="""You are a grader assessing an answer to a question against a set of facts. \n 
+        Here are the facts:
+        \n ------- \n
+        {documents} 
+        \n ------- \n
+        Here is the answer: {generation}
+        Here is the question: {question}
+        Give a binary score 'yes' or 'no' for 'grounded', whether the answer is grounded in / supported by the set of facts. \n
+        Give a binary score 'yes' or 'no' for 'useful', whether the answer is useful to resolve the question. \n
+        Provide the scores as a JSON with the keys 'grounded' and 'useful' and no preamble or explanation.""",
+    input_variables=["generation", "documents", "question"],
+)
+
+def build_chains(llm) -> Dict[str, Runnable]:
+    """
+    Pipe every prompt into `llm` and its output parser.
+
+    Args:
+        llm: Chat model shared by all chains
+
+    Returns:
+        dict: Chain name -> compiled runnable
+    """
+    chains = {
+        "question_router": router_prompt | llm | JsonOutputParser(),
+        "challenge_name_extractor": challenge_name_prompt | llm | StrOutputParser(),
+        "rag_chain": (rag_prompt | llm | StrOutputParser()).with_config(tags=[ANSWER_TAG]),
+        "hallucination_grader": hallucination_prompt | llm | JsonOutputParser(),
+        "answer_grader": answer_prompt | llm | JsonOutputParser(),
+        "combined_grader": combined_grader_prompt | llm | JsonOutputParser(),
+    }
+    # Both graders at once on a thread pool; each prompt ignores the other's input keys
+    chains["parallel_graders"] = RunnableParallel(
+        hallucination=chains["hallucination_grader"], answer=chains["answer_grader"]
+    )
+    return chains
+
+# ==== Chain registry used by the graph nodes ====
+chains = build_chains(ollama_llm)
+# chains["rag_chain"] = rag_prompt | google_llm | StrOutputParser()
+
+question_router = chains["question_router"]
+challenge_name_extractor = chains["challenge_name_extractor"]
+rag_chain = chains["rag_chain"]
+hallucination_grader = chains["hallucination_grader"]
+answer_grader = chains["answer_grader"]
+combined_grader = chains["combined_grader"]
+parallel_graders = chains["parallel_graders"]
+
+@lru_cache(maxsize=None)
+def rag_chain_at(temperature: float) -> Runnable:
+    """`rag_chain` sampling at `temperature`, for a retry that must not reproduce the temperature-0 answer."""
+    if temperature == ollama_llm.temperature:
+        return rag_chain
+    llm = ollama_llm.model_copy(update={"temperature": temperature})
+    return (rag_prompt | llm | StrOutputParser()).with_config(tags=[ANSWER_TAG])
@@ -0,0 +1,216 @@
+import os
+import re
+import logging
+import argparse
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+from langchain.schema import Document
+from utils.vectorstore import get_vectorstore, get_index_version
+from utils.vector_backends import VectorBackend
+
+# Normalized challenge name every ingest path writes to chunk metadata
+CHALLENGE_KEY = "challenge"
+# Challenges whose vectors are kept in memory at once (least recently used are dropped)
+PARTITION_CACHE = int(os.getenv("CHALLENGE_PARTITION_CACHE", "64"))
+BACKFILL_BATCH = 500
+
+def normalize_name(name: str) -> str:
+    """'fluffy.md' -> 'fluffy', 'htb-babytwo' -> 'babytwo', 'Two Million' -> 'twomillion'"""
+    name = Path(name).stem if name.endswith(".md") else name
+    name = re.sub(r"^htb[-_]", "", name.lower())
+    return re.sub(r"[^a-z0-9]", "", name)
+
+def challenge_key(metadata: Optional[Dict]) -> str:
+    """The chunk's challenge key: the stored one, else derived from what its ingest path wrote
+    (crawler: challenge_name "htb-babytwo", doc loader: basename "fluffy.md")."""
+    if not metadata:
+        return ""
+    for field in (CHALLENGE_KEY, "challenge_name", "basename"):
+        if metadata.get(field):
+            return normalize_name(str(metadata[field]))
+    return ""
+
+def tag_challenge(chunks: List[Document], key: str) -> List[Document]:
+    """Write the challenge key on every chunk (when there is one)."""
+    if key:
+        for chunk in chunks:
+            chunk.metadata[CHALLENGE_KEY] = key
+    return chunks
+
+class ChallengeIndex:
+    """
+    Exact pre-filter index for challenge-scoped retrieval.
+
+    Keeps challenge key -> chunk ids for the whole collection (metadata only), and loads a
+    challenge's vectors by id the first time it is queried. A scoped query is then a
+    brute-force cosine search over that challenge's chunks only, so it costs
+    O(chunks-per-challenge) however large the collection grows, and is exact instead of a
+    filtered HNSW walk that has to skip every other challenge's neighbours.
+
+    Attributes:
+        vectorstore: collection the index is over
+        version: index version of the collection when the ids were read, None if never
+        ids: challenge key -> chunk ids
+    """
+
+    def __init__(self, vectorstore: VectorBackend, max_partitions: int = PARTITION_CACHE):
+        self.vectorstore = vectorstore
+        self.max_partitions = max_partitions
+        self.version: Optional[str] = None
+        self.ids: Dict[str, List[str]] = {}
+        self._partitions: "OrderedDict[str, Tuple[List[Document], np.ndarray]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {"refreshes": 0, "partition_loads": 0, "partition_hits": 0, "queries": 0}
+
+    def refresh(self, force: bool = False):
+        """Re-read the challenge -> ids map if the collection changed since it was read."""
+        version = get_index_version()
+        with self._lock:
+            if not force and self.version is not None and self.version == version:
+                return
+            stored = self.vectorstore.get(with_documents=False)
+            ids: Dict[str, List[str]] = {}
+            for cid, metadata in zip(stored["ids"], stored["metadatas"]):
+                key = challenge_key(metadata)
+                if key:
+                    ids.setdefault(key, []).append(cid)
+            self.ids = ids
+            self.version = version
+            self._partitions.clear()
+            self._stats["refreshes"] += 1
+        logging.info(f"---CHALLENGE INDEX: {len(ids)} CHALLENGES, {sum(map(len, ids.values()))} CHUNKS---")
+
+    def challenges(self) -> List[str]:
+        self.refresh()
+        return sorted(self.ids)
+
+    def ids_for(self, challenge: str) -> List[str]:
+        """Chunk ids of `challenge` (any spelling normalize_name accepts)."""
+        self.refresh()
+        return list(self.ids.get(normalize_name(challenge), ()))
+
+    def _partition(self, key: str) -> Tuple[List[Document], np.ndarray]:
+        with self._lock:
+            partition = self._partitions.get(key)
+            if partition is not None:
+                self._partitions.move_to_end(key)
+                self._stats["partition_hits"] += 1
+                return partition
+            ids = self.ids.get(key, [])
+        stored = self.vectorstore.get(ids=ids, with_embeddings=True) if ids else {"documents": [], "metadatas": [], "embeddings": []}
+        docs = [Document(page_content=text, metadata=metadata or {}) for text, metadata in zip(stored["documents"], stored["metadatas"])]
+        matrix = np.asarray(stored["embeddings"], dtype=np.float32).reshape(len(docs), -1)
+        if len(docs):
+            matrix /= np.maximum(np.linalg.norm(matrix, axis=1, keepdims=True), 1e-12)
+        with self._lock:
+            self._partitions[key] = (docs, matrix)
+            while len(self._partitions) > self.max_partitions:
+                self._partitions.popitem(last=False)
+            self._stats["partition_loads"] += 1
+        return docs, matrix
+
+    def search(self, query_embeddings: List[List[float]], challenge: str, k: int) -> List[List[Tuple[Document, float]]]:
+        """
+        Exact top-k within one challenge.
+
+        Args:
+            query_embeddings: One vector per query
+            challenge (str): Challenge name, normalized with normalize_name
+            k (int): Results per query
+
+        Returns:
+            list: Per query, (Document, cosine distance) pairs, closest first
+        """
+        self.refresh()
+        docs, matrix = self._partition(normalize_name(challenge))
+        with self._lock:
+            self._stats["queries"] += len(query_embeddings)
+        if not docs or not query_embeddings:
+            return [[] for _ in query_embeddings]
+        queries = np.asarray(query_embeddings, dtype=np.float32)
+        queries /= np.maximum(np.linalg.norm(queries, axis=1, keepdims=True), 1e-12)
+        distances = 1.0 - queries @ matrix.T
+        k = min(k, len(docs))
+        results = []
+        for row in distances:
+            top = np.argpartition(row, k - 1)[:k] if k < len(docs) else np.arange(len(docs))
+            top = top[np.argsort(row[top])]
+            results.append([(docs[i], float(row[i])) for i in top])
+        return results
+
+    def vectors(self, challenge: str, chunk_ids: List[str]) -> Dict[str, np.ndarray]:
+        """Stored unit-length vectors of some of `challenge`'s chunks, by chunk id, from its cached partition."""
+        self.refresh()
+        docs, matrix = self._partition(normalize_name(challenge))
+        wanted = set(chunk_ids)
+        return {d.metadata["chunk_id"]: matrix[i] for i, d in enumerate(docs) if d.metadata.get("chunk_id") in wanted}
+
+    def similarity_search(self, query: str, challenge: str, k: int = 8) -> List[Document]:
+        return [doc for doc, _ in self.search([self.vectorstore.embeddings.embed_query(query)], challenge, k)[0]]
+
+    def get_stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {**self._stats, "challenges": len(self.ids), "partitions_cached": len(self._partitions)}
+
+_indexes: Dict[Tuple[str, str, str], ChallengeIndex] = {}
+_indexes_lock = threading.Lock()
+
+def get_challenge_index(vectorstore: Optional[VectorBackend] = None) -> ChallengeIndex:
+    """Process-wide challenge index over `vectorstore` (default: the shared vectorstore)."""
+    vectorstore = vectorstore or get_vectorstore()
+    key = (vectorstore.backend, vectorstore.local_dir, vectorstore.collection_name)
+    with _indexes_lock:
+        index = _indexes.get(key)
+        if index is None or index.vectorstore is not vectorstore:
+            index = _indexes[key] = ChallengeIndex(vectorstore)
+        return index
+
+def backfill_challenge_keys(vectorstore: VectorBackend, batch_size: int = BACKFILL_BATCH) -> int:
+    """
+    Write the challenge key on chunks ingested before it existed (re-upserting their stored
+    embeddings, nothing is re-embedded), so metadata filters on CHALLENGE_KEY match them too.
+
+    Returns:
+        int: Chunks updated
+    """
+    updated = 0
+    for batch in vectorstore.iter_records(batch_size):
+        stale = [
+            i for i, metadata in enumerate(batch["metadatas"])
+            if challenge_key(metadata) and (metadata or {}).get(CHALLENGE_KEY) != challenge_key(metadata)
+        ]
+        if not stale:
+            continue
+        vectorstore.upsert(
+            [batch["ids"][i] for i in stale],
+            [batch["documents"][i] for i in stale],
+            [{**batch["metadatas"][i], CHALLENGE_KEY: challenge_key(batch["metadatas"][i])} for i in stale],
+            [batch["embeddings"][i] for i in stale],
+        )
+        updated += len(stale)
+    return updated
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Inspect the per-challenge index, or backfill challenge keys.")
+    parser.add_argument("--backfill", action="store_true", help="Write the challenge key on chunks that lack it")
+    args = parser.parse_args()
+
+    vectorstore = get_vectorstore()
+    if args.backfill:
+        from utils.vectorstore import bump_index_version
+        from utils.keyword_index import KEYWORD_INDEX_PATH, update_keyword_index
+
+        updated = backfill_challenge_keys(vectorstore)
+        if updated:
+            bump_index_version()
+            # The keyword index keeps its own copy of the metadata; rebuild it from the store
+            if os.path.exists(KEYWORD_INDEX_PATH):
+                os.remove(KEYWORD_INDEX_PATH)
+            update_keyword_index(vectorstore)
+        print(f"Challenge key written on {updated} chunks")
+    index = get_challenge_index(vectorstore)
+    for challenge in index.challenges():
+        print(f"{challenge}: {len(index.ids[challenge])} chunks")
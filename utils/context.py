@@ -0,0 +1,181 @@
+import os
+import logging
+import threading
+from bisect import bisect_right
+from typing import Dict, List, Optional, Tuple
+from langchain.schema import Document
+
+# Tokens of retrieved context per prompt: num_ctx (8192) minus room for the prompt
+# instructions, the question and the answer, which the grader prompts also carry
+TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "5120"))
+# Same encoding the text splitters count chunk sizes in
+ENCODING = "gpt2"
+# Shortest suffix/prefix match treated as splitter overlap rather than coincidence
+MIN_OVERLAP = 32
+# A truncated block shorter than this is not worth adding
+MIN_BLOCK_TOKENS = 64
+SEPARATOR = "\n\n---\n\n"
+
+_encoding = None
+_encoding_lock = threading.Lock()
+
+_stats_lock = threading.Lock()
+_stats = {"requests": 0, "tokens_raw": 0, "tokens": 0, "duplicates": 0, "merged": 0, "truncated": 0}
+
+def _get_encoding():
+    global _encoding
+    with _encoding_lock:
+        if _encoding is None:
+            try:
+                import tiktoken
+
+                _encoding = tiktoken.get_encoding(ENCODING)
+            except Exception as e:
+                logging.warning(f"---CONTEXT: TIKTOKEN UNAVAILABLE ({e}), ESTIMATING 4 CHARS PER TOKEN---")
+                _encoding = False
+        return _encoding
+
+def count_tokens(text: str) -> int:
+    encoding = _get_encoding()
+    if encoding:
+        return len(encoding.encode(text, disallowed_special=()))
+    return (len(text) + 3) // 4
+
+def count_line_tokens(text: str) -> List[int]:
+    """Tokens of each line of `text` (its newline included), from a single encode of the whole text."""
+    lines = text.split("\n")
+    encoding = _get_encoding()
+    if not encoding:
+        return [(len(line) + 4) // 4 for line in lines]
+    _, offsets = encoding.decode_with_offsets(encoding.encode(text, disallowed_special=()))
+    starts = [0]
+    for line in lines[:-1]:
+        starts.append(starts[-1] + len(line) + 1)
+    counts = [0] * len(lines)
+    for offset in offsets:
+        counts[bisect_right(starts, offset) - 1] += 1
+    return counts
+
+def truncate_tokens(text: str, tokens: int) -> str:
+    encoding = _get_encoding()
+    if encoding:
+        return encoding.decode(encoding.encode(text, disallowed_special=())[:tokens])
+    return text[: tokens * 4]
+
+def _as_list(documents) -> List[Document]:
+    if documents is None:
+        return []
+    if isinstance(documents, Document):
+        return [documents]
+    return [d if isinstance(d, Document) else Document(page_content=str(d)) for d in documents]
+
+def _position(doc: Document) -> Tuple[str, Optional[int]]:
+    """(source, chunk index) from the chunk_id set at ingest ("<source hash>-<index>")."""
+    source = doc.metadata.get("source") or doc.metadata.get("basename") or ""
+    chunk_id = doc.metadata.get("chunk_id") or ""
+    prefix, _, index = chunk_id.rpartition("-")
+    if prefix and index.isdigit():
+        return source or prefix, int(index)
+    return source, None
+
+def _overlap(head: str, tail: str) -> int:
+    """Length of the longest suffix of `head` that is a prefix of `tail` (splitter overlap), or 0."""
+    probe = tail[:MIN_OVERLAP]
+    if len(probe) < MIN_OVERLAP:
+        return 0
+    start = head.rfind(probe, max(0, len(head) - len(tail)))
+    while start != -1:
+        if tail.startswith(head[start:]):
+            return len(head) - start
+        start = head.rfind(probe, 0, start + len(probe) - 1)
+    return 0
+
+def _merge(head: str, tail: str) -> Optional[str]:
+    """`head` + `tail` without the repeated overlap, or None when they do not overlap."""
+    overlap = _overlap(head, tail)
+    return head + tail[overlap:] if overlap else None
+
+def assemble_context(documents, token_budget: int = TOKEN_BUDGET) -> Tuple[str, Dict[str, int]]:
+    """
+    Turn retrieved documents into the prompt context.
+
+    Exact and contained duplicates are dropped, chunks that are adjacent in the same source
+    (consecutive chunk ids, or splitter overlap) are stitched into one block without the
+    overlap, only page_content is rendered, and blocks are added in relevance order until
+    `token_budget` is used up (the last one truncated to fit).
+
+    Args:
+        documents: Retrieved documents in relevance order (a list, a single Document or None)
+        token_budget (int): Maximum tokens of context
+
+    Returns:
+        tuple: (context string, stats with tokens_raw/tokens/tokens_saved and what was
+        deduplicated, merged and truncated)
+    """
+    docs = _as_list(documents)
+    stats = {"chunks": len(docs), "blocks": 0, "duplicates": 0, "merged": 0, "truncated": 0}
+
+    # 1. Drop duplicates, keeping the best-ranked copy
+    kept: List[Tuple[int, Document]] = []
+    for rank, doc in enumerate(docs):
+        text = doc.page_content.strip()
+        if not text or any(text in other.page_content for _, other in kept):
+            stats["duplicates"] += 1
+            continue
+        kept.append((rank, doc))
+
+    # 2. Stitch neighbours from the same source into blocks, ranked by their best chunk
+    by_source: Dict[str, List[Tuple[int, Document]]] = {}
+    for rank, doc in kept:
+        by_source.setdefault(_position(doc)[0], []).append((rank, doc))
+    blocks: List[Tuple[int, str]] = []
+    for chunks in by_source.values():
+        chunks.sort(key=lambda item: (_position(item[1])[1] is None, _position(item[1])[1] or 0, item[0]))
+        best, text, index = chunks[0][0], chunks[0][1].page_content.strip(), _position(chunks[0][1])[1]
+        for rank, doc in chunks[1:]:
+            next_text, next_index = doc.page_content.strip(), _position(doc)[1]
+            merged = _merge(text, next_text)
+            if merged is None and index is not None and next_index == index + 1:
+                merged = f"{text}\n{next_text}"
+            if merged is None:
+                blocks.append((best, text))
+                best, text = rank, next_text
+            else:
+                stats["merged"] += 1
+                best, text = min(best, rank), merged
+            index = next_index
+        blocks.append((best, text))
+    blocks.sort()
+
+    # 3. Fill the budget in relevance order
+    parts: List[str] = []
+    used = 0
+    separator_tokens = count_tokens(SEPARATOR)
+    for _, text in blocks:
+        tokens = count_tokens(text) + (separator_tokens if parts else 0)
+        if used + tokens > token_budget:
+            remaining = token_budget - used - (separator_tokens if parts else 0)
+            if remaining >= MIN_BLOCK_TOKENS:
+                parts.append(truncate_tokens(text, remaining))
+                used += remaining
+            stats["truncated"] += 1
+            break
+        parts.append(text)
+        used += tokens
+
+    context = SEPARATOR.join(parts)
+    stats["blocks"] = len(parts)
+    # What the prompt used to carry: the repr of the document list, metadata included
+    stats["tokens_raw"] = count_tokens(str(documents)) if docs else 0
+    stats["tokens"] = count_tokens(context)
+    stats["tokens_saved"] = max(0, stats["tokens_raw"] - stats["tokens"])
+
+    with _stats_lock:
+        _stats["requests"] += 1
+        for key in ("tokens_raw", "tokens", "duplicates", "merged", "truncated"):
+            _stats[key] += stats[key]
+    return context, stats
+
+def get_stats() -> Dict[str, int]:
+    with _stats_lock:
+        return {**_stats, "tokens_saved": max(0, _stats["tokens_raw"] - _stats["tokens"])}
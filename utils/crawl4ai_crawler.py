@@ -1,14 +1,20 @@
-import asyncio, argparse, re
-from sitemap_parser import get_urls_from_sitemap
+import asyncio, argparse, re, os
+from utils.sitemap_parser import SitemapWalker
 from urllib.parse import urlparse, unquote
-from typing import List, Tuple
+from typing import AsyncIterable, AsyncIterator, Dict, Iterable, List, Optional, Tuple, Union
 from langchain.schema import Document
-from langchain_text_splitters import RecursiveCharacterTextSplitter
-from langchain_community.vectorstores import Chroma
-from langchain_ollama import OllamaEmbeddings
-from crawl4ai import AsyncWebCrawler, CrawlerRunConfig, CacheMode  # type: ignore
+from utils.markdown_chunker import MarkdownChunker
+from utils.vector_backends import VectorBackend
+from utils.vectorstore import get_vectorstore, bump_index_version, COLLECTION_NAME, PERSIST_DIRECTORY
+from utils.ingest_manifest import IngestManifest, prepare_source, purge_removed, commit_written
+from utils.keyword_index import update_keyword_index
+from utils.embed_pipeline import embed_and_upsert
+from crawl4ai import AsyncWebCrawler, CrawlerRunConfig, CacheMode, MemoryAdaptiveDispatcher  # type: ignore
 from crawl4ai.markdown_generation_strategy import DefaultMarkdownGenerator
 
+MANIFEST_PATH = os.path.join(PERSIST_DIRECTORY, "crawl_manifest.json")
+SITEMAP_STATE_PATH = os.path.join(PERSIST_DIRECTORY, "sitemap_state.json")
+
 # ==== Simple helper ====
 def extract_challenge_slug(url: str) -> str:
     """https://0xdf.gitlab.io/2025/09/26/htb-babytwo.html -> htb-babytwo"""
@@ -23,18 +29,20 @@ def extract_challenge_slug(url: str) -> str:
     return slug
 
 # ==== Crawler ====
-async def crawl_parallel(urls: List[str]) -> List[Tuple[str, str]]:
-    """Returns a list of (url, markdown_text) tuples."""
-    crawl_result: List[Tuple[str, str]] = []
-
+def get_run_config(stream: bool) -> CrawlerRunConfig:
     md_generator = DefaultMarkdownGenerator(
         options={"ignore_links": True, "escape_html": False, "body_width": 80}
     )
-    run_conf = CrawlerRunConfig(
+    return CrawlerRunConfig(
         markdown_generator=md_generator,
         cache_mode=CacheMode.BYPASS,
         excluded_tags=["a"]
-    ).clone(stream=False)
+    ).clone(stream=stream)
+
+async def crawl_parallel(urls: List[str]) -> List[Tuple[str, str]]:
+    """Returns a list of (url, markdown_text) tuples."""
+    crawl_result: List[Tuple[str, str]] = []
+    run_conf = get_run_config(stream=False)
 
     async with AsyncWebCrawler() as crawler:
         results = await crawler.arun_many(urls, config=run_conf)
@@ -48,12 +56,9 @@ async def crawl_parallel(urls: List[str]) -> List[Tuple[str, str]]:
 
     return crawl_result
 
-# ==== Build chunks with metadata (url, challenge_name) ====
-async def build_chunks_from_crawl(
-    urls: List[str],
-    chunk_size: int = 1000,
-    chunk_overlap: int = 200,
-) -> List[Document]:
+# ==== Build documents with metadata (url, challenge_name) ====
+async def build_docs_from_crawl(urls: List[str]) -> List[Document]:
+    """Crawls `urls` and returns one unsplit Document per page."""
     crawl_results = await crawl_parallel(urls)  
 
     docs: List[Document] = []
@@ -69,12 +74,173 @@ async def build_chunks_from_crawl(
                 },
             )
         )
+    return docs
 
-    text_splitter = RecursiveCharacterTextSplitter.from_tiktoken_encoder(
-        chunk_size=chunk_size,
-        chunk_overlap=chunk_overlap,
-    )
-    return text_splitter.split_documents(docs)
+def get_text_splitter(chunk_size: int = 1000, chunk_overlap: int = 200):
+    # Splits on headings and paragraphs, never inside fenced code blocks; sizes in tiktoken tokens
+    return MarkdownChunker(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+
+# ==== Build chunks with metadata (url, challenge_name) ====
+async def build_chunks_from_crawl(
+    urls: List[str],
+    chunk_size: int = 1000,
+    chunk_overlap: int = 200,
+) -> List[Document]:
+    docs = await build_docs_from_crawl(urls)
+    return get_text_splitter(chunk_size, chunk_overlap).split_documents(docs)
+
+# ==== Streaming crawl -> clean -> split -> embed -> upsert ====
+async def _windows(urls: Union[List[str], AsyncIterable[str]], size: int) -> AsyncIterator[List[str]]:
+    if not hasattr(urls, "__aiter__"):
+        for start in range(0, len(urls), size):
+            yield urls[start:start + size]
+        return
+    window: List[str] = []
+    async for url in urls:
+        window.append(url)
+        if len(window) >= size:
+            yield window
+            window = []
+    if window:
+        yield window
+
+async def stream_crawl(
+    urls: Union[List[str], AsyncIterable[str]],
+    max_sessions: int = 10,
+    window: int = 64,
+) -> AsyncIterator[Tuple[str, str]]:
+    """
+    Yields (url, markdown_text) as pages finish crawling. `urls` may be an async
+    iterable (e.g. the sitemap walker), so crawling starts before enumeration ends.
+
+    URLs are handed to crawl4ai `window` at a time: crawl4ai buffers finished pages
+    internally, so this is what stops it from racing ahead of a slow consumer.
+    """
+    run_conf = get_run_config(stream=True)
+    async with AsyncWebCrawler() as crawler:
+        async for batch in _windows(urls, window):
+            dispatcher = MemoryAdaptiveDispatcher(max_session_permit=max_sessions)
+            async for res in await crawler.arun_many(batch, config=run_conf, dispatcher=dispatcher):  # type: ignore
+                if res.success:
+                    md = res.markdown.raw_markdown or ""
+                    print(f"[OK] {res.url}, length: {len(md)}")
+                    yield res.url, md
+                else:
+                    print(f"[ERROR] {res.url} => {res.error_message}")
+
+async def crawl_and_index(
+    urls: Union[List[str], AsyncIterable[str]],
+    vectorstore: VectorBackend,
+    manifest: IngestManifest,
+    text_splitter,
+    known_sources: Optional[Iterable[str]] = None,
+    force: bool = False,
+    crawl_sessions: int = 10,
+    split_workers: int = 2,
+    queue_size: int = 64,
+    batch_size: int = 32,
+    embed_concurrency: int = 4,
+) -> Dict:
+    """
+    End-to-end streaming ingest. Pages flow through bounded queues
+    (crawl -> pages -> split workers -> chunks -> embedding pipeline), so memory stays
+    flat however large the site is, and every batch is queryable as soon as it is upserted.
+
+    Args:
+        urls: URLs to crawl, a list or an async iterable
+        vectorstore (VectorBackend): Target store
+        manifest (IngestManifest): Crawl manifest, unchanged pages are not re-split or re-embedded
+        text_splitter: Splitter for changed pages
+        known_sources (Iterable[str]): Every URL that still exists; manifest sources outside it are
+            purged. Read after the crawl, so it may be filled in while crawling. Defaults to `urls`
+            when that is a list, otherwise nothing is purged.
+        force (bool): Re-index every page regardless of its hash
+        crawl_sessions (int): Concurrent browser sessions
+        split_workers (int): Concurrent split workers
+        queue_size (int): Capacity of the pages and chunks queues
+        batch_size (int): Chunks per embedding request
+        embed_concurrency (int): Embedding requests in flight
+
+    Returns:
+        dict: Counts of added/updated/skipped/removed pages, chunks written and chunks/sec
+    """
+    pages: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+    chunks: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+    stats = {"added": 0, "updated": 0, "skipped": 0, "removed": 0, "chunks": 0}
+    seen = set()
+    written: List[str] = []
+
+    def on_written(batch: List[Document]):
+        commit_written(vectorstore, manifest, batch, "url")
+        written.extend(c.metadata["chunk_id"] for c in batch)
+
+    # Sentinels are only sent on a clean finish: when a stage fails every stage is cancelled,
+    # and a put into a queue nobody reads any more would block forever
+    async def crawl_stage():
+        async for url, markdown_text in stream_crawl(urls, crawl_sessions, window=queue_size):
+            if not markdown_text.strip():
+                continue
+            await pages.put(Document(
+                page_content=markdown_text,
+                metadata={"url": url, "challenge_name": extract_challenge_slug(url)},
+            ))
+        for _ in range(split_workers):
+            await pages.put(None)
+
+    async def split_stage():
+        while (doc := await pages.get()) is not None:
+            seen.add(doc.metadata["url"])
+            status, doc_chunks = await asyncio.to_thread(
+                prepare_source, vectorstore, doc, text_splitter, manifest, "url", force
+            )
+            stats[status] += 1
+            if status == "skipped":
+                continue
+            stats["chunks"] += len(doc_chunks)
+            for chunk in doc_chunks:
+                await chunks.put(chunk)
+        await chunks.put(None)
+
+    async def drain_chunks():
+        finished = 0
+        while finished < split_workers:
+            chunk = await chunks.get()
+            if chunk is None:
+                finished += 1
+                continue
+            yield chunk
+
+    stages = [asyncio.create_task(crawl_stage())]
+    stages += [asyncio.create_task(split_stage()) for _ in range(split_workers)]
+    # A page is recorded in the manifest once all of its chunks are upserted
+    stages.append(asyncio.create_task(embed_and_upsert(
+        drain_chunks(), vectorstore, batch_size=batch_size, concurrency=embed_concurrency,
+        on_written=on_written,
+    )))
+    try:
+        *_, result = await asyncio.gather(*stages)
+    except BaseException:
+        for stage in stages:
+            stage.cancel()
+        await asyncio.gather(*stages, return_exceptions=True)
+        # Keep the pages that were fully written before the failure
+        manifest.abandon_staged()
+        await asyncio.to_thread(manifest.save)
+        raise
+
+    manifest.abandon_staged()
+    # Only URLs that disappeared from the sitemap are purged, not ones that failed to crawl
+    if known_sources is None and isinstance(urls, list):
+        known_sources = urls
+    if known_sources is not None:
+        await asyncio.to_thread(purge_removed, vectorstore, manifest, seen | set(known_sources), stats)
+    await asyncio.to_thread(manifest.save)
+    if stats["chunks"] or stats["removed"]:
+        await asyncio.to_thread(update_keyword_index, vectorstore, written)
+        bump_index_version()
+    stats["failed_batches"] = result["failed_batches"]
+    stats["chunks_per_sec"] = round(result["chunks_per_sec"], 1)
+    return stats
 
 async def main():
     parser = argparse.ArgumentParser(description="Crawl URLs from a sitemap and store in Chroma DB.")
@@ -82,25 +248,42 @@ async def main():
     parser.add_argument("-p", "--pattern", default="", help="Regex pattern to filter URLs")
     parser.add_argument("--max_depth", type=int, default=3, help="Max recursion depth for sitemap indexes")
     parser.add_argument("--timeout", type=int, default=10, help="HTTP request timeout in seconds")
+    parser.add_argument("--full", action="store_true", help="Re-index every page, even if its content hash is unchanged")
+    parser.add_argument("--batch-size", type=int, default=32, help="Chunks per embedding request")
+    parser.add_argument("--concurrency", type=int, default=4, help="Embedding requests in flight")
+    parser.add_argument("--crawl-sessions", type=int, default=10, help="Concurrent browser sessions")
+    parser.add_argument("--split-workers", type=int, default=2, help="Concurrent split workers")
+    parser.add_argument("--queue-size", type=int, default=64, help="Capacity of the queues between stages")
+    parser.add_argument("--sitemap-concurrency", type=int, default=8, help="Sitemaps fetched in parallel")
     args = parser.parse_args()
 
-    urls = get_urls_from_sitemap(args.sitemap_url, args.pattern, args.max_depth, args.timeout)
-    print(f"Found {len(urls)} URLs from sitemap")
-
-    if not urls:
-        print("No URLs found to crawl")
-        return
-
-    print(f"Found {len(urls)} URLs to crawl")
-    doc_splits = await build_chunks_from_crawl(urls)
+    # URLs stream out of the walker into the crawler; with --full every URL is returned,
+    # otherwise only those whose <lastmod> moved since the last run
+    walker = SitemapWalker(
+        args.sitemap_url, args.pattern, args.max_depth, args.timeout, args.sitemap_concurrency, SITEMAP_STATE_PATH
+    )
+    if args.full:
+        walker.state = {"sitemaps": {}}
+    manifest = IngestManifest(MANIFEST_PATH)
 
-    Chroma.from_documents(
-        documents=doc_splits,
-        collection_name="htb_2025",                
-        persist_directory="D:/AI-LLM/Agents/RAGAgent/crawled_data_store",  
-        embedding=OllamaEmbeddings(model="bge-m3")
+    stats = await crawl_and_index(
+        walker.iter_urls(save_state=False),
+        get_vectorstore(),
+        manifest,
+        get_text_splitter(),
+        # filled in by the walker as it goes, complete by the time the purge runs
+        known_sources=walker.known_urls,
+        force=args.full,
+        crawl_sessions=args.crawl_sessions,
+        split_workers=args.split_workers,
+        queue_size=args.queue_size,
+        batch_size=args.batch_size,
+        embed_concurrency=args.concurrency,
     )
-    print(f"Persisted {len(doc_splits)} chunks -> collection 'htb_2025' in 'crawled_data_store'")
+    # Pages that failed to crawl or embed are returned again next run
+    walker.forget(walker.known_urls.difference(manifest.indexed_sources()))
+    walker.save_state()
+    print(f"Persisted {stats['chunks']} chunks -> collection '{COLLECTION_NAME}': {stats}")
 
 if __name__ == "__main__":
     asyncio.run(main())
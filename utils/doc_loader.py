@@ -1,42 +1,83 @@
-from langchain.document_loaders import DirectoryLoader
-from typing import List
+import os
+import asyncio
+import argparse
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterator, List
 from pathlib import Path
 from langchain.schema import Document
-from langchain_text_splitters import RecursiveCharacterTextSplitter
-from langchain_community.vectorstores import Chroma
-from langchain_ollama import OllamaEmbeddings
+from utils.markdown_chunker import MarkdownChunker
+from utils.challenge_index import CHALLENGE_KEY, normalize_name
+from utils.vectorstore import get_vectorstore, PERSIST_DIRECTORY
+from utils.ingest_manifest import IngestManifest, aindex_incrementally
 
-DATA_PATH = "D:/AI-LLM/Agents/RAGAgent/data"
+# Directory of Markdown writeups, searched recursively
+DATA_PATH = os.getenv("DATA_PATH", str(Path(__file__).resolve().parent.parent / "data"))
+# Files read concurrently; reads and UTF-8 decoding release the GIL, so threads are enough
+LOAD_WORKERS = int(os.getenv("DOC_LOADER_WORKERS", "8"))
+MANIFEST_PATH = os.path.join(PERSIST_DIRECTORY, "doc_manifest.json")
 
-def load_docs():
-    docs = DirectoryLoader(DATA_PATH, glob="**/*.md", show_progress=True).load()
-    return docs
+def read_markdown(path: Path) -> Document:
+    """One writeup as a Document, with its challenge metadata ("fluffy.md" -> challenge_name "fluffy")."""
+    return Document(
+        page_content=path.read_text(encoding="utf-8", errors="replace"),
+        metadata={
+            "source": str(path),
+            "basename": path.name,
+            "challenge_name": path.stem,
+            CHALLENGE_KEY: normalize_name(path.name),
+        },
+    )
+
+def iter_docs(data_path: str = DATA_PATH, workers: int = LOAD_WORKERS) -> Iterator[Document]:
+    """
+    Lazily yield every *.md under `data_path`, in path order, read on a thread pool.
+
+    At most a few files per worker are read ahead of the consumer, so memory stays flat
+    however large the corpus is.
+    """
+    workers = max(1, workers)
+    paths = sorted(Path(data_path).rglob("*.md"))
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="doc_loader") as pool:
+        pending = deque()
+        for path in paths:
+            pending.append(pool.submit(read_markdown, path))
+            if len(pending) >= workers * 4:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+def load_docs(data_path: str = DATA_PATH, workers: int = LOAD_WORKERS) -> List[Document]:
+    return list(iter_docs(data_path, workers))
+
+def get_text_splitter(chunk_size: int = 1000, chunk_overlap: int = 200):
+    # Splits on headings and paragraphs, never inside fenced code blocks; sizes in tiktoken tokens
+    return MarkdownChunker(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
 
 def build_chunks_from_docs(
     chunk_size: int = 1000,
     chunk_overlap: int = 200,
+    data_path: str = DATA_PATH,
 ) -> List[Document]:
-    docs = load_docs()  
-
-    # Add metadata to each document
-    for d in docs:
-        src = Path(d.metadata['source'])
-        d.metadata["basename"] = src.name
-        
-    text_splitter = RecursiveCharacterTextSplitter.from_tiktoken_encoder(
-        chunk_size=chunk_size,
-        chunk_overlap=chunk_overlap,
-    )
-    return text_splitter.split_documents(docs)
+    return get_text_splitter(chunk_size, chunk_overlap).split_documents(iter_docs(data_path))
 
 if __name__ == "__main__":
-    doc_splits = build_chunks_from_docs()
-    print(f"Built {len(doc_splits)} chunks from PDFs in {DATA_PATH}")
-    
-    # Persist to Chroma DB
-    Chroma.from_documents(
-        documents=doc_splits,
-        collection_name="htb_2025",                
-        persist_directory="D:/AI-LLM/Agents/RAGAgent/crawled_data_store",  
-        embedding=OllamaEmbeddings(model="bge-m3")
-    )
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Index Markdown writeups into Chroma DB.")
+    parser.add_argument("--data-path", default=DATA_PATH, help="Directory of Markdown writeups (default: DATA_PATH)")
+    parser.add_argument("--workers", type=int, default=LOAD_WORKERS, help="Files read concurrently")
+    parser.add_argument("--full", action="store_true", help="Re-index every file, even if its content hash is unchanged")
+    parser.add_argument("--batch-size", type=int, default=32, help="Chunks per embedding request")
+    parser.add_argument("--concurrency", type=int, default=4, help="Embedding requests in flight")
+    args = parser.parse_args()
+
+    stats = asyncio.run(aindex_incrementally(
+        get_vectorstore(),
+        iter_docs(args.data_path, args.workers),
+        get_text_splitter(),
+        IngestManifest(MANIFEST_PATH),
+        source_key="source",
+        force=args.full,
+        batch_size=args.batch_size,
+        concurrency=args.concurrency,
+    ))
+    print(f"Indexed {args.data_path}: {stats}")
@@ -0,0 +1,118 @@
+import time
+import asyncio
+import hashlib
+import logging
+from typing import AsyncIterable, Callable, Dict, Iterable, List, Optional, Union
+from langchain.schema import Document
+from langchain_core.embeddings import Embeddings
+from utils.vector_backends import VectorBackend
+
+BATCH_SIZE = 32
+CONCURRENCY = 4
+MAX_RETRIES = 3
+
+def _chunk_id(doc: Document) -> str:
+    return doc.metadata.get("chunk_id") or hashlib.sha1(doc.page_content.encode("utf-8")).hexdigest()
+
+def upsert_embedded(vectorstore: VectorBackend, docs: List[Document], vectors: List[List[float]]):
+    """Write already-embedded chunks to the collection without embedding them again."""
+    vectorstore.upsert(
+        [_chunk_id(d) for d in docs],
+        [d.page_content for d in docs],
+        [d.metadata for d in docs],
+        vectors,
+    )
+
+async def _iter_batches(chunks: Union[Iterable[Document], AsyncIterable[Document]], batch_size: int):
+    batch: List[Document] = []
+    if hasattr(chunks, "__aiter__"):
+        async for chunk in chunks:
+            batch.append(chunk)
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+    else:
+        for chunk in chunks:
+            batch.append(chunk)
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+                # let finished batches be written while a sync producer is splitting
+                await asyncio.sleep(0)
+    if batch:
+        yield batch
+
+async def _embed_with_retry(embeddings: Embeddings, texts: List[str], max_retries: int) -> List[List[float]]:
+    for attempt in range(max_retries + 1):
+        try:
+            return await embeddings.aembed_documents(texts)
+        except Exception as e:
+            if attempt == max_retries:
+                raise
+            delay = 2 ** attempt
+            logging.warning(f"---EMBED BATCH FAILED ({e}), RETRY {attempt + 1}/{max_retries} IN {delay}s---")
+            await asyncio.sleep(delay)
+
+async def embed_and_upsert(
+    chunks: Union[Iterable[Document], AsyncIterable[Document]],
+    vectorstore: VectorBackend,
+    embeddings: Embeddings = None,
+    batch_size: int = BATCH_SIZE,
+    concurrency: int = CONCURRENCY,
+    max_retries: int = MAX_RETRIES,
+    on_written: Optional[Callable[[List[Document]], None]] = None,
+) -> Dict:
+    """
+    Embed chunks in batches with bounded concurrency and write each batch as soon as it is done.
+
+    At most `concurrency` batches are in flight; the producer waits for a free slot before
+    pulling the next batch, so a slow embedding server back-pressures chunking instead of
+    letting chunks pile up in memory.
+
+    Args:
+        chunks: Sync or async iterable of chunk Documents
+        vectorstore (VectorBackend): Target store
+        embeddings (Embeddings): Embedding client, defaults to the store's embedding function
+        batch_size (int): Chunks per embedding request
+        concurrency (int): Embedding requests in flight
+        max_retries (int): Retries per batch before it is given up
+        on_written (callable): Called in a worker thread with each batch once it is upserted
+
+    Returns:
+        dict: chunks/batches written, failed_batches, failed (list of Documents), seconds, chunks_per_sec
+    """
+    embeddings = embeddings or vectorstore.embeddings
+    slots = asyncio.Semaphore(concurrency)
+    stats = {"chunks": 0, "batches": 0, "failed_batches": 0, "failed": []}
+    tasks = set()
+    started = time.perf_counter()
+
+    async def run(batch: List[Document]):
+        try:
+            vectors = await _embed_with_retry(embeddings, [d.page_content for d in batch], max_retries)
+            await asyncio.to_thread(upsert_embedded, vectorstore, batch, vectors)
+        except Exception as e:
+            logging.error(f"---EMBED BATCH DROPPED AFTER {max_retries} RETRIES: {e}---")
+            stats["failed_batches"] += 1
+            stats["failed"].extend(batch)
+        else:
+            stats["chunks"] += len(batch)
+            stats["batches"] += 1
+            if on_written is not None:
+                await asyncio.to_thread(on_written, batch)
+        finally:
+            slots.release()
+
+    async for batch in _iter_batches(chunks, batch_size):
+        await slots.acquire()
+        task = asyncio.create_task(run(batch))
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
+    if tasks:
+        await asyncio.gather(*tasks)
+
+    stats["seconds"] = time.perf_counter() - started
+    stats["chunks_per_sec"] = stats["chunks"] / stats["seconds"] if stats["seconds"] else 0.0
+    print(f"Embedded {stats['chunks']} chunks in {stats['batches']} batches "
+          f"({stats['chunks_per_sec']:.1f} chunks/sec, {stats['failed_batches']} failed batches)")
+    return stats
@@ -0,0 +1,142 @@
+import os
+import sqlite3
+import hashlib
+import threading
+import unicodedata
+from array import array
+from collections import OrderedDict
+from typing import Dict, List, Optional
+from langchain_core.embeddings import Embeddings
+
+CACHE_PATH = os.getenv("EMBEDDING_CACHE_PATH", os.path.join(os.path.expanduser("~"), ".cache", "ragagent", "embeddings.sqlite"))
+MEMORY_SIZE = int(os.getenv("EMBEDDING_CACHE_SIZE", "4096"))
+
+def normalize_text(text: str) -> str:
+    """Unicode-normalize and collapse whitespace so trivially different texts share a key."""
+    return " ".join(unicodedata.normalize("NFC", text).split())
+
+def cache_key(model: str, text: str) -> str:
+    """Content address of `text` embedded by `model`."""
+    return hashlib.sha256(f"{model}\0{normalize_text(text)}".encode("utf-8")).hexdigest()
+
+class CachedEmbeddings(Embeddings):
+    """
+    Wraps an Embeddings client with a bounded in-memory LRU backed by a SQLite tier.
+
+    Vectors are keyed by model name + normalized text, so a repeated question or an
+    unchanged chunk is never sent to the embedding model twice.
+    """
+
+    def __init__(
+        self,
+        embeddings: Embeddings,
+        model: str,
+        memory_size: int = MEMORY_SIZE,
+        path: Optional[str] = CACHE_PATH,
+    ):
+        self.embeddings = embeddings
+        self.model = model
+        self.memory_size = memory_size
+        self._lru: "OrderedDict[str, List[float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "disk_hits": 0, "misses": 0, "evictions": 0}
+        self._db = None
+        if path:
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA mmap_size=268435456")
+            self._db.execute("CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB)")
+            self._db.commit()
+
+    def _remember(self, key: str, vector: List[float]):
+        self._lru[key] = vector
+        self._lru.move_to_end(key)
+        while len(self._lru) > self.memory_size:
+            self._lru.popitem(last=False)
+            self._stats["evictions"] += 1
+
+    def _lookup(self, keys: List[str]) -> Dict[str, List[float]]:
+        found: Dict[str, List[float]] = {}
+        with self._lock:
+            for key in keys:
+                if key in self._lru:
+                    self._lru.move_to_end(key)
+                    found[key] = self._lru[key]
+                    self._stats["hits"] += 1
+            missing = [k for k in dict.fromkeys(keys) if k not in found]
+            if missing and self._db is not None:
+                # SQLite caps bound parameters, so look keys up in slices
+                for i in range(0, len(missing), 500):
+                    part = missing[i:i + 500]
+                    rows = self._db.execute(
+                        f"SELECT key, vector FROM embeddings WHERE key IN ({','.join('?' * len(part))})", part
+                    ).fetchall()
+                    for key, blob in rows:
+                        vector = array("f", blob).tolist()
+                        found[key] = vector
+                        self._remember(key, vector)
+                        self._stats["disk_hits"] += 1
+        return found
+
+    def _store(self, items: Dict[str, List[float]]):
+        with self._lock:
+            for key, vector in items.items():
+                self._remember(key, vector)
+                self._stats["misses"] += 1
+            if self._db is not None and items:
+                self._db.executemany(
+                    "INSERT OR REPLACE INTO embeddings (key, vector) VALUES (?, ?)",
+                    [(k, array("f", v).tobytes()) for k, v in items.items()],
+                )
+                self._db.commit()
+
+    def _split(self, texts: List[str]):
+        keys = [cache_key(self.model, t) for t in texts]
+        found = self._lookup(keys)
+        todo: Dict[str, str] = {}
+        for key, text in zip(keys, texts):
+            if key not in found and key not in todo:
+                todo[key] = text
+        return keys, found, todo
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        keys, found, todo = self._split(texts)
+        if todo:
+            vectors = self.embeddings.embed_documents(list(todo.values()))
+            fresh = dict(zip(todo.keys(), vectors))
+            self._store(fresh)
+            found.update(fresh)
+        return [found[k] for k in keys]
+
+    def embed_query(self, text: str) -> List[float]:
+        keys, found, todo = self._split([text])
+        if todo:
+            vector = self.embeddings.embed_query(text)
+            self._store({keys[0]: vector})
+            return vector
+        return found[keys[0]]
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        keys, found, todo = self._split(texts)
+        if todo:
+            vectors = await self.embeddings.aembed_documents(list(todo.values()))
+            fresh = dict(zip(todo.keys(), vectors))
+            self._store(fresh)
+            found.update(fresh)
+        return [found[k] for k in keys]
+
+    async def aembed_query(self, text: str) -> List[float]:
+        keys, found, todo = self._split([text])
+        if todo:
+            vector = await self.embeddings.aembed_query(text)
+            self._store({keys[0]: vector})
+            return vector
+        return found[keys[0]]
+
+    def get_stats(self) -> Dict[str, int]:
+        """Return hit/miss/eviction counters and the current LRU size."""
+        with self._lock:
+            stats = dict(self._stats)
+            stats["memory_entries"] = len(self._lru)
+        return stats
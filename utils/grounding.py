@@ -0,0 +1,219 @@
+import os
+import re
+import json
+import logging
+import threading
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+from langchain.schema import Document
+from utils.keyword_index import tokenize
+from utils.web_search import STOP_WORDS
+from utils.challenge_index import get_challenge_index, challenge_key
+from utils.vectorstore import get_vectorstore, get_embeddings, EMBEDDING_MODEL, PERSIST_DIRECTORY
+
+# "1" scores grounding locally first and only sends ambiguous answers to the LLM grader
+ENABLED = os.getenv("GROUNDING_PRECHECK", "1") == "1"
+# Scores at or above ACCEPT are grounded, at or below REJECT are not, in between go to the LLM.
+# Until benchmark/calibrate_grounding.py has written thresholds for EMBEDDING_MODEL to THRESHOLDS_PATH,
+# answers are scored on word overlap alone, which does not depend on the embedding model; these
+# defaults are calibrated for that score on benchmark/grounding_labels.jsonl.
+ACCEPT = float(os.getenv("GROUNDING_ACCEPT", "0.5"))
+REJECT = float(os.getenv("GROUNDING_REJECT", "0.3"))
+THRESHOLDS_PATH = os.getenv("GROUNDING_THRESHOLDS_PATH", os.path.join(PERSIST_DIRECTORY, "grounding_thresholds.json"))
+# Optional JSONL of (score, LLM verdict) for every ambiguous answer, to recalibrate from real traffic
+LOG_PATH = os.getenv("GROUNDING_LOG_PATH", "")
+# Sentences with fewer content words (headings, "Sure!", bare commands) are not scored
+MIN_SENTENCE_WORDS = 3
+
+SENTENCE = re.compile(r"(?<=[.!?])\s+|\n+")
+LIST_MARKER = re.compile(r"^\s*(?:[-*+>#]+|\d+[.)])\s*")
+
+_stats_lock = threading.Lock()
+_stats = {"checks": 0, "accepted": 0, "rejected": 0, "ambiguous": 0, "unscored": 0}
+_log_lock = threading.Lock()
+
+def get_stats() -> Dict[str, float]:
+    """Pre-check counters, and the share of hallucination-grader LLM calls they avoided."""
+    with _stats_lock:
+        stats = dict(_stats)
+    stats["llm_calls_avoided"] = round((stats["accepted"] + stats["rejected"]) / stats["checks"], 3) if stats["checks"] else 0.0
+    return stats
+
+def load_thresholds(path: str = THRESHOLDS_PATH, model: str = EMBEDDING_MODEL) -> Optional[Tuple[float, float]]:
+    """
+    (accept, reject) calibrated for `model`, or None when there are none. Thresholds calibrated
+    offline against benchmark/fake_ollama.py are tagged with its name and never match a real model.
+    """
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            calibrated = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if calibrated.get("embedding_model") != model:
+        logging.warning(f"---GROUNDING THRESHOLDS IN {path} ARE FOR {calibrated.get('embedding_model')}, NOT {model}; IGNORING THEM---")
+        return None
+    return calibrated["accept"], calibrated["reject"]
+
+def split_sentences(text: str) -> List[str]:
+    """Answer sentences and list items worth scoring, without list markers."""
+    sentences = []
+    for piece in SENTENCE.split(text):
+        piece = LIST_MARKER.sub("", piece).strip()
+        if len(content_words(piece)) >= MIN_SENTENCE_WORDS:
+            sentences.append(piece)
+    return sentences
+
+def content_words(text: str) -> List[str]:
+    return [t for t in tokenize(text) if t not in STOP_WORDS]
+
+def _bigrams(words: List[str]) -> set:
+    return set(zip(words, words[1:]))
+
+def _chunk_vectors(documents: List[Document]) -> np.ndarray:
+    """
+    Unit-length vectors of the context chunks: the stored ones, from the per-challenge index
+    partition retrieval just loaded, and embedded (through the embedding cache) only for
+    chunks without one, such as web results.
+    """
+    vectors: List[Optional[np.ndarray]] = [None] * len(documents)
+    by_challenge: Dict[str, List[int]] = {}
+    for i, doc in enumerate(documents):
+        key = challenge_key(doc.metadata)
+        if key and doc.metadata.get("chunk_id"):
+            by_challenge.setdefault(key, []).append(i)
+    index = get_challenge_index(get_vectorstore())
+    for key, positions in by_challenge.items():
+        stored = index.vectors(key, [documents[i].metadata["chunk_id"] for i in positions])
+        for i in positions:
+            vectors[i] = stored.get(documents[i].metadata["chunk_id"])
+    missing = [i for i, v in enumerate(vectors) if v is None]
+    if missing:
+        embedded = get_embeddings().embed_documents([documents[i].page_content for i in missing])
+        for i, vector in zip(missing, embedded):
+            vector = np.asarray(vector, dtype=np.float32)
+            vectors[i] = vector / max(float(np.linalg.norm(vector)), 1e-12)
+    return np.vstack(vectors) if vectors else np.zeros((0, 0), dtype=np.float32)
+
+def grounding_score(answer: str, documents: List[Document], context: str = "", semantic: bool = True) -> Tuple[Optional[float], Dict]:
+    """
+    How well the context supports the answer, in [0, 1], from CPU-only signals.
+
+    Each answer sentence gets the mean of its lexical support (share of its content words and
+    of its word bigrams that occur in the context) and its semantic support (cosine similarity
+    to the closest context chunk). The answer scores the average of its mean and its weakest
+    sentence, so one unsupported step in an otherwise quoted answer still pulls it down.
+
+    Args:
+        answer (str): Generated answer
+        documents (list): Context chunks, with their chunk_id metadata when they came from the vectorstore
+        context (str): Rendered prompt context, for the lexical overlap (default: the chunks' text)
+        semantic (bool): Include the semantic support; without it nothing is embedded
+
+    Returns:
+        tuple: (score, or None when no sentence is long enough to score; per-sentence details)
+    """
+    sentences = split_sentences(answer)
+    documents = [d for d in documents or [] if d.page_content.strip()]
+    if not sentences or not documents:
+        return None, {"sentences": len(sentences), "chunks": len(documents)}
+
+    context_words = content_words(context or "\n".join(d.page_content for d in documents))
+    vocabulary, bigrams = set(context_words), _bigrams(context_words)
+    lexical = []
+    for sentence in sentences:
+        words = content_words(sentence)
+        unigram = sum(w in vocabulary for w in words) / len(words)
+        pairs = _bigrams(words)
+        bigram = len(pairs & bigrams) / len(pairs) if pairs else unigram
+        lexical.append((unigram + bigram) / 2)
+    if not semantic:
+        return (float(np.mean(lexical)) + min(lexical)) / 2, {
+            "sentences": len(sentences),
+            "chunks": len(documents),
+            "lexical": round(float(np.mean(lexical)), 4),
+            "weakest": round(min(lexical), 4),
+        }
+
+    chunks = _chunk_vectors(documents)
+    embedded = np.asarray(get_embeddings().embed_documents(sentences), dtype=np.float32)
+    embedded /= np.maximum(np.linalg.norm(embedded, axis=1, keepdims=True), 1e-12)
+    semantic = np.clip((embedded @ chunks.T).max(axis=1), 0.0, 1.0)
+
+    per_sentence = [(l + float(s)) / 2 for l, s in zip(lexical, semantic)]
+    return (float(np.mean(per_sentence)) + min(per_sentence)) / 2, {
+        "sentences": len(sentences),
+        "chunks": len(documents),
+        "lexical": round(float(np.mean(lexical)), 4),
+        "semantic": round(float(np.mean(semantic)), 4),
+        "weakest": round(min(per_sentence), 4),
+    }
+
+class GroundingPrecheck:
+    """
+    Decides clear grounding cases locally so the LLM hallucination grader only sees ambiguous ones.
+
+    Attributes:
+        accept: score at or above which an answer is grounded
+        reject: score at or below which it is not
+        semantic: whether the score includes semantic support; only with thresholds calibrated
+            for the embedding model, otherwise answers are scored on word overlap alone
+    """
+
+    def __init__(self, accept: Optional[float] = None, reject: Optional[float] = None):
+        calibrated = load_thresholds()
+        self.semantic = calibrated is not None
+        if calibrated is None:
+            logging.info("---NO GROUNDING THRESHOLDS CALIBRATED FOR THE EMBEDDING MODEL, SCORING WORD OVERLAP ONLY---")
+            calibrated = ACCEPT, REJECT
+        self.accept = calibrated[0] if accept is None else accept
+        self.reject = calibrated[1] if reject is None else reject
+
+    def check(self, answer: str, documents: List[Document], context: str = "") -> Tuple[Optional[str], Optional[float]]:
+        """
+        Returns:
+            tuple: ("yes" / "no", or None to ask the LLM grader; the score, None if unscored)
+        """
+        try:
+            score, details = grounding_score(answer, documents, context, self.semantic)
+        except Exception as e:
+            logging.warning(f"---GROUNDING PRE-CHECK FAILED ({e}), USING THE LLM GRADER---")
+            score, details = None, {}
+        if score is None:
+            verdict, outcome = None, "unscored"
+        elif score >= self.accept:
+            verdict, outcome = "yes", "accepted"
+        elif score <= self.reject:
+            verdict, outcome = "no", "rejected"
+        else:
+            verdict, outcome = None, "ambiguous"
+        with _stats_lock:
+            _stats["checks"] += 1
+            _stats[outcome] += 1
+        stats = get_stats()
+        logging.info(
+            f"---GROUNDING PRE-CHECK: {outcome.upper()} (score {score if score is None else round(score, 3)}, {details}); "
+            f"{stats['llm_calls_avoided']:.0%} OF {stats['checks']} HALLUCINATION-GRADER CALLS AVOIDED---"
+        )
+        return verdict, score
+
+def log_verdict(score: Optional[float], answer: str, context: str, grade: str, semantic: bool = True, path: str = LOG_PATH):
+    """Append an LLM-graded ambiguous answer to the calibration log, if one is configured."""
+    if not path or score is None:
+        return
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    row = {"score": score, "semantic": semantic, "grounded": grade == "yes", "answer": answer, "context": context}
+    with _log_lock, open(path, "a", encoding="utf-8") as f:
+        f.write(json.dumps(row) + "\n")
+
+_precheck: Optional[GroundingPrecheck] = None
+_precheck_lock = threading.Lock()
+
+def get_precheck() -> Optional[GroundingPrecheck]:
+    """Process-wide pre-check, or None when GROUNDING_PRECHECK is off."""
+    global _precheck
+    if not ENABLED:
+        return None
+    with _precheck_lock:
+        if _precheck is None:
+            _precheck = GroundingPrecheck()
+        return _precheck
@@ -0,0 +1,128 @@
+import os
+import hashlib
+import logging
+import threading
+from typing import Dict, List, Optional
+from langchain.schema import Document
+from utils.vectorstore import get_vectorstore
+from utils.vector_backends import VectorBackend
+from utils.keyword_index import KeywordIndex, get_keyword_index
+from utils.challenge_index import get_challenge_index
+
+# "hybrid": BM25 + vector search fused with reciprocal-rank fusion; "vector": vector search only
+RETRIEVAL_MODE = os.getenv("RETRIEVAL_MODE", "hybrid")
+# Candidates taken from each retriever before fusion
+FETCH_K = int(os.getenv("HYBRID_FETCH_K", "20"))
+# RRF damping constant, 60 as in the original paper
+RRF_K = 60
+# Optional CPU cross-encoder (sentence-transformers), e.g. "cross-encoder/ms-marco-MiniLM-L-6-v2"; empty disables
+RERANK_MODEL = os.getenv("RERANK_MODEL", "")
+
+_reranker = None
+_reranker_lock = threading.Lock()
+
+def _doc_key(doc: Document) -> str:
+    # Vector hits come back without ids, so fuse on the chunk text
+    return hashlib.sha1(doc.page_content.encode("utf-8")).hexdigest()
+
+def reciprocal_rank_fusion(rankings: List[List[Document]], k: int = RRF_K) -> List[Document]:
+    """
+    Merge ranked lists: each document scores sum(1 / (k + rank)) over the lists it appears in.
+
+    Returns:
+        list: Unique documents, best fused score first
+    """
+    scores: Dict[str, float] = {}
+    docs: Dict[str, Document] = {}
+    for ranking in rankings:
+        for rank, doc in enumerate(ranking, start=1):
+            key = _doc_key(doc)
+            docs.setdefault(key, doc)
+            scores[key] = scores.get(key, 0.0) + 1.0 / (k + rank)
+    return [docs[key] for key in sorted(scores, key=scores.get, reverse=True)]
+
+def get_reranker():
+    """The RERANK_MODEL cross-encoder on CPU, loaded on first use; None if disabled or unavailable."""
+    global _reranker
+    with _reranker_lock:
+        if _reranker is None and RERANK_MODEL:
+            try:
+                from sentence_transformers import CrossEncoder
+
+                _reranker = CrossEncoder(RERANK_MODEL, device="cpu")
+            except Exception as e:
+                logging.warning(f"---RERANKER {RERANK_MODEL} UNAVAILABLE ({e}), SKIPPING RERANK---")
+                _reranker = False
+        return _reranker or None
+
+def rerank(question: str, docs: List[Document], reranker) -> List[Document]:
+    scores = reranker.predict([(question, d.page_content) for d in docs])
+    return [doc for _, doc in sorted(zip(scores, docs), key=lambda pair: pair[0], reverse=True)]
+
+def fuse_keyword_hits(
+    question: str,
+    vector_hits: List[Document],
+    k: int = 8,
+    keyword_index: Optional[KeywordIndex] = None,
+    fetch_k: int = FETCH_K,
+    **scope,
+) -> List[Document]:
+    """
+    Fuse vector hits already retrieved for `question` with its BM25 hits and optionally rerank,
+    the second half of `hybrid_search` for callers that ran the vector search themselves.
+
+    Args:
+        scope: Restricts the BM25 search as the vector search was, `ids=` or `where=` (KeywordIndex.search)
+
+    Returns:
+        list: Top-k documents
+    """
+    keyword_index = keyword_index or get_keyword_index()
+    keyword_hits = [doc for doc, _ in keyword_index.search(question, k=fetch_k, **scope)]
+    fused = reciprocal_rank_fusion([vector_hits, keyword_hits])
+
+    reranker = get_reranker()
+    if reranker is not None and fused:
+        fused = rerank(question, fused, reranker)
+    return fused[:k]
+
+def hybrid_search(
+    question: str,
+    k: int = 8,
+    filter: Optional[Dict[str, str]] = None,
+    vectorstore: Optional[VectorBackend] = None,
+    keyword_index: Optional[KeywordIndex] = None,
+    fetch_k: int = FETCH_K,
+    mode: str = RETRIEVAL_MODE,
+    challenge: Optional[str] = None,
+) -> List[Document]:
+    """
+    Retrieve with vector search and BM25, fuse with RRF and optionally rerank.
+
+    Args:
+        question (str): Query
+        k (int): Documents returned
+        filter (dict): Metadata equality filter applied to both retrievers, e.g. {"basename": "fluffy.md"}
+        vectorstore (VectorBackend): Defaults to the shared vectorstore
+        keyword_index (KeywordIndex): Defaults to the shared keyword index
+        fetch_k (int): Candidates taken from each retriever
+        mode (str): "hybrid" or "vector"
+        challenge (str): Only search this challenge's chunks, through the exact per-challenge
+            index instead of a metadata filter
+
+    Returns:
+        list: Top-k documents
+    """
+    vectorstore = vectorstore or get_vectorstore()
+    if challenge is not None:
+        challenge_index = get_challenge_index(vectorstore)
+        if mode != "hybrid":
+            return challenge_index.similarity_search(question, challenge, k=k)
+        vector_hits = challenge_index.similarity_search(question, challenge, k=fetch_k)
+        scope = {"ids": challenge_index.ids_for(challenge)}
+    else:
+        if mode != "hybrid":
+            return vectorstore.similarity_search(question, k=k, filter=filter)
+        vector_hits = vectorstore.similarity_search(question, k=fetch_k, filter=filter)
+        scope = {"where": filter}
+    return fuse_keyword_hits(question, vector_hits, k, keyword_index, fetch_k, **scope)
@@ -0,0 +1,357 @@
+import os
+import json
+import asyncio
+import hashlib
+import logging
+import threading
+from itertools import groupby
+from typing import AsyncIterator, Dict, Iterable, Iterator, List, Optional, Tuple
+from langchain.schema import Document
+from utils.vector_backends import VectorBackend
+from utils.embed_pipeline import embed_and_upsert, BATCH_SIZE, CONCURRENCY
+from utils.vectorstore import bump_index_version
+from utils.keyword_index import update_keyword_index
+from utils.challenge_index import challenge_key, tag_challenge
+
+SAVE_EVERY = 50
+# Changed documents split together, so a splitter with a process pool can spread them
+SPLIT_WINDOW = 64
+
+def content_hash(text: str) -> str:
+    """sha256 of a source's raw text."""
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+def chunk_id(source: str, index: int) -> str:
+    """Stable ID for the `index`-th chunk of `source`."""
+    return f"{hashlib.sha1(source.encode('utf-8')).hexdigest()[:16]}-{index:05d}"
+
+class IngestManifest:
+    """
+    Per-source content hashes and chunk IDs for one ingest path, persisted as JSON.
+    Safe to update from worker threads.
+
+    A changed source is staged while its chunks are being written and only recorded once
+    every one of them is, so an interrupted run leaves it looking changed, not indexed.
+
+    Attributes:
+        path: manifest file
+        namespace: prefixed to every source before its chunk IDs are derived, so ingest paths
+            that can see the same source (a crawled page and a web result for its URL) never
+            write over each other's chunks
+        entries: source -> {"hash": str, "chunk_ids": [str]}; a hash of None means the
+            source's last write did not complete
+    """
+
+    def __init__(self, path: str, namespace: str = ""):
+        self.path = path
+        self.namespace = namespace
+        self.entries: Dict[str, Dict] = {}
+        self._staged: Dict[str, Dict] = {}
+        self._unsaved = 0
+        self._lock = threading.Lock()
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                self.entries = json.load(f)
+
+    def is_unchanged(self, source: str, digest: str) -> bool:
+        entry = self.entries.get(source)
+        return entry is not None and entry["hash"] == digest
+
+    def chunk_ids(self, source: str) -> List[str]:
+        entry = self.entries.get(source)
+        return list(entry["chunk_ids"]) if entry else []
+
+    def record(self, source: str, digest: str, ids: List[str]):
+        with self._lock:
+            self.entries[source] = {"hash": digest, "chunk_ids": ids}
+            self._unsaved += 1
+            due = self._unsaved >= SAVE_EVERY
+        if due:
+            self.save()
+
+    def stage(self, source: str, digest: str, ids: List[str], old_ids: List[str]):
+        """Hold a changed source's entry back until `written` has seen all of its chunks."""
+        with self._lock:
+            self._staged[source] = {"hash": digest, "chunk_ids": ids, "old_ids": old_ids, "remaining": len(ids)}
+
+    def written(self, chunks: Iterable[Document], source_key: str = "source") -> List[Tuple[str, List[str]]]:
+        """
+        Count `chunks` as written.
+
+        Returns:
+            list: (source, old chunk IDs the new chunks did not overwrite) for every staged
+            source that is now fully written, to delete and then `commit`
+        """
+        done = []
+        with self._lock:
+            for chunk in chunks:
+                staged = self._staged.get(chunk.metadata[source_key])
+                if staged is None:
+                    continue
+                staged["remaining"] -= 1
+                if staged["remaining"] == 0:
+                    done.append((chunk.metadata[source_key], sorted(set(staged["old_ids"]) - set(staged["chunk_ids"]))))
+        return done
+
+    def commit(self, source: str):
+        with self._lock:
+            staged = self._staged.pop(source)
+        self.record(source, staged["hash"], staged["chunk_ids"])
+
+    def abandon_staged(self) -> List[str]:
+        """
+        Give up on staged sources, e.g. after a dropped batch. They are kept without a hash,
+        so the next run re-indexes them, and with both their old and new chunk IDs, so it
+        also deletes whatever is left of either.
+        """
+        with self._lock:
+            abandoned = list(self._staged)
+            for source, staged in self._staged.items():
+                self.entries[source] = {"hash": None, "chunk_ids": sorted(set(staged["old_ids"]) | set(staged["chunk_ids"]))}
+            self._staged.clear()
+        return abandoned
+
+    def forget(self, source: str):
+        with self._lock:
+            self.entries.pop(source, None)
+
+    def sources(self) -> List[str]:
+        with self._lock:
+            return list(self.entries)
+
+    def indexed_sources(self) -> List[str]:
+        """Sources whose last write completed."""
+        with self._lock:
+            return [source for source, entry in self.entries.items() if entry["hash"] is not None]
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp = f"{self.path}.tmp"
+        with self._lock:
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(self.entries, f)
+            self._unsaved = 0
+        os.replace(tmp, self.path)
+
+def prepare_source(
+    vectorstore: VectorBackend,
+    doc: Document,
+    text_splitter,
+    manifest: IngestManifest,
+    source_key: str = "source",
+    force: bool = False,
+    chunks: Optional[List[Document]] = None,
+) -> Tuple[str, List[Document]]:
+    """
+    Decide what to do with one whole document. If it is new or changed, split it (unless
+    `chunks` were already split from it), give the chunks stable IDs and the normalized
+    challenge key, and stage it in the manifest. Its old chunks stay until the new ones are
+    written: chunk IDs are positional, so those are overwritten, and `commit_written`
+    deletes the rest.
+
+    Returns:
+        tuple: ("skipped" | "added" | "updated", chunks to write)
+    """
+    source = doc.metadata[source_key]
+    digest = content_hash(doc.page_content)
+    if not force and manifest.is_unchanged(source, digest):
+        return "skipped", []
+
+    old_ids = manifest.chunk_ids(source)
+    if chunks is None:
+        chunks = text_splitter.split_documents([doc])
+    chunks = tag_challenge(chunks, challenge_key(doc.metadata))
+    ids = [chunk_id(manifest.namespace + source, i) for i in range(len(chunks))]
+    for cid, chunk in zip(ids, chunks):
+        chunk.metadata["chunk_id"] = cid
+    if chunks:
+        manifest.stage(source, digest, ids, old_ids)
+    else:
+        # Nothing to write: the source is done as soon as its old chunks are gone
+        if old_ids:
+            vectorstore.delete(ids=old_ids)
+        manifest.record(source, digest, ids)
+    return ("updated" if old_ids else "added"), chunks
+
+def commit_written(vectorstore: VectorBackend, manifest: IngestManifest, chunks: List[Document], source_key: str = "source"):
+    """
+    Call once `chunks` are in the store: every source they complete has its leftover old
+    chunks deleted and is recorded in the manifest, which is saved every SAVE_EVERY sources.
+    """
+    for source, stale_ids in manifest.written(chunks, source_key):
+        if stale_ids:
+            vectorstore.delete(ids=stale_ids)
+        manifest.commit(source)
+
+def prepare_window(
+    vectorstore: VectorBackend,
+    window: List[Document],
+    text_splitter,
+    manifest: IngestManifest,
+    stats: Dict[str, int],
+    source_key: str = "source",
+    force: bool = False,
+) -> List[Document]:
+    """`prepare_source` for a window of documents, split together; the chunks to write."""
+    presplit = _split_changed(window, text_splitter, manifest, source_key, force)
+    changed: List[Document] = []
+    for doc in window:
+        source = doc.metadata[source_key]
+        stats.setdefault("seen", set()).add(source)
+        status, chunks = prepare_source(vectorstore, doc, text_splitter, manifest, source_key, force, presplit.get(source))
+        stats[status] += 1
+        stats["chunks"] += len(chunks)
+        changed.extend(chunks)
+    return changed
+
+def iter_changed_chunks(
+    vectorstore: VectorBackend,
+    docs: Iterable[Document],
+    text_splitter,
+    manifest: IngestManifest,
+    stats: Dict[str, int],
+    source_key: str = "source",
+    force: bool = False,
+) -> Iterator[Document]:
+    """
+    Yield the chunks of new/changed sources, staging them in the manifest. Unchanged
+    sources are counted as skipped and yield nothing.
+    """
+    for window in _windows(docs, SPLIT_WINDOW):
+        yield from prepare_window(vectorstore, window, text_splitter, manifest, stats, source_key, force)
+
+async def aiter_changed_chunks(
+    vectorstore: VectorBackend,
+    docs: Iterable[Document],
+    text_splitter,
+    manifest: IngestManifest,
+    stats: Dict[str, int],
+    source_key: str = "source",
+    force: bool = False,
+) -> AsyncIterator[Document]:
+    """`iter_changed_chunks` with loading and splitting in a worker thread, off the event loop."""
+    windows = _windows(docs, SPLIT_WINDOW)
+    while (window := await asyncio.to_thread(next, windows, None)) is not None:
+        for chunk in await asyncio.to_thread(prepare_window, vectorstore, window, text_splitter, manifest, stats, source_key, force):
+            yield chunk
+
+def _windows(docs: Iterable[Document], size: int) -> Iterator[List[Document]]:
+    window: List[Document] = []
+    for doc in docs:
+        window.append(doc)
+        if len(window) >= size:
+            yield window
+            window = []
+    if window:
+        yield window
+
+def _split_changed(
+    window: List[Document], text_splitter, manifest: IngestManifest, source_key: str, force: bool
+) -> Dict[str, List[Document]]:
+    """Split the window's new/changed documents in one call; chunks by source."""
+    changed = [
+        d for d in window
+        if force or not manifest.is_unchanged(d.metadata[source_key], content_hash(d.page_content))
+    ]
+    if len(changed) < 2 or len({d.metadata[source_key] for d in changed}) < len(changed):
+        return {}
+    split: Dict[str, List[Document]] = {d.metadata[source_key]: [] for d in changed}
+    for chunk in text_splitter.split_documents(changed):
+        split[chunk.metadata[source_key]].append(chunk)
+    return split
+
+def purge_removed(vectorstore: VectorBackend, manifest: IngestManifest, known: Iterable[str], stats: Dict[str, int]):
+    """Delete the chunks of every manifest source that is not in `known`."""
+    known = set(known)
+    for source in manifest.sources():
+        if source not in known:
+            old_ids = manifest.chunk_ids(source)
+            if old_ids:
+                vectorstore.delete(ids=old_ids)
+            manifest.forget(source)
+            stats["removed"] += 1
+
+def index_incrementally(
+    vectorstore: VectorBackend,
+    docs: Iterable[Document],
+    text_splitter,
+    manifest: IngestManifest,
+    source_key: str = "source",
+    known_sources: Optional[Iterable[str]] = None,
+    force: bool = False,
+) -> Dict[str, int]:
+    """
+    Sync whole (unsplit) documents into the vectorstore using the manifest.
+
+    Unchanged sources are skipped, changed ones have their old chunks deleted and
+    replaced, and sources in the manifest that are no longer known are purged.
+
+    Args:
+        vectorstore (VectorBackend): Target store
+        docs (Iterable[Document]): One document per source, identified by metadata[source_key]
+        text_splitter: Splitter used to chunk new/changed documents
+        manifest (IngestManifest): Manifest for this ingest path
+        source_key (str): Metadata key holding the source identifier
+        known_sources (Iterable[str]): Every source that still exists. Defaults to the sources in `docs`.
+            Pass the full URL list for crawls so failed fetches are not purged.
+        force (bool): Re-index every source regardless of its hash
+
+    Returns:
+        dict: Counts of added/updated/skipped/removed sources and written chunks
+    """
+    stats = {"added": 0, "updated": 0, "skipped": 0, "removed": 0, "chunks": 0}
+    written: List[str] = []
+    chunks = iter_changed_chunks(vectorstore, docs, text_splitter, manifest, stats, source_key, force)
+    for source, group in groupby(chunks, key=lambda c: c.metadata[source_key]):
+        group = list(group)
+        ids = [c.metadata["chunk_id"] for c in group]
+        vectorstore.add_documents(group, ids=ids)
+        commit_written(vectorstore, manifest, group, source_key)
+        written.extend(ids)
+
+    seen = stats.pop("seen", set())
+    purge_removed(vectorstore, manifest, seen | set(known_sources or ()), stats)
+    manifest.save()
+    if stats["chunks"] or stats["removed"]:
+        update_keyword_index(vectorstore, written)
+        bump_index_version()
+    logging.info(f"---INCREMENTAL INGEST: {stats}---")
+    return stats
+
+async def aindex_incrementally(
+    vectorstore: VectorBackend,
+    docs: Iterable[Document],
+    text_splitter,
+    manifest: IngestManifest,
+    source_key: str = "source",
+    known_sources: Optional[Iterable[str]] = None,
+    force: bool = False,
+    batch_size: int = BATCH_SIZE,
+    concurrency: int = CONCURRENCY,
+) -> Dict[str, int]:
+    """
+    Same as `index_incrementally`, but changed chunks go through the batched, concurrent
+    embedding pipeline, and splitting and deletes run in worker threads. Sources with a
+    dropped batch are left unrecorded so the next run retries them.
+    """
+    stats = {"added": 0, "updated": 0, "skipped": 0, "removed": 0, "chunks": 0}
+    written: List[str] = []
+
+    def on_written(batch: List[Document]):
+        commit_written(vectorstore, manifest, batch, source_key)
+        written.extend(c.metadata["chunk_id"] for c in batch)
+
+    chunks = aiter_changed_chunks(vectorstore, docs, text_splitter, manifest, stats, source_key, force)
+    result = await embed_and_upsert(chunks, vectorstore, batch_size=batch_size, concurrency=concurrency, on_written=on_written)
+    manifest.abandon_staged()
+
+    seen = stats.pop("seen", set())
+    await asyncio.to_thread(purge_removed, vectorstore, manifest, seen | set(known_sources or ()), stats)
+    await asyncio.to_thread(manifest.save)
+    if stats["chunks"] or stats["removed"]:
+        await asyncio.to_thread(update_keyword_index, vectorstore, written)
+        bump_index_version()
+    stats["failed_batches"] = result["failed_batches"]
+    stats["chunks_per_sec"] = round(result["chunks_per_sec"], 1)
+    logging.info(f"---INCREMENTAL INGEST: {stats}---")
+    return stats
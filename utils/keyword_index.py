@@ -0,0 +1,209 @@
+import os
+import re
+import json
+import math
+import heapq
+import logging
+import argparse
+import threading
+from collections import Counter
+from typing import Dict, Iterable, List, Optional, Tuple
+from langchain.schema import Document
+from utils.vectorstore import get_vectorstore, get_index_version, COLLECTION_NAME, PERSIST_DIRECTORY
+from utils.vector_backends import VectorBackend
+
+# BM25 index over the same chunks as the vector collection, persisted next to it
+KEYWORD_INDEX_PATH = os.path.join(PERSIST_DIRECTORY, f"bm25_{COLLECTION_NAME}.json")
+K1 = 1.5
+B = 0.75
+SYNC_BATCH = 500
+
+# Keeps exact tokens such as "cve-2021-1675", "10.10.11.69", "fluffy.htb" and "ms-rpc" whole
+TOKEN_PATTERN = re.compile(r"[a-z0-9](?:[a-z0-9._\-/]*[a-z0-9])?")
+SUBTOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+
+def tokenize(text: str) -> List[str]:
+    """Lowercased tokens, plus the alphanumeric parts of compound ones, so both
+    "CVE-2021-1675" and "1675" match."""
+    tokens = []
+    for token in TOKEN_PATTERN.findall(text.lower()):
+        tokens.append(token)
+        parts = SUBTOKEN_PATTERN.findall(token)
+        if len(parts) > 1:
+            tokens.extend(parts)
+    return tokens
+
+class KeywordIndex:
+    """
+    Inverted index with BM25 scoring, kept in sync with a vector collection and persisted as JSON.
+
+    Attributes:
+        path: index file
+        version: index version of the collection when the index was last synced, None if never
+        docs: chunk id -> {"text": str, "metadata": dict, "length": int}
+        postings: term -> {chunk id: term frequency}
+    """
+
+    def __init__(self, path: str = KEYWORD_INDEX_PATH):
+        self.path = path
+        self.version: Optional[str] = None
+        self.docs: Dict[str, Dict] = {}
+        self.postings: Dict[str, Dict[str, int]] = {}
+        self._total_length = 0
+        self._lock = threading.Lock()
+        if path and os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            self.version = data.get("version", "")
+            self.docs = data["docs"]
+            self.postings = data["postings"]
+            self._total_length = sum(d["length"] for d in self.docs.values())
+
+    def __len__(self) -> int:
+        return len(self.docs)
+
+    def add(self, ids: Iterable[str], texts: Iterable[str], metadatas: Iterable[Optional[Dict]]):
+        """Index (or re-index) chunks by id."""
+        with self._lock:
+            for cid, text, metadata in zip(ids, texts, metadatas):
+                if cid in self.docs:
+                    self._remove(cid)
+                counts = Counter(tokenize(text))
+                length = sum(counts.values())
+                self.docs[cid] = {"text": text, "metadata": metadata or {}, "length": length}
+                self._total_length += length
+                for term, tf in counts.items():
+                    self.postings.setdefault(term, {})[cid] = tf
+
+    def remove(self, ids: Iterable[str]):
+        with self._lock:
+            for cid in ids:
+                if cid in self.docs:
+                    self._remove(cid)
+
+    def _remove(self, cid: str):
+        doc = self.docs.pop(cid)
+        self._total_length -= doc["length"]
+        for term in set(tokenize(doc["text"])):
+            posting = self.postings.get(term)
+            if posting is not None:
+                posting.pop(cid, None)
+                if not posting:
+                    del self.postings[term]
+
+    def search(
+        self, query: str, k: int = 8, where: Optional[Dict[str, str]] = None, ids: Optional[Iterable[str]] = None
+    ) -> List[Tuple[Document, float]]:
+        """
+        BM25 top-k.
+
+        Args:
+            query (str): Free-text query
+            k (int): Number of results
+            where (dict): Metadata equality filter, e.g. {"basename": "fluffy.md"}
+            ids (Iterable[str]): Only score these chunks, e.g. one challenge's from the challenge index
+
+        Returns:
+            list: (Document, score) pairs, best first
+        """
+        allowed = set(ids) if ids is not None else None
+        with self._lock:
+            n = len(self.docs)
+            if not n:
+                return []
+            avg_length = self._total_length / n
+            scores: Dict[str, float] = {}
+            for term in set(tokenize(query)):
+                posting = self.postings.get(term)
+                if not posting:
+                    continue
+                idf = math.log(1 + (n - len(posting) + 0.5) / (len(posting) + 0.5))
+                for cid, tf in posting.items():
+                    if allowed is not None and cid not in allowed:
+                        continue
+                    doc = self.docs[cid]
+                    if where and any(doc["metadata"].get(key) != value for key, value in where.items()):
+                        continue
+                    norm = tf + K1 * (1 - B + B * doc["length"] / avg_length)
+                    scores[cid] = scores.get(cid, 0.0) + idf * tf * (K1 + 1) / norm
+            best = heapq.nlargest(k, scores.items(), key=lambda item: item[1])
+            return [
+                (Document(page_content=self.docs[cid]["text"], metadata=dict(self.docs[cid]["metadata"])), score)
+                for cid, score in best
+            ]
+
+    def sync(self, vectorstore: VectorBackend, changed_ids: Iterable[str] = ()) -> Dict[str, int]:
+        """
+        Bring the index in line with the collection: drop chunks that are gone, index new ones,
+        and re-index `changed_ids`. Chunk IDs are reused when a source changes, so an ID that is
+        already indexed may hold new text; only the ingest that wrote it knows.
+
+        Returns:
+            dict: Counts of added, updated and removed chunks
+        """
+        ids = set(vectorstore.get(with_documents=False)["ids"])
+        changed = set(changed_ids) & ids
+        with self._lock:
+            stale = [cid for cid in self.docs if cid not in ids]
+            missing = [cid for cid in ids if cid not in self.docs]
+            updated = [cid for cid in changed if cid in self.docs]
+        self.remove(stale)
+        pending = missing + updated
+        for start in range(0, len(pending), SYNC_BATCH):
+            batch = vectorstore.get(ids=pending[start:start + SYNC_BATCH])
+            self.add(batch["ids"], batch["documents"], batch["metadatas"])
+        self.version = get_index_version()
+        if stale or pending:
+            logging.info(f"---KEYWORD INDEX: +{len(missing)} ~{len(updated)} -{len(stale)} CHUNKS ({len(self.docs)} TOTAL)---")
+        return {"added": len(missing), "updated": len(updated), "removed": len(stale)}
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp = f"{self.path}.tmp"
+        with self._lock:
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump({"version": self.version, "docs": self.docs, "postings": self.postings}, f)
+        os.replace(tmp, self.path)
+
+def keyword_index_path(vectorstore: VectorBackend) -> str:
+    """Where the keyword index of `vectorstore`'s collection lives: next to it, one file per collection."""
+    return os.path.join(vectorstore.local_dir or PERSIST_DIRECTORY, f"bm25_{vectorstore.collection_name}.json")
+
+def update_keyword_index(vectorstore: VectorBackend, changed_ids: Iterable[str] = ()) -> Dict[str, int]:
+    """
+    Sync the persisted keyword index with `vectorstore` after an ingest and save it. Call it
+    before `bump_index_version`, with the IDs of every chunk the ingest wrote, so processes
+    that reload the index on the version change see the new text.
+    """
+    index = KeywordIndex(keyword_index_path(vectorstore))
+    stats = index.sync(vectorstore, changed_ids)
+    index.save()
+    return stats
+
+_keyword_index: Optional[KeywordIndex] = None
+_keyword_index_lock = threading.Lock()
+
+def get_keyword_index() -> KeywordIndex:
+    """
+    Process-wide keyword index for the shared vectorstore. Reloaded from disk and re-synced
+    with the collection whenever the index version moved (i.e. something was ingested since):
+    the file has the chunks the ingest overwrote, which a sync on its own would not pick up.
+    """
+    global _keyword_index
+    with _keyword_index_lock:
+        if _keyword_index is None or _keyword_index.version != get_index_version():
+            _keyword_index = KeywordIndex()
+        if _keyword_index.version != get_index_version():
+            if any(_keyword_index.sync(get_vectorstore()).values()):
+                _keyword_index.save()
+        return _keyword_index
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build or update the BM25 index next to the vector collection.")
+    parser.add_argument("--rebuild", action="store_true", help="Start from an empty index instead of syncing the existing one")
+    args = parser.parse_args()
+
+    if args.rebuild and os.path.exists(KEYWORD_INDEX_PATH):
+        os.remove(KEYWORD_INDEX_PATH)
+    stats = update_keyword_index(get_vectorstore())
+    print(f"Keyword index {KEYWORD_INDEX_PATH}: {stats}")
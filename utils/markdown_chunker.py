@@ -0,0 +1,226 @@
+import os
+import re
+import math
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Iterable, List, Optional, Tuple
+from langchain.schema import Document
+from utils.context import count_tokens, count_line_tokens
+
+# Process-pool size for `split_documents`; 1 splits in the calling process
+WORKERS = int(os.getenv("CHUNKER_WORKERS", str(min(4, os.cpu_count() or 1))))
+# Below this many documents handing them to the pool costs more than it saves
+PARALLEL_MIN_DOCS = 32
+
+HEADING = re.compile(r"^(#{1,6})\s+(.*?)\s*#*\s*$")
+FENCE = re.compile(r"^(\s*)(`{3,}|~{3,})(.*)$")
+
+# (first line, end line exclusive, kind, section path); kind is "heading", "text" or "code"
+Block = Tuple[int, int, str, Tuple[str, ...]]
+
+class MarkdownChunker:
+    """
+    Splits Markdown on its structure: chunks end at headings and between paragraphs, never
+    inside a fenced code block (a block bigger than a chunk is cut on line boundaries and
+    each piece re-fenced), and carry their heading path as metadata "section".
+
+    Each document is tokenized once and chunk sizes are sums of per-line counts, instead of
+    re-tokenizing each candidate split. Drop-in for the text splitters: `split_text`,
+    `split_documents`.
+
+    Attributes:
+        chunk_size: maximum tokens per chunk
+        chunk_overlap: tokens of trailing blocks repeated at the start of the next chunk of the same section
+        min_chunk_size: a heading only starts a new chunk once the current one has this many tokens,
+            so runs of short sections are kept together
+        workers: process-pool size for `split_documents`
+    """
+
+    def __init__(
+        self,
+        chunk_size: int = 1000,
+        chunk_overlap: int = 200,
+        min_chunk_size: Optional[int] = None,
+        workers: int = WORKERS,
+    ):
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+        self.min_chunk_size = chunk_size // 2 if min_chunk_size is None else min_chunk_size
+        self.workers = workers
+
+    @staticmethod
+    def _blocks(lines: List[str]) -> List[Block]:
+        """Headings, paragraphs and fenced code blocks, each with the blank lines that follow it."""
+        # Each line is matched once; the cheap prefix tests skip the regexes for most lines
+        fences = [FENCE.match(line) if line.lstrip()[:1] in ("`", "~") else None for line in lines]
+        headings = [HEADING.match(line) if line[:1] == "#" else None for line in lines]
+        blocks: List[Block] = []
+        path: List[Tuple[int, str]] = []
+        i = 0
+        while i < len(lines):
+            start = i
+            fence = fences[i]
+            heading = headings[i]
+            if fence:
+                marker = fence.group(2)
+                i += 1
+                while i < len(lines):
+                    closing = fences[i]
+                    i += 1
+                    if closing and closing.group(2)[0] == marker[0] and len(closing.group(2)) >= len(marker) and not closing.group(3).strip():
+                        break
+                kind = "code"
+            elif heading:
+                level = len(heading.group(1))
+                path = [(l, t) for l, t in path if l < level] + [(level, heading.group(2))]
+                i += 1
+                kind = "heading"
+            else:
+                while i < len(lines) and lines[i].strip() and not fences[i] and not headings[i]:
+                    i += 1
+                kind = "text"
+            while i < len(lines) and not lines[i].strip():
+                i += 1
+            blocks.append((start, max(i, start + 1), kind, tuple(t for _, t in path)))
+        return blocks
+
+    def _split_oversized(self, lines: List[str], tokens: List[int], block: Block) -> List[str]:
+        """Cut one block bigger than a chunk on line boundaries; code pieces are re-fenced."""
+        start, end, kind, _ = block
+        body = list(range(start, end))
+        opener = closer = ""
+        if kind == "code":
+            fence = FENCE.match(lines[start])
+            opener, closer = lines[start], f"{fence.group(1)}{fence.group(2)}"
+            body = body[1:]
+            # The block ends with the blank lines after its closing fence
+            while body and not lines[body[-1]].strip():
+                body = body[:-1]
+            if body and FENCE.match(lines[body[-1]]):
+                body = body[:-1]
+        budget = max(1, self.chunk_size - (count_tokens(opener + "\n" + closer) if kind == "code" else 0))
+        pieces: List[str] = []
+        current: List[str] = []
+        used = 0
+        for i in body:
+            line, size = lines[i], tokens[i]
+            if size > budget:
+                # A single line bigger than a chunk: cut it at whitespace into roughly even parts
+                parts = math.ceil(size / budget)
+                step = math.ceil(len(line) / parts)
+                segments, rest = [], line
+                while rest:
+                    cut = rest.rfind(" ", 0, step) if len(rest) > step else len(rest)
+                    cut = cut if cut > 0 else min(step, len(rest))
+                    segments.append(rest[:cut])
+                    rest = rest[cut:].lstrip(" ")
+                if current:
+                    pieces.append("\n".join(current))
+                    current, used = [], 0
+                pieces.extend(segments)
+                continue
+            if used + size > budget and current:
+                pieces.append("\n".join(current))
+                current, used = [], 0
+            current.append(line)
+            used += size
+        if current:
+            pieces.append("\n".join(current))
+        if kind == "code":
+            pieces = [f"{opener}\n{piece}\n{closer}" for piece in pieces]
+        return [p for p in pieces if p.strip()]
+
+    def _split(self, text: str) -> List[Tuple[str, Tuple[str, ...]]]:
+        lines = text.split("\n")
+        tokens = count_line_tokens(text)
+        blocks = self._blocks(lines)
+        sizes = [sum(tokens[s:e]) for s, e, _, _ in blocks]
+        chunks: List[Tuple[str, Tuple[str, ...]]] = []
+        current: List[int] = []
+        used = 0
+
+        def flush(keep_overlap: bool) -> List[int]:
+            nonlocal used
+            # A chunk never ends on a heading: it moves on with its section
+            carried = []
+            while current and blocks[current[-1]][2] == "heading":
+                carried.insert(0, current.pop())
+            if current:
+                first, last = blocks[current[0]], blocks[current[-1]]
+                content = [blocks[b] for b in current if blocks[b][2] != "heading"] or [first]
+                chunks.append(("\n".join(lines[first[0]:last[1]]).strip("\n"), content[0][3]))
+            overlap: List[int] = []
+            if keep_overlap and current:
+                section = blocks[current[-1]][3]
+                budget = self.chunk_overlap
+                for b in reversed(current):
+                    if blocks[b][3] != section or blocks[b][2] == "heading" or sizes[b] > budget:
+                        break
+                    overlap.insert(0, b)
+                    budget -= sizes[b]
+            current[:] = overlap + carried
+            used = sum(sizes[b] for b in current)
+            return current
+
+        for b, (start, end, kind, path) in enumerate(blocks):
+            if kind == "heading" and used >= self.min_chunk_size:
+                flush(keep_overlap=False)
+            if sizes[b] > self.chunk_size:
+                flush(keep_overlap=False)
+                heading = [lines[blocks[h][0]] for h in current]
+                current.clear()
+                used = 0
+                pieces = self._split_oversized(lines, tokens, blocks[b])
+                if heading and pieces:
+                    pieces[0] = "\n".join(heading) + "\n\n" + pieces[0]
+                chunks.extend((piece, path) for piece in pieces)
+                continue
+            if used + sizes[b] > self.chunk_size and current:
+                flush(keep_overlap=True)
+                # The overlap may not leave room for this block
+                while current and used + sizes[b] > self.chunk_size:
+                    used -= sizes[current.pop(0)]
+            current.append(b)
+            used += sizes[b]
+        flush(keep_overlap=False)
+        return [(text, path) for text, path in chunks if text.strip()]
+
+    def split_text(self, text: str) -> List[str]:
+        return [chunk for chunk, _ in self._split(text)]
+
+    def _split_document(self, doc: Document) -> List[Document]:
+        return [
+            Document(page_content=chunk, metadata={**doc.metadata, "section": " > ".join(path)})
+            for chunk, path in self._split(doc.page_content)
+        ]
+
+    def split_documents(self, documents: Iterable[Document]) -> List[Document]:
+        """Split documents, across a process pool when there are enough of them to pay for it."""
+        documents = list(documents)
+        if self.workers > 1 and len(documents) >= PARALLEL_MIN_DOCS:
+            per_doc = get_pool(self.workers).map(
+                self._split_document, documents, chunksize=max(1, len(documents) // (self.workers * 4))
+            )
+            return [chunk for chunks in per_doc for chunk in chunks]
+        return [chunk for doc in documents for chunk in self._split_document(doc)]
+
+_pools: Dict[int, ProcessPoolExecutor] = {}
+_pools_lock = threading.Lock()
+
+def get_pool(workers: int) -> ProcessPoolExecutor:
+    """
+    Process-wide pool of `workers` processes, started on first use and reused by every later
+    split, so an ingest pays for it once rather than per window of documents. Workers come
+    from a forkserver (spawned where there is none), never forked from the ingest process
+    while its loader and embedding threads are running.
+    """
+    with _pools_lock:
+        if workers not in _pools:
+            if "forkserver" in multiprocessing.get_all_start_methods():
+                context = multiprocessing.get_context("forkserver")
+                context.set_forkserver_preload([__name__])
+            else:
+                context = multiprocessing.get_context("spawn")
+            _pools[workers] = ProcessPoolExecutor(max_workers=workers, mp_context=context)
+        return _pools[workers]
@@ -0,0 +1,66 @@
+import math
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Dict, List
+
+WINDOW = 1000
+
+def percentile(samples: List[float], q: float) -> float:
+    """Nearest-rank percentile of `samples`, `q` in [0, 100]; 0.0 when empty."""
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    rank = max(1, math.ceil(q / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+class LatencyRecorder:
+    """
+    Thread-safe request counters and a sliding window of latencies.
+
+    Attributes:
+        window: number of most recent latencies kept for the percentiles
+    """
+
+    def __init__(self, window: int = WINDOW):
+        self.window = window
+        self._latencies = deque(maxlen=window)
+        self._lock = threading.Lock()
+        self._stats = {"in_flight": 0, "queued": 0, "completed": 0, "errors": 0, "timeouts": 0, "rejected": 0}
+
+    def incr(self, counter: str, by: int = 1):
+        with self._lock:
+            self._stats[counter] += by
+
+    def observe(self, seconds: float):
+        with self._lock:
+            self._latencies.append(seconds)
+
+    @contextmanager
+    def track(self):
+        """Count the block as in flight and record its latency; exceptions count as errors."""
+        self.incr("in_flight")
+        started = time.perf_counter()
+        try:
+            yield
+        except Exception:
+            self.incr("errors")
+            raise
+        else:
+            self.incr("completed")
+        finally:
+            self.incr("in_flight", -1)
+            self.observe(time.perf_counter() - started)
+
+    def get_stats(self) -> Dict[str, float]:
+        with self._lock:
+            samples = list(self._latencies)
+            stats = dict(self._stats)
+        stats.update({
+            "p50": percentile(samples, 50),
+            "p95": percentile(samples, 95),
+            "max": max(samples, default=0.0),
+            "samples": len(samples),
+        })
+        return stats
@@ -0,0 +1,45 @@
+import os
+import logging
+import argparse
+from typing import Dict
+from utils.vector_backends import VectorBackend
+from utils.vectorstore import get_vectorstore, bump_index_version, COLLECTION_NAME, PERSIST_DIRECTORY, EMBEDDING_MODEL
+
+def migrate(source: VectorBackend, target: VectorBackend, batch_size: int = 500) -> Dict[str, int]:
+    """
+    Copy every chunk (id, text, metadata and stored embedding) from `source` to `target`.
+    Embeddings are copied as they are, so nothing is re-embedded; re-running is safe
+    because chunks are upserted by id.
+
+    Returns:
+        dict: Chunks copied, and the chunk counts of both stores afterwards
+    """
+    copied = 0
+    for batch in source.iter_records(batch_size):
+        target.upsert(batch["ids"], batch["documents"], batch["metadatas"], batch["embeddings"])
+        copied += len(batch["ids"])
+        logging.info(f"---MIGRATE: {copied} CHUNKS COPIED---")
+    stats = {"copied": copied, "source_count": source.count(), "target_count": target.count()}
+    if stats["target_count"] < stats["source_count"]:
+        raise RuntimeError(f"Migration incomplete: {stats}")
+    return stats
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Copy a collection between vector backends without re-embedding.")
+    parser.add_argument("--from", dest="source", choices=["chroma", "pgvector"], required=True, help="Backend to read")
+    parser.add_argument("--to", dest="target", choices=["chroma", "pgvector"], required=True, help="Backend to write")
+    parser.add_argument("--collection", default=COLLECTION_NAME, help="Collection to copy")
+    parser.add_argument("--persist-directory", default=PERSIST_DIRECTORY, help="Chroma persist directory")
+    parser.add_argument("--embedding-model", default=EMBEDDING_MODEL, help="Model the stored embeddings were made with")
+    parser.add_argument("--batch-size", type=int, default=500)
+    args = parser.parse_args()
+
+    if args.source == args.target:
+        parser.error("--from and --to must differ")
+    source = get_vectorstore(args.collection, args.persist_directory, args.embedding_model, args.source)
+    target = get_vectorstore(args.collection, args.persist_directory, args.embedding_model, args.target)
+    stats = migrate(source, target, args.batch_size)
+    # Answer/retrieval caches keyed on the index version must not outlive the switch
+    bump_index_version(os.path.join(args.persist_directory, "index_version"))
+    print(f"Migrated {args.collection} from {args.source} to {args.target}: {stats}")
@@ -0,0 +1,130 @@
+import os
+import re
+import json
+import logging
+import threading
+from difflib import SequenceMatcher, get_close_matches
+from typing import Dict, Iterable, List, Optional, Tuple
+from utils.vector_backends import VectorBackend
+from utils.vectorstore import get_vectorstore
+from utils.challenge_index import normalize_name, CHALLENGE_KEY
+
+CONFIDENCE_THRESHOLD = float(os.getenv("PREROUTER_THRESHOLD", "0.85"))
+# Optional JSONL of {"question": ..., "datasource": "vectorstore" | "web_search"} to train the classifier on
+TRAINING_PATH = os.getenv("PREROUTER_TRAINING_PATH", "")
+
+HTB_PATTERN = re.compile(r"\b(hack\s*the\s*box|hackthebox|htb)\b", re.I)
+STOP_WORDS = {
+    "the", "how", "to", "solve", "challenge", "machine", "box", "show", "give", "full", "step",
+    "from", "with", "this", "that", "what", "admin", "root", "user", "flag", "privesc", "escalate",
+    "hackthebox", "writeup", "walkthrough", "have", "done", "recon", "part",
+}
+
+_stats_lock = threading.Lock()
+_stats = {
+    "route_fast": 0, "route_classifier": 0, "route_llm": 0,
+    "name_fast": 0, "name_llm": 0,
+}
+
+def record(path: str):
+    """Count one decision taken by `path` (e.g. "route_llm")."""
+    with _stats_lock:
+        _stats[path] += 1
+
+def get_stats() -> Dict[str, int]:
+    with _stats_lock:
+        return dict(_stats)
+
+class PreRouter:
+    """
+    Decides the route and challenge name locally, so the router/name-extraction LLM
+    calls are only made when the question is ambiguous.
+
+    Attributes:
+        names: normalized challenge names
+        threshold: minimum confidence for a local decision
+        classifier: optional TF-IDF + logistic regression route classifier
+    """
+
+    def __init__(self, names: Iterable[str], threshold: float = CONFIDENCE_THRESHOLD, training_path: str = TRAINING_PATH):
+        self.names = {normalize_name(n) for n in names} - {""}
+        self.threshold = threshold
+        self.classifier = self._train(training_path) if training_path and os.path.exists(training_path) else None
+
+    @classmethod
+    def from_vectorstore(cls, vectorstore: VectorBackend, **kwargs) -> "PreRouter":
+        """Build the name index from the challenge key/challenge_name/basename metadata stored in the collection."""
+        metadatas = vectorstore.get(with_documents=False)["metadatas"]
+        names = set()
+        for m in metadatas:
+            for key in (CHALLENGE_KEY, "basename", "challenge_name"):
+                if m and m.get(key):
+                    names.add(m[key])
+        logging.info(f"---PREROUTER: {len(names)} CHALLENGE NAMES INDEXED---")
+        return cls(names, **kwargs)
+
+    def _train(self, path: str):
+        from sklearn.feature_extraction.text import TfidfVectorizer
+        from sklearn.linear_model import LogisticRegression
+        from sklearn.pipeline import make_pipeline
+
+        with open(path, "r", encoding="utf-8") as f:
+            rows = [json.loads(line) for line in f if line.strip()]
+        labels = {r["datasource"] for r in rows}
+        if len(labels) < 2:
+            logging.warning(f"---PREROUTER: {path} NEEDS BOTH ROUTES TO TRAIN, CLASSIFIER DISABLED---")
+            return None
+        classifier = make_pipeline(TfidfVectorizer(ngram_range=(1, 2), sublinear_tf=True), LogisticRegression(max_iter=1000))
+        classifier.fit([r["question"] for r in rows], [r["datasource"] for r in rows])
+        return classifier
+
+    def _candidates(self, question: str) -> List[str]:
+        tokens = [t for t in re.findall(r"[a-z0-9]+", question.lower()) if t not in STOP_WORDS]
+        # also try adjacent tokens glued together, for names like "Two Million"
+        pairs = [a + b for a, b in zip(tokens, tokens[1:])]
+        return [t for t in tokens + pairs if len(t) >= 4]
+
+    def match_challenge(self, question: str) -> Tuple[Optional[str], float]:
+        """
+        Fuzzy-match the question against the indexed challenge names.
+
+        Returns:
+            tuple: (challenge name or None, confidence in [0, 1])
+        """
+        best, confidence = None, 0.0
+        for candidate in self._candidates(question):
+            if candidate in self.names:
+                return candidate, 1.0
+            for match in get_close_matches(candidate, self.names, n=1, cutoff=self.threshold):
+                ratio = SequenceMatcher(None, candidate, match).ratio()
+                if ratio > confidence:
+                    best, confidence = match, ratio
+        return best, confidence
+
+    def route(self, question: str) -> Tuple[Optional[str], float, str]:
+        """
+        Returns:
+            tuple: (datasource or None if undecided, confidence, path that decided)
+        """
+        name, confidence = self.match_challenge(question)
+        if name and confidence >= self.threshold:
+            return "vectorstore", confidence, "route_fast"
+        if HTB_PATTERN.search(question):
+            return "vectorstore", 0.9, "route_fast"
+        if self.classifier is not None:
+            probabilities = self.classifier.predict_proba([question])[0]
+            best = probabilities.argmax()
+            if probabilities[best] >= self.threshold:
+                return self.classifier.classes_[best], float(probabilities[best]), "route_classifier"
+        return None, 0.0, "route_llm"
+
+_prerouter: Optional[PreRouter] = None
+_prerouter_lock = threading.Lock()
+
+def get_prerouter() -> PreRouter:
+    """Process-wide PreRouter over the shared vectorstore, built on first use."""
+    global _prerouter
+    with _prerouter_lock:
+        if _prerouter is None:
+            _prerouter = PreRouter.from_vectorstore(get_vectorstore())
+        return _prerouter
@@ -1,6 +1,14 @@
+import os
 import gzip
+import json
+import zlib
+import asyncio
 import argparse
+from datetime import datetime, timezone
+from typing import AsyncIterator
 from urllib.parse import urljoin
+from xml.etree import ElementTree
+import httpx
 import requests
 from bs4 import BeautifulSoup
 
@@ -70,15 +78,188 @@ def get_urls_from_sitemap(root_url, pattern="", max_depth=3, timeout=10) -> list
     walk(root_url, depth=0)
     return sorted(found_urls)
 
-# if __name__ == "__main__":
-#     parser = argparse.ArgumentParser(description="Fetch URLs from a sitemap.")
-#     parser.add_argument("sitemap_url", help="URL of the sitemap or sitemap index")
-#     parser.add_argument("--pattern", default="", help="Regex pattern to filter URLs")
-#     parser.add_argument("--max_depth", type=int, default=3, help="Max recursion depth for sitemap indexes")
-#     parser.add_argument("--timeout", type=int, default=10, help="HTTP request timeout in seconds")
-
-#     args = parser.parse_args()
-#     urls = get_urls_from_sitemap(args.sitemap_url, args.pattern, args.max_depth, args.timeout)
-#     for url in urls:
-#         print(url)
-#     print(f"Found {len(urls)} URLs!")
\ No newline at end of file
+# ==== Async, incremental walker ====
+def _local(tag: str) -> str:
+    """'{http://www.sitemaps.org/schemas/sitemap/0.9}loc' -> 'loc'"""
+    return tag.rsplit("}", 1)[-1]
+
+def _parse_lastmod(value):
+    if not value:
+        return None
+    try:
+        dt = datetime.fromisoformat(value.strip().replace("Z", "+00:00"))
+    except ValueError:
+        return None
+    return dt if dt.tzinfo else dt.replace(tzinfo=timezone.utc)
+
+def _is_newer(lastmod, previous) -> bool:
+    """True if `lastmod` is later than `previous`, or if either is missing/unparseable."""
+    new, old = _parse_lastmod(lastmod), _parse_lastmod(previous)
+    return new is None or old is None or new > old
+
+class SitemapWalker:
+    """
+    Walks a sitemap or sitemap index concurrently over one pooled HTTP client, parsing
+    each sitemap incrementally as it downloads and streaming matching URLs out as soon
+    as they are found.
+
+    With `state_path`, the `<lastmod>` of every sitemap and URL is persisted, and later
+    runs only return URLs changed since then. Child sitemaps whose `<lastmod>` has not
+    moved are not fetched at all; their URLs are carried over from the state file.
+
+    Attributes:
+        known_urls: every matching URL that currently exists, including unchanged ones.
+            Complete once iteration finishes.
+    """
+
+    def __init__(self, root_url, pattern="", max_depth=3, timeout=10, concurrency=8, state_path=None):
+        self.root_url = root_url
+        self.pattern = pattern
+        self.max_depth = max_depth
+        self.timeout = timeout
+        self.concurrency = concurrency
+        self.state_path = state_path
+        self.known_urls = set()
+        self.state = {"sitemaps": {}}
+        if state_path and os.path.exists(state_path):
+            with open(state_path, "r", encoding="utf-8") as f:
+                self.state = json.load(f)
+
+    def save_state(self):
+        if not self.state_path:
+            return
+        os.makedirs(os.path.dirname(self.state_path) or ".", exist_ok=True)
+        tmp = f"{self.state_path}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self.state, f)
+        os.replace(tmp, self.state_path)
+
+    async def _parse(self, client, url):
+        """Yields ("sitemap" | "url", loc, lastmod) entries while the body is still downloading."""
+        parser = ElementTree.XMLPullParser(events=("end",))
+        inflate = None
+        async with client.stream("GET", url) as r:
+            r.raise_for_status()
+            # Handle gzip by header or extension
+            if r.headers.get("Content-Type", "").lower() == "application/x-gzip" or url.lower().endswith(".gz"):
+                inflate = zlib.decompressobj(zlib.MAX_WBITS | 32)
+            async for data in r.aiter_bytes():
+                parser.feed(inflate.decompress(data) if inflate else data)
+                for _, elem in parser.read_events():
+                    kind = _local(elem.tag)
+                    if kind not in ("sitemap", "url"):
+                        continue
+                    fields = {_local(child.tag): (child.text or "").strip() for child in elem}
+                    if fields.get("loc"):
+                        yield kind, urljoin(url, fields["loc"]), fields.get("lastmod")
+                    elem.clear()
+        parser.close()
+
+    async def _walk(self, client, url, depth, out, seen, slots, tasks, lastmod=None):
+        if depth > self.max_depth or url in seen:
+            return
+        seen.add(url)
+
+        previous = self.state["sitemaps"].get(url, {})
+        urls, children = {}, []
+        print(f"Fetching sitemap: {url}")
+        try:
+            async with slots:
+                async for kind, loc, loc_lastmod in self._parse(client, url):
+                    if kind == "sitemap":
+                        children.append(loc)
+                        child = self.state["sitemaps"].get(loc)
+                        if child and child.get("lastmod") and not _is_newer(loc_lastmod, child["lastmod"]):
+                            # Unchanged child sitemap: keep its URLs, skip the fetch
+                            self._carry_over(loc, seen)
+                            continue
+                        tasks.append(asyncio.create_task(
+                            self._walk(client, loc, depth + 1, out, seen, slots, tasks, loc_lastmod)
+                        ))
+                    elif self.pattern in loc:
+                        urls[loc] = loc_lastmod
+                        self.known_urls.add(loc)
+                        old = previous.get("urls", {})
+                        if loc not in old or _is_newer(loc_lastmod, old[loc]):
+                            await out.put(loc)
+        except Exception as e:
+            print(f"Failed to fetch or parse sitemap: {url} ({e})")
+            # Keep what we knew so a transient error does not look like removed pages
+            seen.discard(url)
+            self._carry_over(url, seen)
+            return
+        # Only recorded once fully parsed, so a failed fetch is retried next run
+        self.state["sitemaps"][url] = {"lastmod": lastmod, "urls": urls, "children": children}
+
+    def _carry_over(self, url, seen):
+        """Mark an unfetched sitemap's (and its children's) URLs from the last run as still known."""
+        if url in seen:
+            return
+        seen.add(url)
+        entry = self.state["sitemaps"].get(url, {})
+        self.known_urls.update(entry.get("urls", {}))
+        for child in entry.get("children", []):
+            self._carry_over(child, seen)
+
+    def forget(self, urls):
+        """
+        Drop `urls` from the state, e.g. pages that failed to crawl, so the next run
+        returns them again. Their sitemaps lose their lastmod so they are re-fetched.
+        """
+        urls = set(urls)
+        for entry in self.state["sitemaps"].values():
+            stale = urls.intersection(entry.get("urls", {}))
+            for url in stale:
+                del entry["urls"][url]
+            if stale:
+                entry["lastmod"] = None
+
+    async def iter_urls(self, save_state: bool = True) -> AsyncIterator[str]:
+        """
+        Yields new or changed URLs as they are found. Pass `save_state=False` to persist
+        the state yourself once the URLs have actually been processed.
+        """
+        out: asyncio.Queue = asyncio.Queue()
+        seen, tasks = set(), []
+        slots = asyncio.Semaphore(self.concurrency)
+        limits = httpx.Limits(max_connections=self.concurrency, max_keepalive_connections=self.concurrency)
+        headers = {"User-Agent": "SitemapFetcher/1.0 (+https://example.com)"}
+
+        async with httpx.AsyncClient(headers=headers, timeout=self.timeout, limits=limits, follow_redirects=True) as client:
+            tasks.append(asyncio.create_task(self._walk(client, self.root_url, 0, out, seen, slots, tasks)))
+            while True:
+                pending = [t for t in tasks if not t.done()]
+                while not out.empty():
+                    yield out.get_nowait()
+                if not pending:
+                    break
+                getter = asyncio.ensure_future(out.get())
+                done, _ = await asyncio.wait([getter, *pending], return_when=asyncio.FIRST_COMPLETED)
+                if getter in done:
+                    yield getter.result()
+                else:
+                    getter.cancel()
+        if save_state:
+            self.save_state()
+
+async def aget_urls_from_sitemap(root_url, pattern="", max_depth=3, timeout=10, concurrency=8, state_path=None) -> list:
+    """Async counterpart of `get_urls_from_sitemap`; with `state_path`, only URLs changed since the last run."""
+    walker = SitemapWalker(root_url, pattern, max_depth, timeout, concurrency, state_path)
+    return sorted({u async for u in walker.iter_urls()})
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fetch URLs from a sitemap.")
+    parser.add_argument("sitemap_url", help="URL of the sitemap or sitemap index")
+    parser.add_argument("--pattern", default="", help="Substring the URLs must contain")
+    parser.add_argument("--max_depth", type=int, default=3, help="Max recursion depth for sitemap indexes")
+    parser.add_argument("--timeout", type=int, default=10, help="HTTP request timeout in seconds")
+    parser.add_argument("--concurrency", type=int, default=8, help="Sitemaps fetched in parallel")
+    parser.add_argument("--state", default=None, help="State file; only URLs changed since the last run are printed")
+
+    args = parser.parse_args()
+    urls = asyncio.run(aget_urls_from_sitemap(
+        args.sitemap_url, args.pattern, args.max_depth, args.timeout, args.concurrency, args.state
+    ))
+    for url in urls:
+        print(url)
+    print(f"Found {len(urls)} URLs!")
@@ -1,19 +1,23 @@
 from dotenv import load_dotenv
-from langchain_community.chat_models import ChatOllama
-from langchain_core.output_parsers import StrOutputParser, JsonOutputParser
-from langchain.prompts import PromptTemplate, ChatPromptTemplate, SystemMessagePromptTemplate, HumanMessagePromptTemplate
-from langchain_community.vectorstores import Chroma
-from langchain_ollama.embeddings import OllamaEmbeddings
-from langchain.schema import Document
-from langchain_community.tools.tavily_search import TavilySearchResults
-from langchain_google_genai import ChatGoogleGenerativeAI
+from utils.vectorstore import get_vectorstore
+from utils.prerouter import get_prerouter, record
+from utils.context import assemble_context
+from utils.hybrid import hybrid_search
+from utils.web_search import search_web
+from utils.tracing import annotate
+from utils import budget
+from utils.grounding import get_precheck, log_verdict
+from utils.chains import ollama_llm, google_llm, question_router, challenge_name_extractor, rag_chain_at, hallucination_grader, answer_grader, combined_grader, parallel_graders
+import os
+import time
 import logging
 
 load_dotenv()
 
-# LLM
-ollama_llm = ChatOllama(model="llama3.1:8b-instruct-q4_0", temperature=0, num_ctx=8192)
-google_llm = ChatGoogleGenerativeAI(model="gemini-2.5-flash", temperature=0)
+# "sequential": answer grader only runs if the hallucination grader passes
+# "parallel": both graders run concurrently
+# "combined": one prompt returns both scores
+GRADER_MODE = os.getenv("GRADER_MODE", "sequential")
 
 # Router
 def route_question(state):
@@ -27,21 +31,12 @@ def route_question(state):
         str: Next node to call
     """
     logging.info("---ROUTE QUESTION---")
-    system_prompt = """You are an expert at routing a user question to a vectorstore or web search. \n
-    Use the vectorstore for questions on HackTheBox challenges. \n
-    You do not need to be stringent with the keywords in the question related to these topics. \n
-    Otherwise, use web-search. Give a binary choice 'web_search' or 'vectorstore' based on the question. \n
-    Return a JSON with a single key 'datasource' and no premable or explanation. \n"""
-    human_prompt = "Route this question to the appropriate datasource: {question}"
-    
-    prompt = ChatPromptTemplate.from_messages(
-        [
-            SystemMessagePromptTemplate.from_template(system_prompt),
-            HumanMessagePromptTemplate.from_template(human_prompt),
-        ]
-    )
+    datasource, confidence, path = get_prerouter().route(state["question"])
+    record(path)
+    if datasource:
+        logging.info(f"---FAST ROUTE: {datasource} ({path}, confidence {confidence:.2f})---")
+        return datasource
 
-    question_router = prompt | ollama_llm | JsonOutputParser()
     source = question_router.invoke({"question": state["question"]})
     datasource = source["datasource"]
     if datasource == "vectorstore":
@@ -63,35 +58,27 @@ def retrieve(state):
     
     question = state["question"]
     challenge_name = state["challenge_name"]
+    started = budget.started_at(state)
+    llm_calls = state.get("llm_calls", 0)
+    if not challenge_name:
+        name, confidence = get_prerouter().match_challenge(question)
+        if name and confidence >= get_prerouter().threshold:
+            record("name_fast")
+            logging.info(f"---CHALLENGE NAME (FAST PATH, confidence {confidence:.2f}): {name}---")
+            challenge_name = name
     while not challenge_name:
+        record("name_llm")
         logging.info("---GUESS CHALLENGE NAME FROM QUESTION---")
-        system_prompt = """You are an expert at extracting the HackTheBox challenge name from a user question.\n
-        The challenge name MUST be in the format 'challengename'.\n
-        If the question does not reference a HackTheBox challenge, return 'unknown'.\n
-        Return ONLY the challenge name with NO preamble or explanation.\n"""
-        human_prompt = "Extract the HackTheBox challenge name, from this question: {question}"
-        
-        prompt = ChatPromptTemplate.from_messages(
-            [
-                SystemMessagePromptTemplate.from_template(system_prompt),
-                HumanMessagePromptTemplate.from_template(human_prompt),
-            ]
-        )
-
-        challenge_name_extractor = prompt | ollama_llm | StrOutputParser()
         challenge_name = challenge_name_extractor.invoke({"question": question}).lower().strip()
+        llm_calls += 1
         if challenge_name == "unknown":
             logging.info("---DECISION: CHALLENGE NAME UNKNOWN, USE WEB SEARCH---")
-            return {"documents": None, "question": question, "challenge_name": challenge_name}
+            return {"documents": None, "question": question, "challenge_name": challenge_name, "started": started, "llm_calls": llm_calls}
         logging.info(f"---CHALLENGE NAME: {challenge_name}---")
 
     logging.info("---RETRIEVE---")
-    # load the vectorstore
-    vectorstore = Chroma(
-        collection_name="htb_2025", 
-        persist_directory="D:/AI-LLM/Agents/RAGAgent/crawled_data_store", 
-        embedding_function=OllamaEmbeddings(model="bge-m3")
-    )
+    # reuse the process-wide vectorstore
+    vectorstore = get_vectorstore()
 
     # retriever = vectorstore.as_retriever(search_kwargs={"k": 8, "filter": {"challenge_name": challenge_name}})
     # documents = retriever.invoke(question)
@@ -106,124 +93,191 @@ def retrieve(state):
     #     query=question,
     #     k=10
     # )
-    documents = vectorstore.as_retriever(
-        search_kwargs={
-            "k": 8, 
-            "filter":{
-                "basename": f"{challenge_name}.md"
-            }
-        }
-    ).invoke(question)
+    # documents = vectorstore.as_retriever(
+    #     search_kwargs={
+    #         "k": 8,
+    #         "filter":{
+    #             "basename": f"{challenge_name}.md"
+    #         }
+    #     }
+    # ).invoke(question)
+
+    # BM25 + vector search fused with RRF, so exact tokens (CVE IDs, tool names, hosts) are not missed.
+    # Scoped through the per-challenge index, which matches every ingest path's naming
+    # (basename "fluffy.md", crawled challenge_name "htb-fluffy") rather than only the basename.
+    documents = hybrid_search(
+        question,
+        k=8,
+        challenge=challenge_name,
+        vectorstore=vectorstore,
+    )
+
+    return {"documents": documents, "question": question, "challenge_name": challenge_name, "started": started, "llm_calls": llm_calls}
 
-    return {"documents": documents, "question": question, "challenge_name": challenge_name}
+def build_context(documents) -> str:
+    context, stats = assemble_context(documents)
+    logging.info(
+        f"---CONTEXT: {stats['chunks']} CHUNKS -> {stats['blocks']} BLOCKS, "
+        f"{stats['tokens']} TOKENS ({stats['tokens_saved']} SAVED)---"
+    )
+    annotate("context.tokens_saved", stats["tokens_saved"])
+    return context
 
 def generate(state):
     """
     Generate answer
 
+    A retry applies the strategy chosen by the grader (reranked, fewer or more documents,
+    another temperature), so it never sends the exact prompt of an earlier attempt.
+
     Args:
         state (dict): The current graph state
 
     Returns:
         state (dict): New key added to state, generation, that contains LLM generation
     """
-    logging.info("---GENERATE---")
-    system_prompt = """You are an expert at question-answering tasks.\n
-        Use the following pieces of retrieved context to answer the question.\n
-        If you don't know the answer, just say that you don't know.\n
-        Provide a conversational answer with a step-by-step guide on how to solve the challenge.\n"""
-    human_prompt = "Here is the context: {context}\nAnswer this question base on the above context: {question}"
-    
-    prompt = ChatPromptTemplate.from_messages(
-        [
-            SystemMessagePromptTemplate.from_template(system_prompt),
-            HumanMessagePromptTemplate.from_template(human_prompt),
-        ]
-    )
-
-    # rag_chain = prompt | google_llm | StrOutputParser()
-    rag_chain = prompt | ollama_llm | StrOutputParser()
-
+    strategy = state.get("strategy") or ""
+    logging.info(f"---GENERATE{f' ({strategy})' if strategy else ''}---")
     question = state["question"]
     documents = state["documents"]
 
-    # RAG generation
-    generation = rag_chain.invoke({"context": documents, "question": question})
-    return {"documents": documents, "question": question, "generation": generation, "challenge_name": state["challenge_name"], "generate_count": state["generate_count"] + 1}
-
-
-def grade_generation_v_documents_and_question(state):
+    context_documents, temperature, replaces_pool = budget.apply_strategy(strategy, question, documents, state["challenge_name"])
+    if replaces_pool:
+        documents = context_documents
+    # RAG generation, on deduplicated/merged page_content within the context budget
+    context = build_context(context_documents)
+    generation = rag_chain_at(temperature).invoke({"context": context, "question": question})
+    attempt = {"strategy": strategy or "initial", "fingerprint": budget.fingerprint(context, temperature)}
+    return {
+        "documents": documents,
+        "question": question,
+        "generation": generation,
+        "challenge_name": state["challenge_name"],
+        "generate_count": state["generate_count"] + 1,
+        "started": budget.started_at(state),
+        "llm_calls": state.get("llm_calls", 0) + 1,
+        "context": context,
+        "attempts": (state.get("attempts") or []) + [attempt],
+    }
+
+def _context_documents(documents, context: str):
+    """The documents that made it into `context` (assembly drops duplicates and what is over budget)."""
+    return [
+        d for d in documents or []
+        if d.page_content.strip()[:100] in context or d.page_content.strip()[-100:] in context
+    ]
+
+def grade_generation(state):
     """
-    Determines whether the generation is grounded in the document and answers question.
+    Grade the generation against its context and the question, and decide what happens next
+    within the request's budget.
 
     Args:
         state (dict): The current graph state
 
     Returns:
-        str: Decision for next node to call
+        state (dict): decision ("useful", "not_supported" to retry with `strategy`, "not_useful" to
+        search the web, "over_budget" to stop with the best answer so far), the best graded
+        answer, and the LLM calls spent
     """
-
-    logging.info("---CHECK HALLUCINATIONS---")
-    # Hallucination grader
-    prompt = PromptTemplate(
-        template="""You are a grader assessing whether an answer is grounded in / supported by a set of facts. \n 
-        Here are the facts:
-        \n ------- \n
-        {documents} 
-        \n ------- \n
-        Here is the answer: {generation}
-        Give a binary score 'yes' or 'no' score to indicate whether the answer is grounded in / supported by a set of facts. \n
-        Provide the binary score as a JSON with a single key 'score' and no preamble or explanation.""",
-        input_variables=["generation", "documents"],
-    )
-
-    hallucination_grader = prompt | ollama_llm | JsonOutputParser()
-
-    # Answer grader
-    prompt = PromptTemplate(
-        template="""You are a grader assessing whether an answer is useful to resolve a question. \n 
-        Here is the answer:
-        \n ------- \n
-        {generation} 
-        \n ------- \n
-        Here is the question: {question}
-        Give a binary score 'yes' or 'no' to indicate whether the answer is useful to resolve a question. \n
-        Provide the binary score as a JSON with a single key 'score' and no preamble or explanation.""",
-        input_variables=["generation", "question"],
-    )
-
-    answer_grader = prompt | ollama_llm | JsonOutputParser()
-
+    logging.info(f"---CHECK HALLUCINATIONS ({GRADER_MODE})---")
     question = state["question"]
-    documents = state["documents"]
+    # The context the answer was generated from, not the whole document pool
+    documents = state.get("context") or build_context(state["documents"])
     generation = state["generation"]
-
-    score = hallucination_grader.invoke(
-        {"documents": documents, "generation": generation}
-    )
-    hallucination_grade = score["score"]
+    llm_calls = state.get("llm_calls", 0)
+
+    started = time.perf_counter()
+    answer_grade = None
+    # Clear cases are decided locally; only ambiguous ones cost a hallucination-grader call
+    precheck = get_precheck()
+    verdict, local_score = precheck.check(generation, _context_documents(state["documents"], documents), documents) if precheck else (None, None)
+    if verdict is not None:
+        hallucination_grade = verdict
+    elif GRADER_MODE == "parallel":
+        scores = parallel_graders.invoke({"documents": documents, "generation": generation, "question": question})
+        hallucination_grade = scores["hallucination"]["score"]
+        answer_grade = scores["answer"]["score"]
+        llm_calls += 2
+    elif GRADER_MODE == "combined":
+        scores = combined_grader.invoke({"documents": documents, "generation": generation, "question": question})
+        hallucination_grade = scores["grounded"]
+        answer_grade = scores["useful"]
+        llm_calls += 1
+    else:
+        score = hallucination_grader.invoke(
+            {"documents": documents, "generation": generation}
+        )
+        hallucination_grade = score["score"]
+        llm_calls += 1
+    if precheck and verdict is None:
+        log_verdict(local_score, generation, documents, hallucination_grade, precheck.semantic)
 
     # Check hallucination
     if hallucination_grade == "yes":
         print("---DECISION: GENERATION IS GROUNDED IN DOCUMENTS---")
         # Check answer relevance to question
         print("---GRADE GENERATION vs QUESTION---")
-        score = answer_grader.invoke({"question": question, "generation": generation})
-        answer_grade = score["score"]
-        if answer_grade == "yes":
-            print("---DECISION: GENERATION ADDRESSES QUESTION---")
-            return "useful"
-        else:
-            print("---DECISION: GENERATION DOES NOT ADDRESS QUESTION---")
-            return "not_useful"
+        if answer_grade is None:
+            score = answer_grader.invoke({"question": question, "generation": generation})
+            answer_grade = score["score"]
+            llm_calls += 1
+        grade = "useful" if answer_grade == "yes" else "not_useful"
+    else:
+        grade = "not_supported"
+    logging.info(f"---GRADING TOOK {time.perf_counter() - started:.2f}s ({GRADER_MODE})---")
+
+    state = {**state, "llm_calls": llm_calls}
+    update = {"llm_calls": llm_calls, "best": budget.keep_best(state, grade), "decision": grade, "strategy": ""}
+    if grade == "useful":
+        print("---DECISION: GENERATION ADDRESSES QUESTION---")
+        budget.record("useful")
+        return update
+
+    if grade == "not_supported":
+        print("---DECISION: GENERATION IS NOT GROUNDED IN DOCUMENTS---")
+        # Another attempt costs a generation plus a grading
+        stop_reason = budget.exhausted(state, 1 + budget.grading_calls(GRADER_MODE))
+        strategy = None if stop_reason else budget.next_strategy(state, build_context)
+        if strategy:
+            print(f"---DECISION: RE-TRY WITH {strategy}---")
+            budget.record(f"retry_{strategy}")
+            return {**update, "strategy": strategy}
+        stop_reason = stop_reason or "strategies"
     else:
-        generate_count = state["generate_count"]
-        if generate_count < 3:
-            print("---DECISION: GENERATION IS NOT GROUNDED IN DOCUMENTS, RE-TRY---")
-            return "not_supported"
-        else:
-            print("---DECISION: MAX GENERATION ATTEMPTS EXCEEDED, SKIPPING RE-TRY---")
-            return "useful"
+        print("---DECISION: GENERATION DOES NOT ADDRESS QUESTION---")
+        # A web search is followed by a generation and a grading
+        stop_reason = budget.exhausted({**state, "generate_count": 0}, 1 + budget.grading_calls(GRADER_MODE))
+        if not stop_reason and state.get("web_searches", 0) >= budget.MAX_WEB_SEARCHES:
+            stop_reason = "web_searches"
+        if not stop_reason:
+            return update
+
+    # Over budget: answer with the best graded generation so far instead of the last one
+    best = update["best"]
+    print(f"---DECISION: OVER BUDGET ({stop_reason}), RETURNING ATTEMPT {best['attempt']}---")
+    budget.record(f"exhausted_{stop_reason}")
+    budget.record("fallback_answers")
+    annotate("budget.exhausted", 1)
+    return {
+        **update,
+        "decision": "over_budget",
+        "stop_reason": stop_reason,
+        "generation": best["generation"],
+        "documents": best["documents"],
+    }
+
+def decide(state):
+    """
+    Next node after grading, as decided by `grade_generation`.
+
+    Args:
+        state (dict): The current graph state
+
+    Returns:
+        str: Decision for next node to call
+    """
+    return state["decision"]
 
 def web_search(state):
     """
@@ -233,15 +287,23 @@ def web_search(state):
         state (dict): The current graph state
 
     Returns:
-        state (dict): Updates documents key with appended web results
+        state (dict): Updates documents key with web results, one Document per page
     """
 
     logging.info("---WEB SEARCH---")
     question = state["question"]
 
-    # Web search
-    docs = TavilySearchResults(k=3).invoke({"query": question})
-    web_results = "\n".join([d["content"] for d in docs])
-    web_results = Document(page_content=web_results)
-
-    return {"documents": web_results, "question": question, "challenge_name": state["challenge_name"]}
\ No newline at end of file
+    # Web search: cached per normalized query, fanned out over query rewrites, merged by URL
+    web_results = search_web(question, state["challenge_name"] or "")
+    budget.record("web_searches")
+
+    return {
+        "documents": web_results,
+        "question": question,
+        "challenge_name": state["challenge_name"],
+        "started": budget.started_at(state),
+        "web_searches": state.get("web_searches", 0) + 1,
+        # New documents: the retry strategies start over on them
+        "attempts": [],
+        "strategy": "",
+    }
@@ -0,0 +1,272 @@
+import os
+import json
+import time
+import uuid
+import logging
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+from typing import Any, Callable, Dict, List, Optional
+from langchain.schema import Document
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.outputs import LLMResult
+from langchain_core.tracers.context import register_configure_hook
+
+# One OTLP/JSON `resourceSpans` object per question, one per line (what the OpenTelemetry
+# collector's otlpjsonfile receiver reads), e.g. traces/rag_traces.jsonl. Off unless set.
+TRACE_PATH = os.getenv("RAG_TRACE_PATH", "")
+# Optional OTLP/HTTP collector, e.g. http://localhost:4318
+OTLP_ENDPOINT = os.getenv("OTEL_EXPORTER_OTLP_ENDPOINT", "")
+SERVICE_NAME = "ragagent"
+
+class Span:
+    """One timed step of a question: a node, an edge function or the question itself."""
+
+    def __init__(self, trace_id: str, name: str, parent_id: Optional[str] = None):
+        self.trace_id = trace_id
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = parent_id
+        self.name = name
+        self.start_ns = time.time_ns()
+        self.end_ns: Optional[int] = None
+        self.attributes: Dict[str, Any] = {}
+        self.error: Optional[str] = None
+
+    @property
+    def seconds(self) -> float:
+        return ((self.end_ns or time.time_ns()) - self.start_ns) / 1e9
+
+    def add(self, key: str, value: int):
+        self.attributes[key] = self.attributes.get(key, 0) + value
+
+class Trace:
+    """All spans recorded while answering one question."""
+
+    def __init__(self, question: str):
+        self.trace_id = uuid.uuid4().hex
+        self.root = Span(self.trace_id, "question")
+        self.root.attributes["question"] = question
+        self.spans: List[Span] = [self.root]
+        self.lock = threading.Lock()
+
+_current_trace: ContextVar[Optional[Trace]] = ContextVar("rag_trace", default=None)
+_current_span: ContextVar[Optional[Span]] = ContextVar("rag_trace_span", default=None)
+
+class TokenCounter(BaseCallbackHandler):
+    """Adds the prompt/completion token counts of every LLM call to the span it was made in."""
+
+    def on_llm_end(self, response: LLMResult, **kwargs: Any):
+        span = _current_span.get()
+        if span is None:
+            return
+        prompt_tokens = completion_tokens = 0
+        for generations in response.generations:
+            for generation in generations:
+                usage = getattr(getattr(generation, "message", None), "usage_metadata", None) or {}
+                info = generation.generation_info or {}
+                # usage_metadata (langchain_ollama and most chat models), else Ollama's raw counters
+                prompt_tokens += usage.get("input_tokens") or info.get("prompt_eval_count") or 0
+                completion_tokens += usage.get("output_tokens") or info.get("eval_count") or 0
+        span.add("llm.calls", 1)
+        span.add("llm.prompt_tokens", prompt_tokens)
+        span.add("llm.completion_tokens", completion_tokens)
+
+# Every LangChain run started while a question is traced gets the TokenCounter, without
+# having to thread callbacks through the graph nodes
+_token_counter_var: ContextVar[Optional[TokenCounter]] = ContextVar("rag_trace_token_counter", default=None)
+register_configure_hook(_token_counter_var, inheritable=True)
+
+def annotate(key: str, value: int):
+    """Add `value` to counter `key` (e.g. "context.tokens_saved") on the span of the step being traced, if any."""
+    span = _current_span.get()
+    if span is not None:
+        span.add(key, value)
+
+def _count_documents(documents) -> int:
+    if documents is None:
+        return 0
+    if isinstance(documents, Document):
+        return 1
+    return len(documents)
+
+def _otlp_value(value) -> Dict[str, Any]:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+def to_otlp(trace: Trace) -> Dict[str, Any]:
+    """Render a trace as an OTLP/JSON ExportTraceServiceRequest."""
+    spans = []
+    for span in trace.spans:
+        otlp_span = {
+            "traceId": span.trace_id,
+            "spanId": span.span_id,
+            "name": span.name,
+            "kind": 1,
+            "startTimeUnixNano": str(span.start_ns),
+            "endTimeUnixNano": str(span.end_ns or span.start_ns),
+            "attributes": [{"key": k, "value": _otlp_value(v)} for k, v in span.attributes.items()],
+            "status": {"code": 2, "message": span.error} if span.error else {"code": 1},
+        }
+        if span.parent_id:
+            otlp_span["parentSpanId"] = span.parent_id
+        spans.append(otlp_span)
+    return {
+        "resourceSpans": [{
+            "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": SERVICE_NAME}}]},
+            "scopeSpans": [{"scope": {"name": "utils.tracing"}, "spans": spans}],
+        }]
+    }
+
+def summarize(trace: Trace) -> Dict[str, Any]:
+    """
+    Per-question summary of a finished trace.
+
+    Returns:
+        dict: total seconds, time/calls per node and edge, LLM calls and tokens, prompt
+        tokens saved by context assembly, retrieved documents, generation retries, web searches
+        and whether the request ran out of budget
+    """
+    steps: Dict[str, Dict[str, float]] = {}
+    totals = {"llm.calls": 0, "llm.prompt_tokens": 0, "llm.completion_tokens": 0, "context.tokens_saved": 0, "budget.exhausted": 0}
+    documents = 0
+    for span in trace.spans[1:]:
+        step = steps.setdefault(span.name, {"calls": 0, "seconds": 0.0})
+        step["calls"] += 1
+        step["seconds"] = round(step["seconds"] + span.seconds, 4)
+        for key in totals:
+            totals[key] += span.attributes.get(key, 0)
+        if span.name == "node.retrieve":
+            documents = span.attributes.get("documents", 0)
+    generations = steps.get("node.generate", {}).get("calls", 0)
+    return {
+        "question": trace.root.attributes["question"],
+        "trace_id": trace.trace_id,
+        "seconds": round(trace.root.seconds, 4),
+        "steps": steps,
+        "llm_calls": totals["llm.calls"],
+        "prompt_tokens": totals["llm.prompt_tokens"],
+        "completion_tokens": totals["llm.completion_tokens"],
+        "context_tokens_saved": totals["context.tokens_saved"],
+        "documents": documents,
+        "retries": max(0, generations - 1),
+        "web_searches": steps.get("node.web_search", {}).get("calls", 0),
+        "budget_exhausted": bool(totals["budget.exhausted"]),
+    }
+
+class Tracer:
+    """
+    Wraps graph nodes and conditional-edge functions in spans, and exports one trace
+    per question (OTLP/JSON lines file and/or an OTLP/HTTP collector).
+
+    Steps that run outside `tracer.question(...)` are not recorded.
+
+    Attributes:
+        path: OTLP/JSON lines file, or "" to skip the file export
+        endpoint: OTLP/HTTP collector base URL, or "" to skip it
+        summaries: per-question summaries of the traces finished so far, newest last
+    """
+
+    def __init__(self, path: str = TRACE_PATH, endpoint: str = OTLP_ENDPOINT, keep: int = 100):
+        self.path = path
+        self.endpoint = endpoint.rstrip("/")
+        self.keep = keep
+        self.summaries: List[Dict[str, Any]] = []
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def question(self, question: str):
+        """Trace everything the graph does for `question`; yields the Trace."""
+        if _current_trace.get() is not None:
+            # Nested entry point (e.g. cached_invoke called from a traced caller): reuse the trace
+            yield _current_trace.get()
+            return
+        trace = Trace(question)
+        tokens = (_current_trace.set(trace), _current_span.set(trace.root), _token_counter_var.set(TokenCounter()))
+        try:
+            yield trace
+        except Exception as e:
+            trace.root.error = str(e)
+            raise
+        finally:
+            _token_counter_var.reset(tokens[2])
+            _current_span.reset(tokens[1])
+            _current_trace.reset(tokens[0])
+            trace.root.end_ns = time.time_ns()
+            self._finish(trace)
+
+    def _step(self, kind: str, name: str, fn: Callable, record: Callable[[Span, Any], None]) -> Callable:
+        @wraps(fn)
+        def wrapper(state, *args, **kwargs):
+            trace = _current_trace.get()
+            if trace is None:
+                return fn(state, *args, **kwargs)
+            parent = _current_span.get()
+            span = Span(trace.trace_id, f"{kind}.{name}", parent.span_id if parent else None)
+            with trace.lock:
+                trace.spans.append(span)
+            token = _current_span.set(span)
+            try:
+                result = fn(state, *args, **kwargs)
+                record(span, result)
+                return result
+            except Exception as e:
+                span.error = str(e)
+                raise
+            finally:
+                _current_span.reset(token)
+                span.end_ns = time.time_ns()
+        return wrapper
+
+    def node(self, name: str, fn: Callable) -> Callable:
+        """Wrap a graph node; records retrieved-document counts and the generation attempt."""
+        def record(span: Span, result):
+            if isinstance(result, dict):
+                if "documents" in result:
+                    span.attributes["documents"] = _count_documents(result["documents"])
+                if "generate_count" in result:
+                    span.attributes["attempt"] = result["generate_count"]
+                if result.get("challenge_name"):
+                    span.attributes["challenge_name"] = result["challenge_name"]
+        return self._step("node", name, fn, record)
+
+    def edge(self, name: str, fn: Callable) -> Callable:
+        """Wrap a conditional-edge function; records the decision it returned."""
+        def record(span: Span, result):
+            span.attributes["decision"] = str(result)
+        return self._step("edge", name, fn, record)
+
+    def _finish(self, trace: Trace):
+        summary = summarize(trace)
+        logging.info(
+            f"---TRACE {trace.trace_id[:8]}: {summary['seconds']:.2f}s, {summary['llm_calls']} LLM calls, "
+            f"{summary['prompt_tokens']}+{summary['completion_tokens']} tokens, {summary['retries']} retries---"
+        )
+        with self._lock:
+            self.summaries.append(summary)
+            del self.summaries[:-self.keep]
+        self.export(trace)
+
+    def export(self, trace: Trace):
+        payload = to_otlp(trace)
+        if self.path:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            with self._lock, open(self.path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(payload) + "\n")
+        if self.endpoint:
+            import httpx
+
+            try:
+                httpx.post(f"{self.endpoint}/v1/traces", json=payload, timeout=5.0).raise_for_status()
+            except httpx.HTTPError as e:
+                logging.warning(f"---TRACE EXPORT TO {self.endpoint} FAILED: {e}---")
+
+# Process-wide tracer used by main.py's graph
+tracer = Tracer()
@@ -0,0 +1,123 @@
+import os
+import threading
+import time
+from typing import Dict, Tuple
+from langchain_ollama import OllamaEmbeddings
+from utils.embedding_cache import CachedEmbeddings
+from utils.vector_backends import VectorBackend, open_backend
+
+COLLECTION_NAME = os.getenv("VECTOR_COLLECTION", "htb_2025")
+# Chroma data, and the local files kept next to the store for every backend
+# (ingest manifest, index version, keyword index)
+PERSIST_DIRECTORY = os.getenv("CHROMA_PERSIST_DIR", "D:/AI-LLM/Agents/RAGAgent/crawled_data_store")
+# "chroma" (local files) or "pgvector" (Postgres at PGVECTOR_DSN)
+VECTOR_BACKEND = os.getenv("VECTOR_BACKEND", "chroma")
+EMBEDDING_MODEL = "bge-m3"
+# Touched by every ingest that changes the collection, so caches over it know to drop stale entries
+INDEX_VERSION_PATH = os.path.join(PERSIST_DIRECTORY, "index_version")
+
+_lock = threading.Lock()
+_embeddings: Dict[str, CachedEmbeddings] = {}
+_stores: Dict[Tuple[str, str, str, str], VectorBackend] = {}
+_stats = {"embedding_opens": 0, "embedding_hits": 0, "store_opens": 0, "store_hits": 0}
+
+def get_embeddings(model: str = EMBEDDING_MODEL) -> CachedEmbeddings:
+    """
+    Return the process-wide embeddings client for `model`, creating it on first use.
+    The client is wrapped in the persistent embedding cache, so repeated questions and
+    unchanged chunks are not re-embedded.
+
+    Args:
+        model (str): Ollama embedding model name
+
+    Returns:
+        CachedEmbeddings: Shared, cached embeddings client
+    """
+    with _lock:
+        embeddings = _embeddings.get(model)
+        if embeddings is None:
+            embeddings = CachedEmbeddings(OllamaEmbeddings(model=model), model)
+            _embeddings[model] = embeddings
+            _stats["embedding_opens"] += 1
+        else:
+            _stats["embedding_hits"] += 1
+        return embeddings
+
+def get_vectorstore(
+    collection_name: str = COLLECTION_NAME,
+    persist_directory: str = PERSIST_DIRECTORY,
+    embedding_model: str = EMBEDDING_MODEL,
+    backend: str = VECTOR_BACKEND,
+) -> VectorBackend:
+    """
+    Return the process-wide store for a collection/persist dir/embedding model/backend,
+    opening it on first use. Later calls reuse the same client and HNSW index.
+
+    Args:
+        collection_name (str): Collection name
+        persist_directory (str): Chroma persist directory, and where local index files live
+        embedding_model (str): Ollama embedding model name
+        backend (str): "chroma" or "pgvector"
+
+    Returns:
+        VectorBackend: Shared vectorstore
+    """
+    key = (collection_name, persist_directory, embedding_model, backend)
+    with _lock:
+        store = _stores.get(key)
+        if store is not None:
+            _stats["store_hits"] += 1
+            return store
+
+    embeddings = get_embeddings(embedding_model)
+    with _lock:
+        # Another thread may have opened it while we were building the embeddings
+        store = _stores.get(key)
+        if store is None:
+            store = open_backend(backend, collection_name, embeddings, persist_directory)
+            _stores[key] = store
+            _stats["store_opens"] += 1
+        else:
+            _stats["store_hits"] += 1
+        return store
+
+def warm_up(
+    collection_name: str = COLLECTION_NAME,
+    persist_directory: str = PERSIST_DIRECTORY,
+    embedding_model: str = EMBEDDING_MODEL,
+    backend: str = VECTOR_BACKEND,
+) -> VectorBackend:
+    """
+    Open the vectorstore ahead of the first request so it does not pay the open cost.
+
+    Returns:
+        VectorBackend: Shared vectorstore
+    """
+    store = get_vectorstore(collection_name, persist_directory, embedding_model, backend)
+    # Touching the collection forces Chroma to load its segment files (and pgvector to connect)
+    store.count()
+    return store
+
+def get_stats() -> Dict[str, int]:
+    """Return a copy of the open/hit counters, plus embedding cache counters per model."""
+    with _lock:
+        stats = dict(_stats)
+        embeddings = dict(_embeddings)
+    for model, cached in embeddings.items():
+        for name, value in cached.get_stats().items():
+            stats[f"embedding_cache.{model}.{name}"] = value
+    return stats
+
+def bump_index_version(path: str = INDEX_VERSION_PATH):
+    """Record that the collection changed, e.g. after a re-index."""
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(str(time.time_ns()))
+
+def get_index_version(path: str = INDEX_VERSION_PATH) -> str:
+    """Opaque token that changes whenever `bump_index_version` is called."""
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return f.read().strip()
+    except FileNotFoundError:
+        return ""
@@ -0,0 +1,272 @@
+import os
+import re
+import json
+import time
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import urlsplit, urlunsplit
+from langchain.schema import Document
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+from utils.embedding_cache import normalize_text
+from utils.hybrid import RRF_K
+from utils.vectorstore import get_vectorstore, PERSIST_DIRECTORY
+
+# "tavily" (needs TAVILY_API_KEY) or "stub" (local, for tests and offline benchmarks)
+PROVIDER = os.getenv("WEB_SEARCH_PROVIDER", "tavily")
+# Results per query rewrite, and documents returned after merging
+MAX_RESULTS = int(os.getenv("WEB_SEARCH_MAX_RESULTS", "3"))
+CACHE_TTL = float(os.getenv("WEB_SEARCH_CACHE_TTL", "3600"))
+CACHE_SIZE = int(os.getenv("WEB_SEARCH_CACHE_SIZE", "256"))
+# Query rewrites searched concurrently per question (1 = the question only)
+REWRITES = int(os.getenv("WEB_SEARCH_REWRITES", "3"))
+# Optional JSONL of {"url", "title", "content"} pages for the stub provider
+STUB_PATH = os.getenv("WEB_SEARCH_STUB_PATH", "")
+# Also ingest fetched pages into the vectorstore, so the next identical question is answered locally.
+# Only searches for a known challenge are indexed: scoped retrieval is the only way back to them.
+INDEX_RESULTS = os.getenv("WEB_SEARCH_INDEX", "0") == "1"
+MANIFEST_PATH = os.path.join(PERSIST_DIRECTORY, "web_manifest.json")
+
+WORD = re.compile(r"[a-z0-9](?:[a-z0-9.\-]*[a-z0-9])?")
+STOP_WORDS = {
+    "a", "an", "the", "how", "what", "why", "when", "where", "which", "who", "is", "are", "was", "were",
+    "do", "does", "did", "to", "of", "in", "on", "for", "with", "and", "or", "i", "me", "my", "can", "you",
+    "please", "give", "show", "tell", "about", "this", "that", "it", "be", "should",
+}
+
+_stats_lock = threading.Lock()
+_stats = {"searches": 0, "provider_calls": 0, "cache_hits": 0, "cache_expired": 0, "errors": 0, "indexed": 0}
+
+def _count(key: str, value: int = 1):
+    with _stats_lock:
+        _stats[key] += value
+
+def get_stats() -> Dict[str, int]:
+    with _stats_lock:
+        return dict(_stats)
+
+class SearchProvider:
+    """A web search backend: query -> list of {"url", "title", "content"} results, best first."""
+
+    name = ""
+
+    def search(self, query: str, k: int) -> List[Dict[str, str]]:
+        raise NotImplementedError
+
+class TavilyProvider(SearchProvider):
+    name = "tavily"
+
+    def search(self, query, k):
+        from langchain_community.tools.tavily_search import TavilySearchResults
+
+        results = TavilySearchResults(max_results=k).invoke({"query": query})
+        if isinstance(results, str):
+            # The tool reports API errors as a string instead of raising
+            raise RuntimeError(results)
+        return [{"url": r.get("url", ""), "title": r.get("title", ""), "content": r.get("content", "")} for r in results]
+
+class StubProvider(SearchProvider):
+    """
+    Offline provider: ranks a fixed set of pages by words shared with the query. Without pages,
+    returns one canned result per query, so the graph still has something to generate from.
+    """
+
+    name = "stub"
+
+    def __init__(self, pages: Optional[List[Dict[str, str]]] = None):
+        self.pages = pages or []
+
+    @classmethod
+    def from_jsonl(cls, path: str) -> "StubProvider":
+        with open(path, "r", encoding="utf-8") as f:
+            return cls([json.loads(line) for line in f if line.strip()])
+
+    def search(self, query, k):
+        words = set(WORD.findall(query.lower())) - STOP_WORDS
+        if not self.pages:
+            slug = "-".join(sorted(words))[:80] or "empty"
+            return [{"url": f"https://stub.invalid/{slug}", "title": query, "content": f"Stub search result for: {query}"}]
+        scored = [(len(words & set(WORD.findall(p["content"].lower()))), i) for i, p in enumerate(self.pages)]
+        return [dict(self.pages[i]) for score, i in sorted(scored, key=lambda s: (-s[0], s[1])) if score][:k]
+
+def normalize_query(query: str) -> str:
+    """Cache key form of a query: Unicode-normalized, lowercased, whitespace collapsed."""
+    return normalize_text(query).lower().strip(" ?!.")
+
+def normalize_url(url: str) -> str:
+    """Drop the fragment and trailing slash, so the same page found by two rewrites merges."""
+    parts = urlsplit(url)
+    return urlunsplit((parts.scheme.lower(), parts.netloc.lower(), parts.path.rstrip("/"), parts.query, ""))
+
+def rewrite_queries(question: str, challenge_name: str = "", n: int = REWRITES) -> List[str]:
+    """
+    Up to `n` distinct queries for one question: the question itself, its keywords only, and
+    the keywords scoped to the HackTheBox challenge when one is known. Local rules, so the
+    fan-out adds no LLM call.
+    """
+    keywords = " ".join(w for w in WORD.findall(question.lower()) if w not in STOP_WORDS)
+    queries = [question.strip(), keywords]
+    if challenge_name and challenge_name != "unknown":
+        queries.append(f"HackTheBox {challenge_name} writeup {keywords}".strip())
+    unique: List[str] = []
+    for query in queries:
+        if query and normalize_query(query) not in {normalize_query(u) for u in unique}:
+            unique.append(query)
+    return unique[:max(1, n)]
+
+class WebSearch:
+    """
+    Web search with a TTL'd result cache and concurrent fan-out over query rewrites.
+
+    Attributes:
+        provider: search backend
+        ttl: seconds a cached result list stays valid
+        max_entries: cached queries kept (least recently used are dropped)
+    """
+
+    def __init__(self, provider: SearchProvider, ttl: float = CACHE_TTL, max_entries: int = CACHE_SIZE, concurrency: int = REWRITES):
+        self.provider = provider
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._cache: "OrderedDict[Tuple[str, str, int], Tuple[float, List[Dict[str, str]]]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers=max(1, concurrency), thread_name_prefix="web_search")
+
+    def search_one(self, query: str, k: int = MAX_RESULTS) -> List[Dict[str, str]]:
+        """Results for one query, from the cache when a fresh entry exists."""
+        key = (self.provider.name, normalize_query(query), k)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._cache.get(key)
+            if entry is not None:
+                if now - entry[0] < self.ttl:
+                    self._cache.move_to_end(key)
+                    _count("cache_hits")
+                    return entry[1]
+                del self._cache[key]
+                _count("cache_expired")
+        _count("provider_calls")
+        results = self.provider.search(query, k)
+        with self._lock:
+            self._cache[key] = (now, results)
+            while len(self._cache) > self.max_entries:
+                self._cache.popitem(last=False)
+        return results
+
+    def search(self, queries: List[str], k: int = MAX_RESULTS) -> List[Document]:
+        """
+        Search every query concurrently and merge the results.
+
+        Results are deduplicated by URL (and identical content), ranked by reciprocal-rank
+        fusion across the queries, and returned as one Document per page.
+
+        Returns:
+            list: Up to `k` Documents with the page URL as metadata source/url
+        """
+        _count("searches")
+        futures = [self._pool.submit(self.search_one, query, k) for query in queries]
+        scores: Dict[str, float] = {}
+        pages: Dict[str, Dict[str, str]] = {}
+        seen_content: Dict[str, str] = {}
+        for query, future in zip(queries, futures):
+            try:
+                results = future.result()
+            except Exception as e:
+                _count("errors")
+                logging.warning(f"---WEB SEARCH FAILED FOR {query!r}: {e}---")
+                continue
+            for rank, result in enumerate(results, start=1):
+                content = (result.get("content") or "").strip()
+                if not content:
+                    continue
+                url = normalize_url(result.get("url") or "")
+                digest = hashlib.sha1(content.encode("utf-8")).hexdigest()
+                key = seen_content.setdefault(digest, url or digest)
+                page = pages.setdefault(key, {**result, "query": query})
+                # Keep the fullest snippet of a page that several rewrites returned
+                if len(content) > len(page.get("content") or ""):
+                    page.update(result)
+                scores[key] = scores.get(key, 0.0) + 1.0 / (RRF_K + rank)
+        ranked = sorted(scores, key=scores.get, reverse=True)[:k]
+        return [
+            Document(
+                page_content=pages[key]["content"].strip(),
+                metadata={
+                    "source": pages[key].get("url", ""),
+                    "url": pages[key].get("url", ""),
+                    "title": pages[key].get("title", ""),
+                    "query": pages[key]["query"],
+                },
+            )
+            for key in ranked
+        ]
+
+def get_provider(name: str = PROVIDER) -> SearchProvider:
+    if name == "tavily":
+        return TavilyProvider()
+    if name == "stub":
+        return StubProvider.from_jsonl(STUB_PATH) if STUB_PATH else StubProvider()
+    raise ValueError(f"Unknown web search provider {name!r}, expected 'tavily' or 'stub'")
+
+_web_search: Optional[WebSearch] = None
+_web_search_lock = threading.Lock()
+# One writer, so concurrent requests do not race on the web ingest manifest
+_index_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="web_index")
+
+def get_web_search() -> WebSearch:
+    """Process-wide WebSearch over the configured provider, so its cache is shared."""
+    global _web_search
+    with _web_search_lock:
+        if _web_search is None:
+            _web_search = WebSearch(get_provider())
+        return _web_search
+
+def is_indexable(challenge_name: str) -> bool:
+    """Whether pages found for `challenge_name` can be cached locally: only under a real challenge."""
+    return bool(challenge_name) and challenge_name != "unknown"
+
+def index_results(documents: List[Document], challenge_name: str) -> Dict[str, int]:
+    """
+    Ingest fetched pages into the shared vectorstore through the web manifest, tagged with the
+    challenge, so challenge-scoped retrieval finds them next time. Pages without a challenge
+    are not indexed: retrieval could never scope to them, and "unknown" would become a challenge.
+    """
+    from utils.ingest_manifest import IngestManifest, index_incrementally
+
+    if not is_indexable(challenge_name):
+        return {"added": 0, "updated": 0, "skipped": 0, "removed": 0, "chunks": 0}
+
+    docs = [
+        Document(page_content=d.page_content, metadata={**d.metadata, "challenge_name": challenge_name})
+        for d in documents if d.metadata.get("url")
+    ]
+    # Its own chunk IDs: a result for a page the crawler indexed must not overwrite the full page
+    manifest = IngestManifest(MANIFEST_PATH, namespace="web:")
+    stats = index_incrementally(
+        get_vectorstore(),
+        docs,
+        RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=200),
+        manifest,
+        source_key="url",
+        # Pages from earlier searches stay indexed
+        known_sources=manifest.sources(),
+    )
+    _count("indexed", stats["added"] + stats["updated"])
+    return stats
+
+def _log_index_failure(future):
+    if future.exception() is not None:
+        logging.warning(f"---WEB RESULTS NOT INDEXED: {future.exception()}---")
+
+def search_web(question: str, challenge_name: str = "", k: int = MAX_RESULTS, index: bool = INDEX_RESULTS) -> List[Document]:
+    """
+    Search the web for `question` (fanned out over its rewrites) and return one Document per page.
+    With `index`, the pages of a challenge-scoped search are also ingested in the background.
+    """
+    documents = get_web_search().search(rewrite_queries(question, challenge_name), k)
+    if index and documents and is_indexable(challenge_name):
+        _index_pool.submit(index_results, documents, challenge_name).add_done_callback(_log_index_failure)
+    return documents
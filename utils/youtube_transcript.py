@@ -1,50 +1,58 @@
-from youtube_transcript_api import YouTubeTranscriptApi
+"""
+Refine YouTube walkthrough transcripts with the local LLM and index them.
+
+Pipeline per batch of videos:
+    fetch    transcripts (injectable fetcher, so tests need no network)
+    map      clean every ~2000-char chunk, all videos' chunks concurrently up to `concurrency`
+    reduce   polish adjacent refined chunks in groups that fit the context window, repeated
+             while groups still merge, instead of one call over the whole transcript
+    index    split for retrieval and sync through the ingest manifest, tagged with the challenge
+
+Map and reduce outputs are cached by content hash, so re-running over the same videos
+makes no LLM calls.
+
+Usage:
+    python -m utils.youtube_transcript KvUC7bakm-E=fluffy dQw4w9WgXcQ=twomillion
+    python -m utils.youtube_transcript --file videos.txt --concurrency 8
+"""
+import os
+import json
+import sqlite3
+import hashlib
+import logging
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
 from langchain_core.documents import Document
+from langchain_core.language_models import BaseChatModel
 from langchain_text_splitters import RecursiveCharacterTextSplitter
-from langchain_community.vectorstores import Chroma
-from langchain_ollama import OllamaEmbeddings, ChatOllama
+from langchain_ollama import ChatOllama
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_core.output_parsers import StrOutputParser
 from dotenv import load_dotenv
+from utils.vectorstore import get_vectorstore, PERSIST_DIRECTORY
+from utils.vector_backends import VectorBackend
+from utils.ingest_manifest import IngestManifest, index_incrementally
+from utils.context import count_tokens
 
 load_dotenv()
 
-llm = ChatOllama(
-    model="llama3.1:8b-instruct-q4_0",
-    temperature=0.2,     # low temperature for editing tasks, higher for creative tasks
-    num_ctx=8192,        # increase if your model supports it
-)
-
-to_text = StrOutputParser()
+MODEL = "llama3.1:8b-instruct-q4_0"
+NUM_CTX = 8192
+# Concurrent map/reduce calls; match OLLAMA_NUM_PARALLEL on the server
+CONCURRENCY = int(os.getenv("TRANSCRIPT_CONCURRENCY", "4"))
+# Polishing returns about as much text as it is given, so one reduce call's input and
+# output share num_ctx with the prompt (~200 tokens) and some headroom
+REDUCE_INPUT_TOKENS = (NUM_CTX - 512) // 2
+CACHE_PATH = os.getenv("TRANSCRIPT_CACHE_PATH", os.path.join(os.path.expanduser("~"), ".cache", "ragagent", "transcripts.sqlite"))
+MANIFEST_PATH = os.path.join(PERSIST_DIRECTORY, "youtube_manifest.json")
+# Bump when the prompts change, so cached outputs of the old prompts are not reused
+PROMPT_VERSION = "1"
 
-# ---------- 1) Fetch transcript ----------
-ytt_api = YouTubeTranscriptApi()
 # Each item: {"text": "...", "start": float, "duration": float}
-fetched_transcript = ytt_api.fetch("KvUC7bakm-E", languages=["en"])  # or fetch(...)
-
-# Optional: quick guard for empty transcripts
-if not fetched_transcript:
-    raise RuntimeError("No transcript found for video KvUC7bakm-E")
-
-# ---------- 2) Prepare raw text & docs ----------
-# Keep timestamps in metadata for traceability; also build a raw text blob
-docs_raw = []
-raw_lines = []
-for snip in fetched_transcript:
-    text = (snip.text or "").strip()
-    if not text:
-        continue
-    docs_raw.append(
-        Document(
-            page_content=text,
-            metadata={"start": snip.start, "duration": snip.duration}
-        )
-    )
-    raw_lines.append(text)
-
-raw_text = "\n".join(raw_lines)
+TranscriptFetcher = Callable[[str], List[Dict[str, Any]]]
 
-# # ---------- 4) Prompts ----------
 map_prompt = ChatPromptTemplate.from_messages([
     ("system",
      "You are a careful editor. Clean up an automatic speech transcript so it's accurate and easy to use for retrieval.\n"
@@ -66,58 +74,235 @@ reduce_prompt = ChatPromptTemplate.from_messages([
     ("user", "Refined chunks:\n```{joined}```")
 ])
 
-to_text = StrOutputParser()
+def fetch_transcript(video_id: str, languages: Tuple[str, ...] = ("en",)) -> List[Dict[str, Any]]:
+    """Default fetcher: the video's transcript from YouTube."""
+    from youtube_transcript_api import YouTubeTranscriptApi
+
+    fetched = YouTubeTranscriptApi().fetch(video_id, languages=list(languages))
+    return [{"text": s.text, "start": s.start, "duration": s.duration} for s in fetched]
+
+def transcript_text(snippets: List[Dict[str, Any]]) -> str:
+    return "\n".join(text for text in ((s.get("text") or "").strip() for s in snippets) if text)
+
+class RefineCache:
+    """LLM outputs keyed by sha256 of (step, model, prompt version, input text), in SQLite."""
+
+    def __init__(self, path: Optional[str] = CACHE_PATH):
+        self._lock = threading.Lock()
+        self._db = None
+        if path:
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("CREATE TABLE IF NOT EXISTS refined (key TEXT PRIMARY KEY, text TEXT)")
+            self._db.commit()
 
-map_chain = map_prompt | llm | to_text
-reduce_chain = reduce_prompt | llm | to_text
+    @staticmethod
+    def key(step: str, model: str, text: str) -> str:
+        return hashlib.sha256(f"{step}\0{model}\0{PROMPT_VERSION}\0{text}".encode("utf-8")).hexdigest()
 
-# # ---------- 5) Chunk for refinement (map) ----------
-# # Use slightly smaller chunks for editing than for retrieval to keep prompts snappy.
-refine_splitter = RecursiveCharacterTextSplitter(
-    chunk_size=2000, chunk_overlap=200,
-    separators=["\n\n", "\n", ". ", " "]
-)
-refine_chunks = refine_splitter.split_text(raw_text)
+    def get_many(self, keys: List[str]) -> Dict[str, str]:
+        if self._db is None or not keys:
+            return {}
+        found: Dict[str, str] = {}
+        with self._lock:
+            for i in range(0, len(keys), 500):
+                part = keys[i:i + 500]
+                rows = self._db.execute(f"SELECT key, text FROM refined WHERE key IN ({','.join('?' * len(part))})", part).fetchall()
+                found.update(rows)
+        return found
 
-# # Run the map step
-refined_chunks = [map_chain.invoke({"chunk": ch}) for ch in refine_chunks]
+    def put_many(self, items: Dict[str, str]):
+        if self._db is None or not items:
+            return
+        with self._lock:
+            self._db.executemany("INSERT OR REPLACE INTO refined (key, text) VALUES (?, ?)", list(items.items()))
+            self._db.commit()
 
-# # ---------- 6) Light reduce step ----------
-# # If the transcript is short, this is trivial; for long transcripts it smooths boundaries.
-refined_full = reduce_chain.invoke({"joined": "\n\n".join(refined_chunks)})
+class TranscriptRefiner:
+    """
+    Concurrent, cached map-reduce over transcript chunks.
 
-# # ---------- 7) Build Documents for RAG ----------
-# # We’ll split the refined text for retrieval. Keep source metadata pointing to the YouTube video id.
-rag_splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=200)
-rag_docs = [
-    Document(page_content=chunk, metadata={"source": "youtube", "video_id": "KvUC7bakm-E"})
-    for chunk in rag_splitter.split_text(refined_full)
-]
+    Attributes:
+        llm: chat model used for both steps
+        concurrency: LLM calls in flight
+        reduce_tokens: maximum tokens of refined text per reduce call
+        stats: map/reduce calls made and served from the cache
+    """
 
-# # ---------- 8) Store in Chroma ----------
-Chroma.from_documents(
-    documents=rag_docs,
-    collection_name="htb-fluffy",
-    persist_directory="../crawl4ai_store",
-    embedding=OllamaEmbeddings(model="nomic-embed-text") 
-)
+    def __init__(
+        self,
+        llm: Optional[BaseChatModel] = None,
+        concurrency: int = CONCURRENCY,
+        cache: Optional[RefineCache] = None,
+        reduce_tokens: int = REDUCE_INPUT_TOKENS,
+    ):
+        # low temperature for editing tasks, higher for creative tasks
+        self.llm = llm or ChatOllama(model=MODEL, temperature=0.2, num_ctx=NUM_CTX)
+        self.model = getattr(self.llm, "model", type(self.llm).__name__)
+        self.concurrency = concurrency
+        self.cache = cache if cache is not None else RefineCache()
+        self.reduce_tokens = reduce_tokens
+        self.map_chain = map_prompt | self.llm | StrOutputParser()
+        self.reduce_chain = reduce_prompt | self.llm | StrOutputParser()
+        self.stats = {"map_calls": 0, "map_cached": 0, "reduce_calls": 0, "reduce_cached": 0}
+        self._stats_lock = threading.Lock()
 
-print("✅ Transcript refined and indexed to Chroma.")
+    def _run(self, step: str, chain, field: str, texts: List[str]) -> List[str]:
+        """Run `chain` over `texts` concurrently, skipping (and filling) the cache."""
+        keys = [RefineCache.key(step, self.model, t) for t in texts]
+        found = self.cache.get_many(list(dict.fromkeys(keys)))
+        todo = {k: t for k, t in zip(keys, texts) if k not in found}
+        if todo:
+            outputs = chain.batch([{field: t} for t in todo.values()], config={"max_concurrency": self.concurrency})
+            fresh = {k: out.strip() for k, out in zip(todo, outputs)}
+            self.cache.put_many(fresh)
+            found.update(fresh)
+        with self._stats_lock:
+            self.stats[f"{step}_calls"] += len(todo)
+            self.stats[f"{step}_cached"] += len(texts) - len(todo)
+        return [found[k] for k in keys]
 
-# vectorstore = Chroma(
-#     collection_name="htb-fluffy", persist_directory="../crawl4ai_store", embedding_function=OllamaEmbeddings(model="nomic-embed-text")
-# )
+    def refine(self, chunks: List[str]) -> List[str]:
+        """Map step: clean every chunk."""
+        return self._run("map", self.map_chain, "chunk", chunks)
 
-# retriever = vectorstore.as_retriever(k=3)
+    def _groups(self, pieces: List[str]) -> List[List[str]]:
+        """Pack adjacent pieces into groups of at most `reduce_tokens` (a bigger piece stays alone)."""
+        groups: List[List[str]] = []
+        used = 0
+        for piece in pieces:
+            tokens = count_tokens(piece)
+            if groups and used + tokens <= self.reduce_tokens:
+                groups[-1].append(piece)
+                used += tokens
+            else:
+                groups.append([piece])
+                used = tokens
+        return groups
 
-# question = "From the youtube video transcript, give me plan of how to fully solve the Fluffy challenge in Hack The Box."
-# documents = retriever.invoke(question)
+    def reduce(self, pieces: List[str]) -> str:
+        """
+        Hierarchical reduce: polish groups of adjacent pieces that fit the context window, and
+        repeat on the results while that still merges anything. Long transcripts end as several
+        polished sections rather than one call that overflows num_ctx; a single piece has no
+        boundaries to smooth and is returned as is.
+        """
+        pieces = [p for p in pieces if p.strip()]
+        while len(pieces) > 1:
+            groups = self._groups(pieces)
+            if len(groups) == len(pieces):
+                break
+            pieces = self._run("reduce", self.reduce_chain, "joined", ["\n\n".join(g) for g in groups])
+        return "\n\n".join(pieces)
+
+def refine_videos(
+    video_ids: List[str],
+    refiner: TranscriptRefiner,
+    fetcher: TranscriptFetcher = fetch_transcript,
+    chunk_size: int = 2000,
+    chunk_overlap: int = 200,
+) -> Tuple[Dict[str, str], Dict[str, str]]:
+    """
+    Fetch and refine many videos; all their map calls share one concurrent batch.
+
+    Returns:
+        tuple: (video id -> refined transcript, video id -> error for videos that were skipped)
+    """
+    # Slightly smaller chunks for editing than for retrieval keep prompts snappy
+    splitter = RecursiveCharacterTextSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap, separators=["\n\n", "\n", ". ", " "])
+    errors: Dict[str, str] = {}
+
+    def fetch(video_id: str) -> Optional[str]:
+        try:
+            text = transcript_text(fetcher(video_id))
+        except Exception as e:
+            errors[video_id] = str(e)
+            return None
+        if not text:
+            errors[video_id] = "no transcript"
+        return text or None
+
+    with ThreadPoolExecutor(max_workers=refiner.concurrency) as pool:
+        texts = dict(zip(video_ids, pool.map(fetch, video_ids)))
+    chunks = {vid: splitter.split_text(text) for vid, text in texts.items() if text}
+    flat = [chunk for vid_chunks in chunks.values() for chunk in vid_chunks]
+    refined_flat = iter(refiner.refine(flat))
+    refined = {vid: [next(refined_flat) for _ in vid_chunks] for vid, vid_chunks in chunks.items()}
+
+    with ThreadPoolExecutor(max_workers=refiner.concurrency) as pool:
+        reduced = dict(zip(refined, pool.map(refiner.reduce, refined.values())))
+    for video_id, error in errors.items():
+        logging.warning(f"---TRANSCRIPT {video_id} SKIPPED: {error}---")
+    return reduced, errors
+
+def ingest_videos(
+    videos: Dict[str, str],
+    vectorstore: Optional[VectorBackend] = None,
+    fetcher: TranscriptFetcher = fetch_transcript,
+    refiner: Optional[TranscriptRefiner] = None,
+    manifest_path: str = MANIFEST_PATH,
+) -> Dict[str, Any]:
+    """
+    Refine and index a batch of walkthrough videos.
+
+    Args:
+        videos (dict): Video id -> challenge name (e.g. {"KvUC7bakm-E": "fluffy"})
+        vectorstore (VectorBackend): Target store, defaults to the shared vectorstore
+        fetcher: Returns a video's transcript snippets; swap in a stub to run offline
+        refiner (TranscriptRefiner): Defaults to the local LLM with the on-disk cache
+        manifest_path (str): Ingest manifest, so unchanged transcripts are not re-embedded
+
+    Returns:
+        dict: Ingest counts, LLM calls made/cached and skipped videos
+    """
+    refiner = refiner or TranscriptRefiner()
+    transcripts, errors = refine_videos(list(videos), refiner, fetcher)
+    docs = [
+        Document(
+            page_content=text,
+            metadata={
+                "source": f"https://www.youtube.com/watch?v={video_id}",
+                "video_id": video_id,
+                "challenge_name": videos[video_id],
+            },
+        )
+        for video_id, text in transcripts.items()
+    ]
+    manifest = IngestManifest(manifest_path)
+    stats = index_incrementally(
+        vectorstore or get_vectorstore(),
+        docs,
+        RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=200),
+        manifest,
+        # Videos not in this batch stay indexed
+        known_sources=manifest.sources(),
+    )
+    return {**stats, **refiner.stats, "skipped_videos": errors}
 
-# from langchain import hub
-# prompt = hub.pull("rlm/rag-prompt")
+def parse_videos(args: Iterable[str]) -> Dict[str, str]:
+    """"VIDEO_ID=challenge" arguments (or lines) -> {video id: challenge name}."""
+    videos = {}
+    for arg in args:
+        arg = arg.strip()
+        if arg and not arg.startswith("#"):
+            video_id, _, challenge = arg.partition("=")
+            videos[video_id.strip()] = challenge.strip()
+    return videos
 
-# rag_chain = prompt | llm | to_text
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Refine YouTube walkthrough transcripts and index them.")
+    parser.add_argument("videos", nargs="*", help="VIDEO_ID=challenge_name, e.g. KvUC7bakm-E=fluffy")
+    parser.add_argument("--file", help="File with one VIDEO_ID=challenge_name per line")
+    parser.add_argument("--concurrency", type=int, default=CONCURRENCY, help="LLM calls in flight")
+    args = parser.parse_args()
 
-# # RAG generation
-# generation = rag_chain.invoke({"context": documents, "question": question})
-# print(generation)
\ No newline at end of file
+    videos = parse_videos(args.videos)
+    if args.file:
+        with open(args.file, "r", encoding="utf-8") as f:
+            videos.update(parse_videos(f))
+    if not videos:
+        parser.error("no videos given")
+    stats = ingest_videos(videos, refiner=TranscriptRefiner(concurrency=args.concurrency))
+    print(json.dumps(stats, indent=2))